@@ -0,0 +1,385 @@
+# Benchmarks for rail-network-simulator (trains.py)
+
+import json
+import os
+import platform
+import random
+import sys
+import time
+import trains as t
+
+SWEEPS = {
+    # (lines, stations per line, interchanges per line, trains, time units)
+    "quick": [(5, 20, 2, 1000, 20), (20, 50, 3, 10000, 20), (50, 100, 4, 100000, 20)],
+    "full": [(5, 20, 2, 1000, 50), (20, 50, 3, 10000, 50), (50, 100, 4, 100000, 50),
+             (100, 200, 5, 1000000, 20), (200, 1000, 8, 1000000, 20)],
+}
+
+LAYOUT_LIMIT = 2000 # spring_layout is O(V²) per iteration, so it's only timed on networks up to this many stations.
+CHECKER_LIMIT = 20000 # The original station_reachability_checker() is only timed on networks up to this many connections.
+QUERIES = 20000 # Route questions answered by the bulk benchmarks.
+
+
+def generate_network(directory, lines, stations_per_line, interchanges, seed=0):
+    '''
+    Function that writes a synthetic rail network to a stations file and a connections file.
+
+    Every line is a chain of stations_per_line stations. Every line after the first shares
+    interchanges of its stations with earlier lines, so the network is connected and has
+    stations on several lines, like a real one. The same parameters always give the same files.
+
+    Parameters: The directory to write the files to; the number of lines; the number of stations on each line;
+    the number of interchange stations on each line (after the first); and the seed.
+
+    Returns: (stations file name, connections file name, a dictionary describing the network).
+
+    '''
+    generator = random.Random(seed)
+    station_count = 0
+    stations = [] # Every station's (name, delay probability), in the order they're created.
+    connections = []
+    for line in range(lines):
+        shared = {}
+        if line and stations:
+            # Spreads the interchanges along the line, each to a different earlier station.
+            places = generator.sample(range(stations_per_line), min(interchanges, stations_per_line))
+            names = generator.sample(range(len(stations)), min(len(places), len(stations)))
+            shared = {place: stations[name][0] for place, name in zip(places, names)}
+        line_stations = []
+        for place in range(stations_per_line):
+            if place in shared:
+                line_stations.append(shared[place])
+            else:
+                name = f"S{station_count}"
+                station_count += 1
+                stations.append((name, round(generator.uniform(0, 0.2), 3)))
+                line_stations.append(name)
+        connections.extend((source, target, f"L{line}", "S") for source, target in zip(line_stations, line_stations[1:]))
+
+    stations_file = os.path.join(directory, f"stations-{lines}x{stations_per_line}.txt")
+    connections_file = os.path.join(directory, f"connections-{lines}x{stations_per_line}.txt")
+    with open(stations_file, "w") as f:
+        f.writelines(f"{name},{delay_probability}\n" for name, delay_probability in stations)
+    with open(connections_file, "w") as f:
+        f.writelines(",".join(connection) + "\n" for connection in connections)
+    return stations_file, connections_file, {"lines": lines, "stations_per_line": stations_per_line, "interchanges": interchanges,
+                                             "stations": len(stations), "connections": len(connections)}
+
+
+def route_queries(network, count, seed=0):
+    '''
+    Function that makes random route questions (start station, target station, time limit) for a network.
+
+    Parameters: A loaded RailNetwork, the number of questions and the seed.
+
+    Returns: A list of (start, target, time limit) tuples.
+
+    '''
+    generator = random.Random(seed)
+    names = list(network.stations)
+    return [(generator.choice(names), generator.choice(names), generator.randrange(1, 50)) for _ in range(count)]
+
+
+def time_best(function, repeat):
+    '''
+    Function that times a function several times.
+
+    Parameters: The function (without arguments), and how many times to run it.
+
+    Returns: (the fastest time, the mean time) in seconds.
+
+    '''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times), sum(times) / len(times)
+
+
+def loaded_network(stations_file, connections_file, engine="object"):
+    '''
+    Function that loads a network from its files.
+
+    Returns: The RailNetwork.
+
+    '''
+    network = t.RailNetwork(engine)
+    network.load_stations(stations_file)
+    network.load_connections(connections_file)
+    return network
+
+
+def benchmark_size(stations_file, connections_file, info, trains, ticks, repeat=3, only=None, seed=0):
+    '''
+    Function that times every hot path of the simulator on one network.
+
+    Parameters: The stations and connections file names; the generate_network() description of the network;
+    the number of trains; the number of time units to advance; how many times to repeat each benchmark;
+    the names of the benchmarks to run (all if None); and the seed.
+
+    Returns: A list of result dictionaries, one per benchmark ("seconds" is the fastest run,
+    and "items" is what "per_item_us" is per), or with a "skipped" reason.
+
+    Warning: Needs the numpy and matplotlib modules to work.
+
+    '''
+    import io
+
+    network = loaded_network(stations_file, connections_file)
+    network.compile()
+    queries = route_queries(network, QUERIES, seed)
+    query_file = "".join(f"{start},{target},{time_limit}\n" for start, target, time_limit in queries)
+
+    def advance(engine):
+        random.seed(seed)
+        fleet = loaded_network(stations_file, connections_file, engine)
+        fleet.add_random_trains(trains)
+        fleet.advance_time() # The array based engines build their state (and start their workers) on the first time unit.
+        return lambda: fleet.advance_ticks(ticks)
+
+    def checker():
+        few = queries[:20]
+        return lambda: [network.station_reachability_checker(start, target, time_limit, network.connections)
+                        for start, target, time_limit in few]
+
+    def layout():
+        def compute():
+            t._layout_cache.clear() # Forgets the layout, so it's computed again (and not kept on disk).
+            t.network_layout(network.connections, cache_dir="")
+        compute() # Raises ImportError here if spring_layout needs scipy for this size.
+        return compute
+
+    def cached_layout():
+        # Large networks get a random layout, because only drawing is timed here.
+        key = t.topology_hash(network.connections)
+        if key not in t._layout_cache:
+            import networkx as nx
+
+            G = nx.MultiDiGraph()
+            for source, target, line_name, direction in network.connections:
+                G.add_edge(source, target, line=line_name, direction=direction)
+            generator = random.Random(seed)
+            t._layout_cache[key] = (G, {name: (generator.uniform(-1, 1), generator.uniform(-1, 1)) for name in G})
+
+    def render():
+        cached_layout()
+        random.seed(seed)
+        fleet = loaded_network(stations_file, connections_file, "array")
+        fleet.add_random_trains(min(trains, 100000))
+        fleet.advance_time()
+        fleet.render_train_map(io.BytesIO()) # Imports matplotlib before the timing starts.
+        return lambda: fleet.render_train_map(io.BytesIO())
+
+    def generate_map():
+        import matplotlib
+        matplotlib.use("Agg") # plt.show() does nothing with a non-interactive backend.
+        import matplotlib.pyplot as plt
+
+        cached_layout()
+        random.seed(seed)
+        fleet = loaded_network(stations_file, connections_file)
+        fleet.add_random_trains(min(trains, 1000))
+        def draw():
+            fleet.generate_train_map()
+            plt.close("all")
+        draw()
+        return draw
+
+    def bulk_queries():
+        return lambda: network.answer_route_queries(io.StringIO(query_file), io.StringIO())
+
+    def reachable():
+        network.reachability()
+        few = queries[:1000]
+        return lambda: [network.station_reachable(start, target, time_limit) for start, target, time_limit in few]
+
+    def index():
+        def build():
+            network.reachability_index = None
+            network.reachability()
+        return build
+
+    def compile_network():
+        def build():
+            network.compiled = None
+            network.compile()
+        return build
+
+    def add_trains():
+        def populate():
+            random.seed(seed)
+            fleet = loaded_network(stations_file, connections_file)
+            fleet.compile()
+            fleet.add_random_trains(trains)
+        return populate
+
+    # Every benchmark: (name, items per run, function that sets it up and returns the function to time, reason to skip it).
+    benchmarks = [
+        ("load", info["connections"], lambda: lambda: loaded_network(stations_file, connections_file), None),
+        ("compile", info["stations"], compile_network, None),
+        ("reachability_index", info["stations"], index, None),
+        ("station_reachable", 1000, reachable, None),
+        ("answer_route_queries", QUERIES, bulk_queries, None),
+        ("station_reachability_checker", 20, checker,
+         f"more than {CHECKER_LIMIT} connections" if info["connections"] > CHECKER_LIMIT else None),
+        ("add_random_trains", trains, add_trains, None),
+        ("advance_time_object", trains * ticks, lambda: advance("object"), None),
+        ("advance_time_array", trains * ticks, lambda: advance("array"), None),
+        ("advance_time_event", trains * ticks, lambda: advance("event"), None),
+        ("advance_time_parallel", trains * ticks, lambda: advance("parallel"), None),
+        ("network_layout", info["stations"], layout,
+         f"more than {LAYOUT_LIMIT} stations" if info["stations"] > LAYOUT_LIMIT else None),
+        ("render_train_map", info["stations"], render, None),
+        ("generate_train_map", info["stations"], generate_map,
+         f"more than {LAYOUT_LIMIT} stations" if info["stations"] > LAYOUT_LIMIT else None),
+    ]
+
+    size = f"{info['lines']}x{info['stations_per_line']}"
+    results = []
+    for name, items, setup, skip in benchmarks:
+        if only is not None and name not in only:
+            continue
+        result = dict(info, benchmark=name, size=size, trains=trains, ticks=ticks)
+        if skip is None:
+            try:
+                best, mean = time_best(setup(), repeat)
+                result.update({"seconds": best, "mean_seconds": mean, "repeat": repeat, "items": items,
+                               "per_item_us": best / items * 1e6 if items else None})
+            except ImportError as error:
+                skip = f"needs {error.name}"
+        if skip is not None:
+            result["skipped"] = skip
+        results.append(result)
+        print(f"{size:>10} {name:<30} " + (f"{result['seconds']:10.4f} s" if "seconds" in result else f"skipped ({skip})"),
+              file=sys.stderr)
+    return results
+
+
+def environment():
+    '''
+    Function that describes the machine and code the benchmarks ran on, so results can be compared fairly.
+
+    Returns: A dictionary.
+
+    '''
+    import subprocess
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+    return {"commit": commit, "python": platform.python_version(), "numpy": numpy_version, "platform": platform.platform(),
+            "processor": platform.processor(), "cpus": os.cpu_count(), "time": time.strftime("%Y-%m-%dT%H:%M:%S%z")}
+
+
+def run_benchmarks(sizes, repeat=3, only=None, seed=0, directory=None):
+    '''
+    Function that generates networks of every size and benchmarks them.
+
+    Parameters: A list of (lines, stations per line, interchanges, trains, time units) tuples (see SWEEPS);
+    how many times to repeat each benchmark; the names of the benchmarks to run (all if None); the seed;
+    and the directory to generate the networks in (a temporary one if None).
+
+    Returns: A dictionary with the environment and the results, that can be saved as JSON.
+
+    '''
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as temporary:
+        results = []
+        for lines, stations_per_line, interchanges, trains, ticks in sizes:
+            stations_file, connections_file, info = generate_network(directory or temporary, lines, stations_per_line, interchanges, seed)
+            results.extend(benchmark_size(stations_file, connections_file, info, trains, ticks, repeat, only, seed))
+    return {"environment": environment(), "seed": seed, "results": results}
+
+
+def compare(baseline, current, threshold=1.1):
+    '''
+    Function that compares two sets of benchmark results (for example, from two commits).
+
+    Parameters: The run_benchmarks() dictionaries to compare, and the ratio of
+    current / baseline time above which a benchmark counts as slower.
+
+    Returns: A list of (benchmark, size, baseline seconds, current seconds, ratio, slower) tuples
+    for the benchmarks that ran in both on the same network, trains and time units.
+
+    '''
+    def key(result):
+        return result["benchmark"], result["size"], result["interchanges"], result["trains"], result["ticks"]
+
+    before = {key(result): result for result in baseline["results"] if "seconds" in result}
+    rows = []
+    for result in current["results"]:
+        old = before.get(key(result))
+        if old is not None and "seconds" in result:
+            ratio = result["seconds"] / old["seconds"] if old["seconds"] else float("inf")
+            rows.append((result["benchmark"], result["size"], old["seconds"], result["seconds"], ratio, ratio > threshold))
+    return rows
+
+
+def command_line(arguments):
+    '''
+    Function that runs the benchmarks from the command line, for example:
+    "python benchtrains.py run --sweep quick -o results.json" and
+    "python benchtrains.py compare before.json results.json".
+
+    Parameter: The command line arguments (without the program name).
+
+    Returns: The exit code (1 if compare found a slower benchmark).
+
+    '''
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="benchtrains.py", description="Benchmarks for the rail network simulator.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="generate synthetic networks and time every hot path on them")
+    run.add_argument("--sweep", choices=SWEEPS, default="quick", help="sizes to run (default: quick)")
+    run.add_argument("--lines", type=int, help="run one size with this many lines instead of a sweep")
+    run.add_argument("--stations-per-line", type=int, default=100, help="stations on each line (with --lines, default: 100)")
+    run.add_argument("--interchanges", type=int, default=3, help="stations each line shares with others (with --lines, default: 3)")
+    run.add_argument("--trains", type=int, default=10000, help="number of trains (with --lines, default: 10000)")
+    run.add_argument("--ticks", type=int, default=20, help="time units to advance (with --lines, default: 20)")
+    run.add_argument("--repeat", type=int, default=3, help="times to run each benchmark, keeping the fastest (default: 3)")
+    run.add_argument("--only", help="comma separated names of the benchmarks to run (default: all)")
+    run.add_argument("--seed", type=int, default=0, help="seed for the networks, trains and questions (default: 0)")
+    run.add_argument("-o", "--output", default="-", help="results JSON file (default: standard output)")
+
+    comparison = commands.add_parser("compare", help="compare two results files")
+    comparison.add_argument("baseline")
+    comparison.add_argument("current")
+    comparison.add_argument("--threshold", type=float, default=1.1, help="time ratio that counts as slower (default: 1.1)")
+
+    args = parser.parse_args(arguments)
+    if args.command == "run":
+        if args.lines is not None:
+            sizes = [(args.lines, args.stations_per_line, args.interchanges, args.trains, args.ticks)]
+        else:
+            sizes = SWEEPS[args.sweep]
+        only = set(args.only.split(",")) if args.only else None
+        results = run_benchmarks(sizes, args.repeat, only, args.seed)
+        with t.open_text(sys.stdout if args.output == "-" else args.output, "w") as output:
+            json.dump(results, output, indent=2)
+            output.write("\n")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    rows = compare(baseline, current, args.threshold)
+    print(f"{'benchmark':<30} {'size':>10} {'before (s)':>12} {'after (s)':>12} {'ratio':>7}")
+    for name, size, old, new, ratio, slower in rows:
+        print(f"{name:<30} {size:>10} {old:12.4f} {new:12.4f} {ratio:7.2f}" + (" slower" if slower else ""))
+    return 1 if any(row[5] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(command_line(sys.argv[1:]))
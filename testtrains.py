@@ -48,6 +48,66 @@ class TestRailNetwork(unittest.TestCase):
         self.assertEqual(network.lines["red"].stations["D"].name, "D")
     
 
+    def test_load_errors(self):
+        '''
+        Function that tests that load_stations() and load_connections() report every malformed line.
+        
+        '''
+        import os
+        import tempfile
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        network = t.RailNetwork()
+        stations_file = os.path.join(directory.name, "stations.txt")
+        with open(stations_file, "w") as f:
+            f.write("A,0.666\nB,lots\n\nC,0.05,extra\nA,0.1\nD,1.5\nE,0.2\n")
+        with self.assertRaises(t.NetworkFileError) as error:
+            network.load_stations(stations_file)
+        self.assertEqual([line_number for line_number, _ in error.exception.problems], [2, 4, 5, 6])
+        self.assertEqual(error.exception.problem_count, 4)
+        self.assertIn("line 6", str(error.exception))
+        self.assertEqual(network.stations, {}) # Nothing is loaded from a malformed file.
+
+        with open(stations_file, "w") as f:
+            f.write("A,0.666\nB,0.187\n\nC,0.05\nD,0.69\n")
+        network.load_stations(stations_file)
+        self.assertEqual(list(network.stations), ["A", "B", "C", "D"])
+        connections_name = os.path.join(directory.name, "connections.txt")
+        with open(connections_name, "w") as test:
+            test.write("A,B,red,N\nB,Meme,red,E\nC,D,,S\nC,D\n")
+        with self.assertRaises(t.NetworkFileError) as error:
+            network.load_connections(connections_name)
+        self.assertEqual([line_number for line_number, _ in error.exception.problems], [2, 3, 4])
+        self.assertIn("'Meme'", error.exception.problems[0][1])
+        self.assertEqual(network.lines, {})
+        self.assertEqual(network.connections, [])
+        with self.assertRaises(FileNotFoundError):
+            network.load_connections("no_such_file.txt")
+
+
+    def test_network_layout(self):
+        '''
+        Function that tests network_layout().
+        
+        '''
+        import tempfile
+        from unittest import mock
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        connections = [("A", "B", "blue", "S"), ("B", "C", "blue", "S"), ("X", "B", "green", "S")]
+        G, position = t.network_layout(connections, directory.name)
+        self.assertEqual(set(position), {"A", "B", "C", "X"})
+        self.assertEqual(G.number_of_edges(), 3)
+
+        # The same topology is reused from memory, and from disk in a new process, without a new layout.
+        with mock.patch("networkx.spring_layout", side_effect=AssertionError("layout recomputed")):
+            self.assertIs(t.network_layout(connections, directory.name)[1], position)
+            t._layout_cache.clear()
+            self.assertEqual(t.network_layout(connections, directory.name)[1], position)
+        # A changed topology gets a new layout.
+        self.assertIn("Y", t.network_layout(connections + [("C", "Y", "blue", "S")], directory.name)[1])
+
+
     def test_station_reachability_checker(self):
         '''
         Function that tests station_reachability_checker().
@@ -89,5 +149,997 @@ class TestRailNetwork(unittest.TestCase):
         self.assertFalse(network.station_reachability_checker("X", "Z", 2, test_connections))
 
 
+    def test_station_trains(self):
+        '''
+        Function that tests adding and removing trains at a station, and that the objects are slotted.
+        
+        '''
+        station = t.Station("Hej", 0.666)
+        line = t.Line("red")
+        trains = [t.Train(station, "North", line, i, False) for i in range(1, 6)]
+        for train in trains:
+            station.add_train(train)
+        station.remove_train(trains[2])
+        self.assertEqual(list(station.trains), [trains[0], trains[1], trains[3], trains[4]])
+        self.assertNotIn(trains[2], station.trains)
+        self.assertEqual(str(station), "Station Hej with delay probability 0.666 and 4 trains")
+        with self.assertRaises(KeyError):
+            station.remove_train(trains[2])
+        for obj in (station, line, trains[0]):
+            self.assertFalse(hasattr(obj, "__dict__"))
+        budget = t.train_memory_budget("stations.txt", "connections.txt", 1000)
+        self.assertLess(budget["array_bytes_per_train"], budget["object_bytes_per_train"])
+    
+
+    def test_station_reachable(self):
+        '''
+        Function that tests station_reachable() and ReachabilityIndex against station_reachability_checker().
+        
+        '''
+        network = t.RailNetwork()
+        network.load_stations("stations.txt")
+        network.load_connections("connections.txt")
+        connections = network.station_reachability_checker_file_opener("connections.txt")
+        # The same answers with the distance matrix and with cached BFS trees.
+        tree_index = t.ReachabilityIndex(network.compile(), matrix_limit=0, cache_size=2)
+        self.assertIsNotNone(network.reachability().matrix)
+        self.assertIsNone(tree_index.matrix)
+        names = list(network.stations) + ["Meme"]
+        for start in names:
+            for target in names:
+                for time_limit in range(-1, 6):
+                    expected = network.station_reachability_checker(start, target, time_limit, connections)
+                    self.assertEqual(network.station_reachable(start, target, time_limit), expected)
+                    self.assertEqual(tree_index.reachable(start, target, time_limit), expected)
+        self.assertLessEqual(len(tree_index.trees), 2)
+        self.assertFalse(network.station_reachable("A", "X", 3))
+        self.assertTrue(network.station_reachable("A", "Z", 3))
+    
+
+    def test_answer_route_queries(self):
+        '''
+        Function that tests answer_route_queries() with CSV and JSONL questions.
+        
+        '''
+        import io
+        import json
+        network = t.RailNetwork()
+        network.load_stations("stations.txt")
+        network.load_connections("connections.txt")
+        questions = "start,target,time_limit\nA,B,1\nA,B,0\nA,X,3\nA,Z,3\nMeme,Meme,0\nA,Meme,10000\n"
+        answers = io.StringIO()
+        self.assertEqual(network.answer_route_queries(io.StringIO(questions), answers, chunk_size=4), 6)
+        self.assertEqual(answers.getvalue().splitlines(), 
+                         ["A,B,1,True", "A,B,0,False", "A,X,3,False", "A,Z,3,True", "Meme,Meme,0,True", "A,Meme,10000,False"])
+        
+        questions = '{"start": "X", "target": "Z", "time_limit": 2}\n{"start": "X", "target": "Z", "time_limit": 3}\n'
+        answers = io.StringIO()
+        network.answer_route_queries(io.StringIO(questions), answers, jsonl=True)
+        self.assertEqual([json.loads(line)["reachable"] for line in answers.getvalue().splitlines()], [False, True])
+
+        # Invalid questions.
+        with self.assertRaises(ValueError):
+            network.answer_route_queries(io.StringIO("A,B\n"), io.StringIO())
+        with self.assertRaises(ValueError):
+            network.answer_route_queries(io.StringIO("A,B,1\nA,B,soon\n"), io.StringIO())
+    
+
+    def test_advance_time_array_engine(self):
+        '''
+        Function that tests the array engine of advance_time() against the object engine.
+        
+        '''
+        networks = []
+        for engine in ("object", "array"):
+            network = t.RailNetwork(engine)
+            stations_file = "test_stations2.txt"
+            with open(stations_file, "w") as f:
+                f.write("A,0\nB,0\nC,0\nD,0\n")
+            network.load_stations(stations_file)
+            connections_name = "test_connections.txt"
+            with open(connections_name, "w") as test:
+                test.write("A,B,red,N\nB,C,red,E\nC,D,red,S\n")
+            network.load_connections(connections_name)
+            for i, (station_name, direction) in enumerate([("A", "North"), ("B", "North"), ("C", "South"), ("D", "South")]):
+                station = network.stations[station_name]
+                train = t.Train(station, direction, network.lines["red"], i+1, False)
+                network.add_train(train, i+1)
+                station.add_train(train)
+            networks.append(network)
+        object_network, array_network = networks
+
+        # Without delays both engines have to move the trains the same way.
+        for _ in range(7):
+            object_network.advance_time()
+            array_network.advance_time()
+            for train_id in range(1, 5):
+                object_train = object_network.get_train(train_id)
+                array_train = array_network.get_train(train_id)
+                self.assertEqual(object_train.station.name, array_train.station.name)
+                self.assertEqual(object_train.direction, array_train.direction)
+        array_network.sync_trains()
+        self.assertEqual(sorted(len(s.trains) for s in array_network.stations.values()), 
+                         sorted(len(s.trains) for s in object_network.stations.values()))
+
+        # A station that always delays keeps its trains.
+        array_network.stations["A"].delay_probability = 1
+        array_network.set_engine("object")
+        array_network.set_engine("array")
+        trains_at_a = [train.train_id for train in array_network.stations["A"].trains]
+        array_network.advance_time()
+        for train_id in trains_at_a:
+            self.assertEqual(array_network.get_train(train_id).station.name, "A")
+            self.assertTrue(array_network.get_train(train_id).train_delayed)
+        with self.assertRaises(ValueError):
+            array_network.set_engine("warp")
+
+
+    def test_advance_time_event_engine(self):
+        '''
+        Function that tests the event engine of advance_time() and advance_ticks() against the other engines.
+        
+        '''
+        import random
+        def network(engine, delays=True):
+            random.seed(666)
+            network = t.RailNetwork(engine)
+            network.load_stations("stations.txt")
+            network.load_connections("connections.txt")
+            if not delays:
+                for station in network.stations.values():
+                    station.delay_probability = 0
+            network.add_random_trains(30)
+            return network
+
+        # Without delays it has to move the trains the same way as the object engine.
+        object_network, event_network = network("object", False), network("event", False)
+        for _ in range(9):
+            object_network.advance_time()
+            event_network.advance_time()
+            self.assertEqual(event_network.train_states(), object_network.train_states())
+
+        # Jumping ahead gives the same result as one time unit at a time.
+        stepped, jumped = network("event"), network("event")
+        random.seed(1)
+        for _ in range(25):
+            stepped.advance_time()
+        random.seed(1)
+        jumped.advance_ticks(25)
+        self.assertEqual(jumped.tick, 25)
+        self.assertEqual(jumped.train_states(), stepped.train_states())
+        self.assertEqual(jumped.delayed_count(), stepped.delayed_count())
+
+        # Trains get delayed as often as with the array engine.
+        rates = {}
+        for engine in ("array", "event"):
+            fleet = network(engine)
+            fleet.add_random_trains(2000)
+            delayed = 0
+            for _ in range(100):
+                fleet.advance_time()
+                delayed += fleet.delayed_count()
+            rates[engine] = delayed / (100 * fleet.train_count())
+        self.assertAlmostEqual(rates["event"], rates["array"], delta=0.01)
+
+        # A station that always delays keeps its trains, and switching engines keeps the state.
+        fleet = network("event")
+        fleet.stations["A"].delay_probability = 1
+        fleet.set_engine("object")
+        fleet.set_engine("event")
+        trains_at_a = [train.train_id for train in fleet.stations["A"].trains]
+        fleet.advance_ticks(10)
+        for train_id in trains_at_a:
+            self.assertEqual(fleet.get_train(train_id).station.name, "A")
+            self.assertTrue(fleet.get_train(train_id).train_delayed)
+        states = fleet.train_states()
+        fleet.set_engine("array")
+        self.assertEqual(fleet.train_states(), states)
+
+
+    def test_advance_time_parallel_engine(self):
+        '''
+        Function that tests the parallel engine of advance_time() and advance_ticks() with two worker processes.
+        
+        '''
+        import random
+        def network(engine, delays=True):
+            random.seed(666)
+            network = t.RailNetwork(engine, workers=2)
+            network.load_stations("stations.txt")
+            network.load_connections("connections.txt")
+            if not delays:
+                for station in network.stations.values():
+                    station.delay_probability = 0
+            network.add_random_trains(200)
+            return network
+
+        # Without delays it has to move the trains the same way as the object engine.
+        object_network, parallel_network = network("object", False), network("parallel", False)
+        for _ in range(9):
+            object_network.advance_time()
+            parallel_network.advance_time()
+            self.assertEqual(parallel_network.train_states(), object_network.train_states())
+
+        # Every line is in exactly one partition, and the workers step the shared arrays in place.
+        fleet = network("parallel")
+        fleet.advance_time()
+        stepper = fleet.parallel
+        self.assertEqual(sorted(sum(stepper.partition_lines, [])), list(range(len(fleet.lines))))
+        for lines, (start, stop) in zip(stepper.partition_lines, stepper.partitions):
+            self.assertTrue(set(fleet.train_arrays.line[start:stop].tolist()) <= set(lines))
+        self.assertIs(stepper.pool is None, len(stepper.partitions) == 1)
+        positions = fleet.train_arrays.position.copy()
+        fleet.advance_ticks(5)
+        self.assertIs(fleet.parallel, stepper)
+        self.assertEqual(fleet.tick, 6)
+        self.assertFalse((fleet.train_arrays.position == positions).all())
+        fleet.sync_trains()
+        self.assertEqual(fleet.station_occupancy().tolist(),
+                         [len(station.trains) for station in map(fleet.stations.get, fleet.compile().station_names)])
+        self.assertEqual(fleet.station_occupancy().sum(), 200)
+
+        # Statistics add up the workers' counts.
+        stats = fleet.enable_stats()
+        fleet.advance_ticks(4)
+        self.assertEqual(stats.counters["moved"] + stats.counters["delayed"], 800)
+
+        # Switching engines keeps the state and frees the shared memory.
+        states = fleet.train_states()
+        fleet.set_engine("array")
+        self.assertIsNone(fleet.parallel)
+        self.assertEqual(fleet.train_states(), states)
+        fleet.advance_time()
+        fleet.set_engine("parallel", workers=2)
+        line = next(line for line in fleet.lines.values() if "A" in line.stations)
+        train = t.Train(fleet.stations["A"], "North", line, 1000, False)
+        fleet.stations["A"].add_train(train)
+        fleet.add_train(train, 1000)
+        fleet.advance_time()
+        self.assertEqual(fleet.train_count(), 201)
+        fleet.close_parallel()
+
+
+    def test_snapshot(self):
+        '''
+        Function that tests snapshot() while another thread advances time.
+        
+        '''
+        import random
+        import threading
+        import numpy as np
+        for engine in t.RailNetwork.ENGINES:
+            random.seed(666)
+            network = t.RailNetwork(engine, workers=1)
+            network.load_stations("stations.txt")
+            network.load_connections("connections.txt")
+            network.add_random_trains(100)
+            first = network.snapshot()
+            self.assertEqual(first.tick, 0)
+            self.assertEqual([first.train_state(train_id) for train_id in range(1, 101)], network.train_states())
+            kept = first.position.copy()
+
+            # Readers see whole time units, however far the simulation has got.
+            stepper = threading.Thread(target=network.advance_ticks, args=(200,))
+            stepper.start()
+            ticks = []
+            while stepper.is_alive() or not ticks or ticks[-1] < 200:
+                snapshot = network.snapshot()
+                self.assertEqual(snapshot.occupancy().sum(), 100)
+                ticks.append(snapshot.tick)
+            stepper.join()
+            self.assertEqual(ticks, sorted(ticks))
+            self.assertEqual(network.snapshot().tick, 200)
+            self.assertEqual([network.snapshot().train_state(train_id) for train_id in range(1, 101)], network.train_states())
+
+            # A kept snapshot never changes, and can't be changed.
+            self.assertTrue((first.position == kept).all())
+            with self.assertRaises(ValueError):
+                first.position[0] = 0
+            network.close_parallel()
+
+        # Buffers nobody reads any more are reused instead of allocating new ones.
+        address = lambda: network.snapshot().position.__array_interface__["data"][0]
+        network.advance_time()
+        before = address()
+        network.advance_time()
+        network.advance_time()
+        self.assertEqual(address(), before)
+        kept = network.snapshot()
+        network.advance_time()
+        network.advance_time()
+        self.assertFalse(np.shares_memory(network.snapshot().position, kept.position))
+
+
+    def test_occupancy_index(self):
+        '''
+        Function that tests occupancy_index() and its queries against counting every train.
+        
+        '''
+        import random
+        from collections import Counter
+        for engine in t.RailNetwork.ENGINES:
+            random.seed(666)
+            network = t.RailNetwork(engine, workers=1)
+            network.load_stations("stations.txt")
+            network.load_connections("connections.txt")
+            network.add_random_trains(300)
+            index = network.occupancy_index()
+            for tick in range(30):
+                if tick == 10:
+                    # New trains make it count again.
+                    line = next(line for line in network.lines.values() if "A" in line.stations)
+                    train = t.Train(network.stations["A"], "North", line, 1000, True)
+                    network.add_train(train, 1000)
+                    network.stations["A"].add_train(train)
+                network.advance_ticks(1 + tick % 3)
+                states = network.train_states()
+                per_station = Counter(state["station"] for state in states)
+                for name in network.stations:
+                    self.assertEqual(sorted(network.trains_at(name)),
+                                     sorted(state["train_id"] for state in states if state["station"] == name))
+                self.assertEqual(network.station_occupancy().tolist(), [per_station[name] for name in network.compile().station_names])
+                self.assertEqual(sorted(network.delayed_trains()), sorted(state["train_id"] for state in states if state["delayed"]))
+                self.assertEqual(network.occupancy.delayed_total, network.delayed_count())
+                for line in network.lines:
+                    on_line = [state for state in states if state["line"] == line]
+                    self.assertEqual(network.line_delayed_count(line), sum(state["delayed"] for state in on_line))
+                    self.assertEqual(sorted(network.delayed_trains(line)), sorted(state["train_id"] for state in on_line if state["delayed"]))
+                    self.assertEqual(network.line_occupancy(line), [(station, sum(state["station"] == station for state in on_line))
+                                                                    for station in network.lines[line].stations])
+                busiest = network.busiest_stations(3)
+                self.assertEqual([count for _, count in busiest], sorted(per_station.values(), reverse=True)[:3])
+                self.assertTrue(all(per_station[name] == count for name, count in busiest))
+            self.assertEqual(network.train_count(), 301)
+            network.close_parallel()
+        with self.assertRaises(KeyError):
+            network.trains_at("Nowhere")
+
+
+    def test_delay_stats(self):
+        '''
+        Function that tests RunningMoments, DwellSketch and enable_delay_stats() with every engine.
+        
+        '''
+        import math
+        import random
+        import numpy as np
+
+        # Merging batches (counted or sorted) gives the same moments as computing them from every sample.
+        generator = np.random.default_rng(666)
+        groups = generator.integers(0, 50, 3000)
+        values = generator.geometric(0.3, 3000)
+        moments = t.RunningMoments(50)
+        for start in range(0, 3000, 997):
+            moments.add(groups[start:start + 997], values[start:start + 997])
+        for size in (1, 2, 3):
+            moments.add(groups[:size], values[:size])
+        groups, values = np.concatenate([groups, groups[:1], groups[:2], groups[:3]]), np.concatenate([values, values[:1], values[:2], values[:3]])
+        for group in range(50):
+            samples = values[groups == group]
+            self.assertEqual(moments.count[group], len(samples))
+            self.assertEqual(moments.total[group], samples.sum())
+            self.assertEqual(moments.max[group], samples.max())
+            self.assertAlmostEqual(moments.mean[group], samples.mean())
+            self.assertAlmostEqual(moments.variance()[group], samples.var(ddof=1))
+
+        # The sketch's quantiles are exact for small values and within a quarter of the true ones after that.
+        samples = generator.integers(1, 10 ** 6, 10000)
+        sketch = t.DwellSketch(2)
+        sketch.add(np.zeros(len(samples), dtype=np.int64), samples)
+        sketch.add([1, 1, 1], [3, 3, 7])
+        quantiles = sketch.quantiles((0.5, 0.9, 1.0))
+        for estimate, exact in zip(quantiles[0], np.quantile(samples, (0.5, 0.9, 1.0))):
+            self.assertLess(abs(estimate - exact) / exact, 0.25)
+        self.assertEqual(quantiles[1].tolist(), [3, 7, 7])
+
+        def network(engine):
+            random.seed(666)
+            network = t.RailNetwork(engine, workers=1)
+            network.load_stations("stations.txt")
+            network.load_connections("connections.txt")
+            network.add_random_trains(500)
+            return network
+
+        # Counting every train's stays one time unit at a time gives the same numbers.
+        fleet = network("object")
+        fleet.enable_delay_stats()
+        arrived = {state["train_id"]: (state["station"], 0) for state in fleet.train_states()}
+        dwells = {name: [] for name in fleet.stations}
+        for tick in range(1, 41):
+            fleet.advance_time()
+            for state in fleet.train_states():
+                if not state["delayed"]:
+                    station, since = arrived[state["train_id"]]
+                    dwells[station].append(tick - since)
+                    arrived[state["train_id"]] = (state["station"], tick)
+        summary = fleet.delay_summary(trains=True)
+        self.assertEqual(summary["ticks"], 40)
+        self.assertEqual(summary["train_ticks"], 500 * 40)
+        for name, station in summary["stations"].items():
+            finished = dwells[name]
+            waiting = sum(40 - since for at, since in arrived.values() if at == name)
+            self.assertEqual(station["dwell"]["count"], len(finished))
+            self.assertEqual(station["train_ticks"], sum(finished) + waiting)
+            self.assertEqual(station["delays"], sum(finished) + waiting - len(finished))
+            if len(finished) > 1:
+                self.assertAlmostEqual(station["dwell"]["mean"], np.mean(finished))
+                self.assertAlmostEqual(station["dwell"]["variance"], np.var(finished, ddof=1))
+        self.assertEqual(sum(train["dwells"] for train in summary["trains"].values()), sum(map(len, dwells.values())))
+
+        # Every engine observes the configured delay probabilities.
+        for engine in t.RailNetwork.ENGINES:
+            fleet = network(engine)
+            fleet.enable_delay_stats()
+            fleet.advance_ticks(200)
+            summary = fleet.delay_summary()
+            self.assertEqual(summary["train_ticks"], 500 * 200)
+            for name, station in summary["stations"].items():
+                if station["train_ticks"] > 1000 and 0 < station["configured_probability"] < 1:
+                    self.assertLess(abs(station["z_score"]), 5, (engine, name))
+                    self.assertAlmostEqual(station["dwell"]["mean"], 1 / (1 - station["configured_probability"]), delta=0.5)
+            fleet.close_parallel()
+
+        # The event engine counts the same when it jumps as when it steps.
+        stepped, jumped = network("event"), network("event")
+        for fleet in (stepped, jumped):
+            fleet.enable_delay_stats()
+        random.seed(1)
+        for _ in range(60):
+            stepped.advance_time()
+        random.seed(1)
+        jumped.advance_ticks(60)
+        def rounded(value):
+            # Batches of different sizes round the means and variances differently.
+            if isinstance(value, dict):
+                return {key: rounded(item) for key, item in value.items()}
+            return round(value, 9) if isinstance(value, float) else value
+        self.assertEqual(rounded(jumped.delay_summary(trains=True)), rounded(stepped.delay_summary(trains=True)))
+
+
+    def test_compile(self):
+        '''
+        Function that tests compile() and CompiledNetwork.
+        
+        '''
+        network = t.RailNetwork()
+        stations_file = "test_stations2.txt"
+        with open(stations_file, "w") as f:
+            f.write("A,0.666\nB,0.187\nC,0.05\nD,0.69\n")
+        network.load_stations(stations_file)
+        connections_name = "test_connections.txt"
+        with open(connections_name, "w") as test:
+            test.write("A,B,red,N\nB,C,red,E\nC,D,red,S\nB,D,blue,S\n")
+        network.load_connections(connections_name)
+        compiled = network.compile()
+        self.assertIs(compiled, network.compile()) # Cached until the network changes.
+        b = compiled.station_ids["B"]
+        red = compiled.line_ids["red"]
+        blue = compiled.line_ids["blue"]
+        # Checks the order of the stations on the lines, and the reverse position map.
+        self.assertEqual([compiled.station_names[compiled.station_at(red, i)] for i in range(compiled.line_lengths[red])], ["A", "B", "C", "D"])
+        self.assertEqual(compiled.position(red, b), 1)
+        self.assertEqual(compiled.position(blue, b), 0)
+        self.assertEqual(sorted(compiled.lines_of(b)), sorted([red, blue]))
+        self.assertEqual(sorted(compiled.station_names[s] for s in compiled.neighbours_of(b)), ["A", "C", "D"])
+        # Checks that it can't be changed.
+        with self.assertRaises(AttributeError):
+            compiled.station_names = ()
+        with self.assertRaises(ValueError):
+            compiled.neighbours[0] = 1
+        network.add_station(t.Station("E", 0.1))
+        self.assertIsNot(compiled, network.compile())
+
+
+    def test_run_headless(self):
+        '''
+        Function that tests run_headless().
+        
+        '''
+        import io
+        import json
+        for engine in t.RailNetwork.ENGINES:
+            output = io.StringIO()
+            tick_log = io.StringIO()
+            network, summary = t.run_headless("stations.txt", "connections.txt", 30, 12, seed=666, engine=engine, output=output, tick_log=tick_log)
+            self.assertEqual(summary["tick"], 12)
+            self.assertEqual(summary["trains"], 30)
+            self.assertEqual(sum(summary["trains_per_station"].values()), 30)
+            saved = json.loads(output.getvalue())
+            self.assertEqual(len(saved["final_state"]), 30)
+            self.assertEqual([json.loads(line)["tick"] for line in tick_log.getvalue().splitlines()], list(range(1, 13)))
+            # The same seed gives the same run.
+            again = t.run_headless("stations.txt", "connections.txt", 30, 12, seed=666, engine=engine)[0]
+            self.assertEqual(network.train_states(), again.train_states())
+    
+
+    def test_simulation_server(self):
+        '''
+        Function that tests SimulationServer with concurrent clients over TCP and a UNIX socket.
+        
+        '''
+        import asyncio
+        import json
+        import os
+        import random
+        import tempfile
+        random.seed(666)
+        network = t.RailNetwork("array")
+        network.load_stations("stations.txt")
+        network.load_connections("connections.txt")
+        network.add_random_trains(50)
+        network.enable_stats()
+        server = t.SimulationServer(network, interval=0.001)
+
+        async def ask(reader, writer, request):
+            writer.write((json.dumps(request) + "\n").encode())
+            await writer.drain()
+            return json.loads(await reader.readline())
+
+        async def client(connect, number):
+            reader, writer = await connect()
+            answers = [await ask(reader, writer, {"id": number, "op": "train", "train_id": 1 + number}),
+                       await ask(reader, writer, {"id": number, "op": "route", "start": "A", "target": "A", "time_limit": 0}),
+                       await ask(reader, writer, {"id": number, "op": "train", "train_id": 1000})]
+            writer.write(b"not json\n")
+            answers.append(json.loads(await reader.readline()))
+            writer.close()
+            return answers
+
+        async def session(directory):
+            tcp = await server.start()
+            port = tcp.sockets[0].getsockname()[1]
+            unix = await server.start(path=os.path.join(directory, "rail.sock"))
+            # Time runs in the background while clients ask questions.
+            while network.tick < 3:
+                await asyncio.sleep(0.001)
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            paused = await ask(reader, writer, {"op": "pause"})
+            self.assertFalse(paused["result"]["running"])
+            tick = network.tick
+            self.assertEqual((await ask(reader, writer, {"id": "a", "op": "advance", "ticks": 5}))["result"], tick + 5)
+            answers = await asyncio.gather(*[client(lambda: asyncio.open_connection("127.0.0.1", port), i) for i in range(5)],
+                                           *[client(lambda: asyncio.open_unix_connection(os.path.join(directory, "rail.sock")), i) for i in range(5, 10)])
+            stats = await ask(reader, writer, {"op": "stats"})
+            at_a = await ask(reader, writer, {"op": "station", "station": "A"})
+            busiest = await ask(reader, writer, {"op": "busiest", "count": 2})
+            self.assertEqual(at_a["result"], network.trains_at("A"))
+            self.assertEqual(busiest["result"], [list(pair) for pair in network.busiest_stations(2)])
+            unknown = await ask(reader, writer, {"id": 7, "op": "explode"})
+            writer.close()
+            server.task.cancel()
+            for listener in (tcp, unix):
+                listener.close()
+                await listener.wait_closed()
+            return answers, stats, unknown
+
+        with tempfile.TemporaryDirectory() as directory:
+            answers, stats, unknown = asyncio.run(session(directory))
+        for number, (train, route, missing, invalid) in enumerate(answers):
+            self.assertEqual(train, {"id": number, "result": network.train_state(1 + number)})
+            self.assertEqual(route, {"id": number, "result": True})
+            self.assertIn("error", missing)
+            self.assertIn("error", invalid)
+        self.assertEqual(stats["result"]["counters"]["ticks"], network.tick)
+        self.assertEqual(unknown["id"], 7)
+        self.assertIn("explode", unknown["error"])
+        self.assertEqual(network.train_states()[:10], [network.train_state(train_id) for train_id in range(1, 11)])
+
+
+    def test_render_train_map(self):
+        '''
+        Function that tests render_train_map() in full detail and at a lower level of detail.
+        
+        '''
+        import io
+        import os
+        import tempfile
+        from unittest import mock
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with mock.patch.object(t, "LAYOUT_CACHE_DIR", directory.name):
+            for engine in t.RailNetwork.ENGINES:
+                network = t.run_headless("stations.txt", "connections.txt", 30, 5, seed=666, engine=engine)[0]
+                image = io.BytesIO()
+                network.render_train_map(image)
+                self.assertTrue(image.getvalue().startswith(b"\x89PNG"))
+                # Only the 2 busiest stations are labelled when there are more than 3 stations.
+                with mock.patch("matplotlib.axes.Axes.text") as text:
+                    network.render_train_map(os.path.join(directory.name, "map.svg"), label_limit=3, busiest=2)
+                self.assertEqual(text.call_count, 2)
+                self.assertTrue(text.call_args_list[0].args[2].endswith("trains"))
+            self.assertTrue(os.listdir(directory.name)) # The layout was cached in the cache directory.
+
+
+    def test_export_animation(self):
+        '''
+        Function that tests export_animation() with PNG frames, a GIF and a missing video encoder.
+        
+        '''
+        import os
+        import tempfile
+        from unittest import mock
+        from PIL import Image
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with mock.patch.object(t, "LAYOUT_CACHE_DIR", directory.name):
+            network = t.run_headless("stations.txt", "connections.txt", 30, 0, seed=666)[0]
+            frames = os.path.join(directory.name, "frames")
+            self.assertEqual(network.export_animation(frames, 6, every=2, workers=1), 4)
+            self.assertEqual(network.tick, 6)
+            self.assertEqual(sorted(os.listdir(frames)), [f"frame-{frame:06d}.png" for frame in range(4)])
+            # Every frame has the same size, so they can be put together.
+            self.assertEqual({Image.open(os.path.join(frames, file)).size for file in os.listdir(frames)}, {(1000, 1000)})
+
+            # Frames rendered by worker processes, at a lower level of detail, put together into a GIF.
+            gif = os.path.join(directory.name, "map.gif")
+            self.assertEqual(network.export_animation(gif, 3, workers=2, dpi=50, label_limit=3), 4)
+            with Image.open(gif) as image:
+                self.assertEqual((image.n_frames, image.size), (4, (500, 500)))
+            self.assertEqual(network.tick, 9)
+
+            # A video needs ffmpeg, which is checked before simulating anything.
+            with mock.patch("shutil.which", return_value=None):
+                with self.assertRaises(ValueError):
+                    network.export_animation(os.path.join(directory.name, "map.mp4"), 3)
+            self.assertEqual(network.tick, 9)
+    
+
+    def test_lazy_imports(self):
+        '''
+        Function that tests that importing trains doesn't load the plotting libraries or numpy.
+        
+        '''
+        import os
+        import subprocess
+        import sys
+        check = "import sys, trains; print(sorted({'matplotlib', 'networkx', 'numpy', 'unittest'} & set(sys.modules)))"
+        result = subprocess.run([sys.executable, "-c", check], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(result.stdout.strip(), "[]")
+
+
+    def test_benchmarks(self):
+        '''
+        Function that tests the synthetic network generator and benchmark runner in benchtrains.py.
+        
+        '''
+        import tempfile
+        import benchtrains
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        stations_file, connections_file, info = benchtrains.generate_network(directory.name, 4, 10, 2, seed=3)
+        self.assertEqual(info["connections"], 4 * 9)
+        self.assertEqual(info["stations"], 4 * 10 - 3 * 2) # Every line after the first shares 2 stations.
+        with open(stations_file) as f, open(connections_file) as g:
+            files = f.read(), g.read()
+        benchtrains.generate_network(directory.name, 4, 10, 2, seed=3)
+        with open(stations_file) as f, open(connections_file) as g:
+            self.assertEqual((f.read(), g.read()), files) # The same seed gives the same network.
+        network = benchtrains.loaded_network(stations_file, connections_file)
+        self.assertEqual(len(network.lines), 4)
+        compiled = network.compile()
+        self.assertTrue(any(len(compiled.lines_of(i)) > 1 for i in range(len(compiled.station_names)))) # Interchanges.
+
+        results = benchtrains.run_benchmarks([(4, 10, 2, 50, 3)], repeat=1, only={"load", "advance_time_array", "network_layout"})
+        self.assertEqual([result["benchmark"] for result in results["results"]], ["load", "advance_time_array", "network_layout"])
+        self.assertEqual(results["results"][1]["items"], 50 * 3)
+        rows = benchtrains.compare(results, results)
+        self.assertEqual([(row[0], row[4], row[5]) for row in rows][:2], [("load", 1.0, False), ("advance_time_array", 1.0, False)])
+
+
+    def test_stats(self):
+        '''
+        Function that tests enable_stats() and SimulationStats with both engines.
+        
+        '''
+        import io
+        import json
+        for engine in t.RailNetwork.ENGINES:
+            network = t.run_headless("stations.txt", "connections.txt", 40, 3, seed=666, engine=engine)[0]
+            self.assertIsNone(network.stats)
+            stats = network.enable_stats()
+            self.assertIs(network.enable_stats(), stats)
+            delayed = 0
+            for _ in range(5):
+                network.advance_time()
+                delayed += network.delayed_count()
+            snapshot = stats.snapshot()
+            self.assertEqual(snapshot["counters"]["ticks"], 5)
+            self.assertEqual(snapshot["counters"]["delayed"], delayed)
+            self.assertEqual(snapshot["counters"]["moved"], 5 * 40 - delayed)
+            self.assertGreater(snapshot["ticks_per_second"], 0)
+            self.assertAlmostEqual(sum(phase["share"] for phase in snapshot["phases"].values()), 1.0)
+
+            network.station_reachable("A", "D", 3)
+            network.answer_route_queries(io.StringIO("A,B,1\nA,Z,2\nB,B,0\n"), io.StringIO())
+            latency = stats.snapshot()["route_query_latency"]
+            self.assertEqual(stats.counters["route_queries"], 4)
+            self.assertEqual(sum(bucket["count"] for bucket in latency["buckets_us"]), 4)
+            self.assertIsNotNone(latency["p99_us"])
+            json.dumps(stats.snapshot()) # Can be scraped as JSON.
+            self.assertIn("Route questions: 4", str(stats))
+
+            network.disable_stats()
+            network.advance_time()
+            self.assertEqual(stats.counters["ticks"], 5)
+
+
+    def test_event_log(self):
+        '''
+        Function that tests open_event_log() and read_event_log() with both engines and formats.
+        
+        '''
+        import json
+        import os
+        import random
+        import tempfile
+        with tempfile.TemporaryDirectory() as directory:
+            for engine in t.RailNetwork.ENGINES:
+                logs = {}
+                for format in ("jsonl", "binary"):
+                    random.seed(666)
+                    network = t.RailNetwork(engine)
+                    network.load_stations("stations.txt")
+                    network.load_connections("connections.txt")
+                    network.add_random_trains(20)
+                    file = os.path.join(directory, f"{engine}.{format}")
+                    network.open_event_log(file, format, buffer_events=7)
+                    delays = 0
+                    for _ in range(10):
+                        network.advance_time()
+                        delays += network.delayed_count()
+                    network.close_event_log()
+                    logs[format] = file
+                with open(logs["jsonl"]) as f:
+                    events = [json.loads(line) for line in f]
+                header, records = t.read_event_log(logs["binary"])
+                kinds = [header["kinds"][kind] for kind in records["kind"]]
+                # Both formats record the same events.
+                self.assertEqual([event["event"] for event in events], kinds)
+                self.assertEqual([event["station"] for event in events], [header["stations"][s] for s in records["station"]])
+                # Every train either got delayed or departed and arrived in every time unit.
+                self.assertEqual(kinds.count("delay"), delays)
+                self.assertEqual(kinds.count("departure"), kinds.count("arrival"))
+                self.assertEqual(kinds.count("delay") + kinds.count("departure"), 20 * 10)
+                self.assertEqual(records["tick"].max(), 10)
+                with self.assertRaises(ValueError):
+                    t.read_event_log(logs["jsonl"])
+    
+
+    def test_checkpoint(self):
+        '''
+        Function that tests save_checkpoint() and load_checkpoint() with both engines.
+        
+        '''
+        import os
+        import random
+        import tempfile
+        with tempfile.TemporaryDirectory() as directory:
+            for engine in t.RailNetwork.ENGINES:
+                random.seed(666)
+                network = t.RailNetwork(engine)
+                network.load_stations("stations.txt")
+                network.load_connections("connections.txt")
+                network.add_random_trains(25)
+                for _ in range(5):
+                    network.advance_time()
+                file = os.path.join(directory, f"{engine}.checkpoint")
+                network.save_checkpoint(file)
+                positions = [network.get_train(i).station.name for i in range(1, 26)]
+                # Both continue the same way, as the random generators were saved too.
+                for _ in range(5):
+                    network.advance_time()
+                resumed = t.RailNetwork.load_checkpoint(file)
+                self.assertEqual(str(resumed), str(network))
+                self.assertEqual(resumed.tick, 5)
+                self.assertEqual(resumed.engine, engine)
+                self.assertEqual(list(resumed.lines["blue"].stations), list(network.lines["blue"].stations))
+                self.assertEqual(resumed.connections, network.connections)
+                if engine == "array":
+                    self.assertEqual(len(resumed.trains), 0) # Train objects are only made when asked for.
+                self.assertEqual([resumed.get_train(i).station.name for i in range(1, 26)], positions)
+                for _ in range(5):
+                    resumed.advance_time()
+                self.assertEqual(resumed.train_states(), network.train_states())
+                self.assertEqual(sum(len(s.trains) for s in resumed.stations.values()), 25)
+            with open(os.path.join(directory, "nonsense"), "wb") as f:
+                f.write(b"nonsense")
+            with self.assertRaises(ValueError):
+                t.RailNetwork.load_checkpoint(os.path.join(directory, "nonsense"))
+    
+
+    def test_counter_rng(self):
+        '''
+        Function that tests CounterRNG and use_counter_rng() with every engine.
+        
+        '''
+        import os
+        import random
+        import tempfile
+        # The known answers of Philox4x32-10.
+        philox = lambda counter, key: [int(word) for word in t.CounterRNG.philox(counter, key)]
+        self.assertEqual(philox((0, 0, 0, 0), (0, 0)), [0x6627e8d5, 0xe169c58d, 0xbc57ac4c, 0x9b00dbd8])
+        self.assertEqual(philox((0xffffffff,) * 4, (0xffffffff,) * 2), [0x408f276d, 0x41c83b0e, 0xa20bc7c6, 0x6d5451fd])
+        self.assertEqual(philox((0x243f6a88, 0x85a308d3, 0x13198a2e, 0x03707344), (0xa4093822, 0x299f31d0)),
+                         [0xd16cfe09, 0x94fdcceb, 0x5001e420, 0x24126ea1])
+        # A train's draws don't depend on the other trains, and differ by time unit and stream.
+        rng = t.CounterRNG(2024)
+        draws = rng.uniform(list(range(1, 11)), 7, t.CounterRNG.DELAY)
+        self.assertEqual(rng.uniform(5, 7, t.CounterRNG.DELAY), draws[4])
+        self.assertTrue(((draws >= 0) & (draws < 1)).all())
+        self.assertNotEqual(rng.uniform(5, 8, t.CounterRNG.DELAY), draws[4])
+        self.assertNotEqual(rng.uniform(5, 7, t.CounterRNG.STAY), draws[4])
+
+        def network(engine, workers=None):
+            random.seed(engine) # The random module isn't used, so its seed doesn't matter.
+            network = t.RailNetwork(engine, workers)
+            network.use_counter_rng(2024)
+            network.load_stations("stations.txt")
+            network.load_connections("connections.txt")
+            network.add_random_trains(200)
+            return network
+
+        # The object, array and parallel engines give the same trajectories, for any number of workers.
+        networks = [network("object"), network("array"), network("parallel", 1), network("parallel", 2)]
+        for _ in range(10):
+            for fleet in networks:
+                fleet.advance_time()
+            for fleet in networks[1:]:
+                self.assertEqual(fleet.train_states(), networks[0].train_states())
+        for fleet in networks:
+            fleet.advance_ticks(10)
+        for fleet in networks[1:]:
+            self.assertEqual(fleet.train_states(), networks[0].train_states())
+        self.assertTrue(any(state["delayed"] for state in networks[0].train_states()))
+        networks[3].close_parallel()
+
+        # The event engine is reproducible too, and jumping gives the same result as stepping.
+        stepped, jumped = network("event"), network("event")
+        for _ in range(20):
+            stepped.advance_time()
+        jumped.advance_ticks(20)
+        self.assertEqual(stepped.train_states(), jumped.train_states())
+
+        # A checkpoint keeps the seed, so a resumed run continues the same way.
+        with tempfile.TemporaryDirectory() as directory:
+            file = os.path.join(directory, "counter.checkpoint")
+            networks[1].save_checkpoint(file)
+            resumed = t.RailNetwork.load_checkpoint(file)
+            self.assertEqual(resumed.counter_rng.seed, 2024)
+            for fleet in (networks[1], resumed):
+                random.seed(fleet is resumed)
+                fleet.advance_ticks(5)
+            self.assertEqual(resumed.train_states(), networks[1].train_states())
+    
+
+    def test_replay(self):
+        '''
+        Function that tests record_replay() and Replay with every engine.
+        
+        '''
+        import os
+        import random
+        import tempfile
+        with tempfile.TemporaryDirectory() as directory:
+            for engine in t.RailNetwork.ENGINES:
+                random.seed(666)
+                network = t.RailNetwork(engine, 2 if engine == "parallel" else None)
+                network.load_stations("stations.txt")
+                network.load_connections("connections.txt")
+                network.add_random_trains(50)
+                file = os.path.join(directory, f"{engine}.replay")
+                recorder = network.record_replay(file, interval=4)
+                states = {0: network.train_states()}
+                for _ in range(10):
+                    network.advance_time()
+                    states[network.tick] = network.train_states()
+                # Adding a train changes more than a time unit does, so it's recorded as a keyframe.
+                line = next(line for line in network.lines.values() if "A" in line.stations)
+                train = t.Train(network.stations["A"], "South", line, 1000, False)
+                network.stations["A"].add_train(train)
+                network.add_train(train, 1000)
+                network.advance_ticks(6)
+                states[network.tick] = network.train_states()
+                self.assertIn(11, [tick for tick, _ in recorder.keyframes])
+                network.close_replay()
+                network.close_parallel()
+                self.assertIsNone(network.recorder)
+
+                replay = t.Replay(file)
+                self.assertEqual((replay.first_tick, replay.last_tick), (0, 16))
+                # Seeks forward and backward, across keyframes.
+                for tick in (10, 3, 0, 7, 16, 4, 5):
+                    snapshot = replay.seek(tick)
+                    self.assertEqual(snapshot.tick, tick)
+                    if tick in states:
+                        self.assertEqual([snapshot.train_state(state["train_id"]) for state in states[tick]], states[tick])
+                self.assertEqual(replay.step(-2).tick, 3)
+                self.assertEqual(replay.step().train_state(1), states[4][0])
+                self.assertEqual(len(replay.seek(16)), 51)
+                with self.assertRaises(ValueError):
+                    replay.seek(17)
+
+            # A recording that wasn't closed is scanned up to its last whole record
+            # (the parallel engine's first time unit is a keyframe too, as it puts the trains in partition order).
+            with open(file, "rb") as f:
+                data = f.read()
+            with open(file, "wb") as f:
+                f.write(data[:-200])
+            replay = t.Replay(file)
+            self.assertEqual(replay.keyframe_ticks.tolist()[:3], [0, 1, 5])
+            self.assertLess(replay.last_tick, 16)
+            self.assertEqual(replay.seek(10).train_state(1), states[10][0])
+            # Between keyframes every time unit takes one bit per train.
+            self.assertLess(os.path.getsize(file), 16 * 18 * 51)
+    
+
+    def test_position_history(self):
+        '''
+        Function that tests record_history() and PositionHistoryReader with every engine.
+        
+        '''
+        import os
+        import random
+        import tempfile
+        import numpy as np
+        with tempfile.TemporaryDirectory() as directory:
+            for engine in t.RailNetwork.ENGINES:
+                random.seed(666)
+                network = t.RailNetwork(engine, 2 if engine == "parallel" else None)
+                network.load_stations("stations.txt")
+                network.load_connections("connections.txt")
+                network.add_random_trains(40)
+                history = os.path.join(directory, engine)
+                network.record_history(history, chunk_ticks=8)
+                states = {0: network.train_states()}
+                for _ in range(12):
+                    network.advance_time()
+                    states[network.tick] = network.train_states()
+                # Trains added later aren't recorded, the others still are.
+                line = next(line for line in network.lines.values() if "A" in line.stations)
+                train = t.Train(network.stations["A"], "North", line, 1000, False)
+                network.stations["A"].add_train(train)
+                network.add_train(train, 1000)
+                network.advance_ticks(9)
+                states[network.tick] = network.train_states()
+                network.close_history()
+                network.close_parallel()
+
+                reader = t.PositionHistoryReader(history)
+                self.assertEqual((reader.first_tick, reader.ticks), (0, 22))
+                self.assertEqual(reader.train_ids.tolist(), list(range(1, 41)))
+                stations, delayed = reader.read("stations"), reader.read("delayed")
+                for tick, tick_states in states.items():
+                    tick_states = sorted(tick_states, key=lambda state: state["train_id"])[:40]
+                    self.assertEqual([reader.station_names[i] for i in stations[tick]], [state["station"] for state in tick_states])
+                    self.assertEqual(delayed[tick].tolist(), [state["delayed"] for state in tick_states])
+                # A slice within a chunk is a view of the file, and slices by train and across chunks are the same as the whole.
+                self.assertIsInstance(reader.read("stations", 2, 7), np.memmap)
+                self.assertEqual(reader.read("stations", 5, 20, [3, 1]).tolist(), stations[5:20][:, [2, 0]].tolist())
+                self.assertEqual(reader.station_counts("C", 3).tolist(), (stations[3:] == reader.station_ids["C"]).sum(axis=1).tolist())
+                with self.assertRaises(KeyError):
+                    reader.read("stations", train_ids=[1000])
+    
+
+    def test_run_replications(self):
+        '''
+        Function that tests run_replications().
+        
+        '''
+        network = t.RailNetwork()
+        network.load_stations("stations.txt")
+        network.load_connections("connections.txt")
+        summary = t.run_replications(network, 50, 20, 4, seed=666, workers=1)
+        self.assertEqual(summary["runs"], 4)
+        self.assertEqual(set(summary["stations"]), set(network.stations))
+        # Every train is somewhere at the end, and spends every time unit somewhere.
+        self.assertAlmostEqual(sum(s["final_trains_mean"] for s in summary["stations"].values()), 50)
+        self.assertAlmostEqual(sum(s["visits_mean"] for s in summary["stations"].values()), 50 * 20)
+        self.assertAlmostEqual(sum(line["delays_mean"] for line in summary["lines"].values()), summary["delays_mean"])
+        # The same seed gives the same results, however many processes run them.
+        self.assertEqual(summary, t.run_replications(network, 50, 20, 4, seed=666, workers=2))
+        self.assertNotEqual(summary, t.run_replications(network, 50, 20, 4, seed=667, workers=1))
+
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -1,10 +1,10 @@
 # rail-network-simulator by Ivan Shabalin
 
+import os
 import random
-import unittest
-import matplotlib.pyplot as plt
-import networkx as nx
+import sys
 from collections import defaultdict
+from collections.abc import Mapping
 
 class Train:
     '''
@@ -18,7 +18,10 @@ class Train:
     train_id: Train's ID number.
     train_delayed: The train's delayed status (True or False).
 
+    Uses __slots__ instead of a dictionary for its attributes, to keep big fleets small in memory.
+
     '''
+    __slots__ = ("station", "direction", "line", "train_id", "train_delayed")
 
 
     def __init__(self, station, direction, line, train_id, train_delayed):
@@ -60,6 +63,9 @@ class Station:
     The Station class represents a station on the rail network.
     
     '''
+    __slots__ = ("name", "delay_probability", "trains")
+
+
     def __init__(self, name, delay_probability):
         '''
         Function that initializes the Station object.
@@ -67,12 +73,14 @@ class Station:
         Parameters: name: The station's name.
         delay_probability: The risk the station has of delaying a train on it.
 
-        Stores trains in a list to add and remove from itself.
+        Stores trains in a dictionary used as an ordered set (the trains are the keys), 
+        so that adding and removing a train takes the same time however many trains the station has.
+        Looping over it gives the trains in the order they arrived.
 
         '''
         self.name = name
         self.delay_probability = delay_probability
-        self.trains = []
+        self.trains = {}
         
     
     def __str__(self):
@@ -90,7 +98,7 @@ class Station:
         Parameter: A train.
 
         '''
-        self.trains.append(train)
+        self.trains[train] = None
     
     def remove_train(self, train):
         '''
@@ -99,7 +107,7 @@ class Station:
         Parameter: A train.
         
         '''
-        self.trains.remove(train)
+        del self.trains[train]
     
 
 class Line:
@@ -107,6 +115,9 @@ class Line:
     The Line class represents a line on the rail network (such as for example a blue, green or red line).
     
     '''
+    __slots__ = ("name", "stations")
+
+
     def __init__(self, name):
         '''
         Function that initializes the Station object.
@@ -143,279 +154,4256 @@ class Line:
         return self.stations[station_name]
     
 
-class RailNetwork:
+class CompiledNetwork:
     '''
-    The RailNetwork class is the main class the whole simulation takes place in.
-    It represents the entire network.
-    
+    The CompiledNetwork class is an immutable, integer indexed view of the rail network's topology,
+    made by RailNetwork.compile(). The simulation, the route queries and the map all share it,
+    so none of them have to re-derive the topology from dictionaries and strings.
+
+    Station and line names are interned to dense integer IDs (their order in the network),
+    and every index is a read-only numpy array.
+
+    Attributes:
+
+    station_names, line_names: Tuples of names, indexed by ID.
+    station_ids, line_ids: Dictionaries from name to ID.
+    line_offsets: Where each line starts in line_stations (length: number of lines + 1).
+    line_lengths: Number of stations on each line.
+    line_stations: The station IDs of every line in order, flattened into one array.
+    station_line_offsets: Where each station starts in station_lines (CSR index, length: number of stations + 1).
+    station_lines: The IDs of the lines each station is on.
+    station_line_positions: The station's position on each of those lines (the reverse position map).
+    neighbour_offsets: Where each station starts in neighbours (CSR index, length: number of stations + 1).
+    neighbours: The IDs of the stations connected to each station, in either direction.
+    edge_sources, edge_targets, edge_lines: The connections, as station and line IDs.
+    edge_directions: The connections' directions, as written in the connections file.
+
+    Warning: Needs the numpy module to work.
+
     '''
-    def __init__(self):
+    __slots__ = ("station_names", "station_ids", "line_names", "line_ids",
+                 "line_offsets", "line_lengths", "line_stations", "positions",
+                 "station_line_offsets", "station_lines", "station_line_positions",
+                 "neighbour_offsets", "neighbours",
+                 "edge_sources", "edge_targets", "edge_lines", "edge_directions")
+
+
+    def __init__(self, network):
         '''
-        Function that initializes the RailStation object.
-        Stores a dictionary of lines, with the line names as keys;
-        a dictionary of stations, with the station names as keys;
-        and a dictionary of trains, with the their ID numbers as keys.
+        Function that initializes the CompiledNetwork object from a loaded RailNetwork.
+
+        Parameter: A RailNetwork, with its stations and connections loaded.
 
         '''
-        self.lines = {}
-        self.stations = {}
-        self.trains = {}
+        import numpy as np
+        from types import MappingProxyType
+
+        def frozen(values, dtype):
+            array = np.array(values, dtype=dtype)
+            array.flags.writeable = False
+            return array
+
+        def csr(rows, dtype=np.int64):
+            # Turns a list of lists into an offsets array and one flat values array.
+            offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(row) for row in rows])
+            offsets.flags.writeable = False
+            return offsets, frozen([value for row in rows for value in row], dtype)
+
+        station_names = tuple(network.stations.keys())
+        station_ids = {name: i for i, name in enumerate(station_names)}
+        line_names = tuple(network.lines.keys())
+        line_ids = {name: i for i, name in enumerate(line_names)}
+
+        # Lines, and the reverse map from each station to the lines it's on and its position there.
+        line_rows = []
+        station_line_rows = [[] for _ in station_names]
+        station_position_rows = [[] for _ in station_names]
+        positions = {}
+        for line_id, line in enumerate(network.lines.values()):
+            row = [station_ids[name] for name in line.stations]
+            for position, station_id in enumerate(row):
+                station_line_rows[station_id].append(line_id)
+                station_position_rows[station_id].append(position)
+                positions[(line_id, station_id)] = position
+            line_rows.append(row)
+        line_offsets, line_stations = csr(line_rows)
+        station_line_offsets, station_lines = csr(station_line_rows)
+        station_line_positions = csr(station_position_rows)[1]
+
+        # Connections, and the stations next to each station (in either direction).
+        connections = network.connections
+        neighbour_sets = [set() for _ in station_names]
+        for source, target, _, _ in connections:
+            neighbour_sets[station_ids[source]].add(station_ids[target])
+            neighbour_sets[station_ids[target]].add(station_ids[source])
+        neighbour_offsets, neighbours = csr([sorted(row) for row in neighbour_sets])
+
+        set_field = object.__setattr__ # Bypasses the immutability of the object while it's being made.
+        set_field(self, "station_names", station_names)
+        set_field(self, "station_ids", MappingProxyType(station_ids))
+        set_field(self, "line_names", line_names)
+        set_field(self, "line_ids", MappingProxyType(line_ids))
+        set_field(self, "line_offsets", line_offsets)
+        set_field(self, "line_lengths", frozen(np.diff(line_offsets), np.int64))
+        set_field(self, "line_stations", line_stations)
+        set_field(self, "positions", MappingProxyType(positions))
+        set_field(self, "station_line_offsets", station_line_offsets)
+        set_field(self, "station_lines", station_lines)
+        set_field(self, "station_line_positions", station_line_positions)
+        set_field(self, "neighbour_offsets", neighbour_offsets)
+        set_field(self, "neighbours", neighbours)
+        set_field(self, "edge_sources", frozen([station_ids[c[0]] for c in connections], np.int64))
+        set_field(self, "edge_targets", frozen([station_ids[c[1]] for c in connections], np.int64))
+        set_field(self, "edge_lines", frozen([line_ids[c[2]] for c in connections], np.int64))
+        set_field(self, "edge_directions", tuple(c[3] for c in connections))
     
+
+    def __setattr__(self, name, value):
+        '''
+        Function that stops the CompiledNetwork object from being changed after it has been made.
+
+        '''
+        raise AttributeError("CompiledNetwork is immutable, compile the network again instead")
+    
+
+    def __getstate__(self):
+        '''
+        Function that returns the CompiledNetwork's fields for pickling (to send it to worker processes).
+
+        '''
+        return {name: dict(value) if isinstance(value, Mapping) else value
+                for name, value in ((name, getattr(self, name)) for name in self.__slots__)}
+    
+
+    def __setstate__(self, state):
+        '''
+        Function that restores a pickled CompiledNetwork.
+
+        '''
+        from types import MappingProxyType
+
+        for name, value in state.items():
+            if isinstance(value, dict):
+                value = MappingProxyType(value)
+            elif hasattr(value, "flags"):
+                value.flags.writeable = False
+            object.__setattr__(self, name, value)
+    
+
     def __str__(self):
         '''
-        Function that returns a string representation of the RailNetwork object, 
-        with relevant information about the rail network, such as amount of lines,
-        amount of stations, and amount of trains in it.
+        Function that returns a string representation of the CompiledNetwork object.
 
         '''
-        return f"Rail network with {len(self.lines)} lines, {len(self.stations)} stations, and {len(self.trains)} trains"
+        return f"Compiled network with {len(self.line_names)} lines, {len(self.station_names)} stations, and {len(self.edge_sources)} connections"
     
-    def add_line(self, line):
+
+    def position(self, line_id, station_id):
         '''
-        Function that adds a line to the network.
-        
-        Parameter: a line.
+        Function that returns the position of a station on a line in O(1).
+
+        Parameters: A line ID and a station ID.
 
         '''
-        self.lines[line.name] = line
+        return self.positions[(line_id, station_id)]
     
-    def add_station(self, station):
+
+    def station_at(self, line_id, position):
         '''
-        Function that adds a station to the network.
-        
-        Parameter: a station.
-        
+        Function that returns the ID of the station at a position on a line.
+
+        Parameters: A line ID and a position on the line.
+
         '''
-        self.stations[station.name] = station
+        return int(self.line_stations[self.line_offsets[line_id] + position])
     
-    def add_train(self, train, train_id):
+
+    def lines_of(self, station_id):
         '''
-        Function that adds a train to the network.
-        
-        Parameters: a train and its ID number.
-        
+        Function that returns the IDs of the lines a station is on.
+
+        Parameter: A station ID.
+
         '''
-        self.trains[train_id] = train
+        return self.station_lines[self.station_line_offsets[station_id]:self.station_line_offsets[station_id + 1]]
     
 
-    def load_stations(self, filename):
+    def neighbours_of(self, station_id):
         '''
-        Function that loads and interpretes a stations file and adds its information into the Station object.
-        
-        Important for it to work: The txt file has to have a line for each station 
-        with its risk of causing a delay (written in decimal form) separated by a comma,
-        with no additional information or empty lines.
-        
-        Parameter: The file name of the stations file as a string.
-        
+        Function that returns the IDs of the stations connected to a station.
+
+        Parameter: A station ID.
+
         '''
-        with open(filename, "r") as f:
-            for line in f:
-                name, delay_probability = line.strip().split(",") # Seperates information into variables.
-                delay_probability = float(delay_probability) # Converts delay risk to a float
-                station = Station(name, delay_probability)
-                self.add_station(station) # Adds information to the Station object.
+        return self.neighbours[self.neighbour_offsets[station_id]:self.neighbour_offsets[station_id + 1]]
+
+
+class ReachabilityIndex:
+    '''
+    The ReachabilityIndex class answers route info questions (can a station be reached from
+    another station within a number of timesteps) from a CompiledNetwork's adjacency index.
+
+    For networks with up to MATRIX_LIMIT stations it precomputes the hop distance between
+    every pair of stations once, so that each question is an O(1) lookup.
+    Larger networks instead run a breadth-first search per start station when it's first
+    asked about, and keep the most recent BFS trees (distances from the start station) cached.
+
+    The answers are the same as station_reachability_checker()'s: a station is always
+    reachable from itself, and otherwise it's reachable if it's at most time_limit
+    connections away (the BFS there starts at time 1).
+
+    Warning: Needs the numpy module to work.
+
+    '''
+    MATRIX_LIMIT = 4096
+    CACHE_SIZE = 256
+
+
+    def __init__(self, compiled, matrix_limit=MATRIX_LIMIT, cache_size=CACHE_SIZE):
+        '''
+        Function that initializes the ReachabilityIndex object.
+
+        Parameters: A CompiledNetwork; the largest number of stations to precompute
+        a distance matrix for; and how many BFS trees to cache for larger networks.
+
+        '''
+        from collections import OrderedDict
+
+        self.compiled = compiled
+        self.cache_size = cache_size
+        self.trees = OrderedDict()
+        self.matrix = None
+        if len(compiled.station_names) <= matrix_limit:
+            self.matrix = self.distance_matrix(compiled)
     
 
-    def load_connections(self, filename):
+    @staticmethod
+    def distance_matrix(compiled):
         '''
-        Function that loads and interpretes a connections file and adds its information into the Line object.
-        
-        Important for it to work: The txt file has to have a line for each connection 
-        with all of its information written in order (source station, target station, line name, direction) 
-        and separated by a comma,
-        with no additional information or empty lines.
-        
-        Parameter: The file name of the connection file as a string.
-        
+        Function that computes the hop distance between every pair of stations,
+        with -1 for stations that can't be reached.
+
+        Runs a breadth-first search from every station at the same time, one level at a time.
+        The set of start stations that have reached each station is kept as a row of bits,
+        so one level costs a few vectorized operations over the adjacency index.
+
+        Parameter: A CompiledNetwork.
+
+        Returns: A matrix where [start ID, target ID] is the distance.
+
         '''
-        with open(filename, "r") as f:
-            for line in f:
-                # Seperates information into variables
-                source, target, line_name, direction = line.strip().split(",")
+        import numpy as np
 
-                # Assign the source station and target station.
-                source_station = self.stations[source]
-                target_station = self.stations[target]
+        count = len(compiled.station_names)
+        words = (count + 63) // 64
+        # The columns are padded to whole words, so each row can also be seen as blocks of 64 columns.
+        padded = np.full((count, words * 64), -1, dtype=np.int16)
+        blocked = padded.reshape(count, words, 64)
+        distances = padded[:, :count]
+        np.fill_diagonal(distances, 0)
+        ids = np.arange(count)
+        reached = np.zeros((count, words), dtype="<u8")
+        reached[ids, ids // 64] = np.left_shift(np.uint64(1), (ids % 64).astype(np.uint64))
+        frontier = reached.copy()
 
-                # Creates new Line objects for new lines found
-                # And adds them to the RailNetwork
-                if line_name not in self.lines:
-                    line = Line(line_name)
-                    self.add_line(line)
-                else:
-                    line = self.lines[line_name]
-                # Adds the source station and target station 
-                line.add_station(source_station) 
-                line.add_station(target_station) 
+        # Only stations with connections can be reached from new stations.
+        offsets = compiled.neighbour_offsets
+        connected = np.flatnonzero(np.diff(offsets) > 0)
+        level = 0
+        while len(connected) and frontier.any():
+            level += 1
+            # Each station gets reached by every start station that reached one of its neighbours last level.
+            incoming = np.bitwise_or.reduceat(frontier[compiled.neighbours], offsets[connected], axis=0)
+            new = incoming & ~reached[connected]
+            rows = np.flatnonzero(new.any(axis=1))
+            if not len(rows):
+                break
+            new = new[rows]
+            targets = connected[rows]
+            reached[targets] |= new
+            frontier = np.zeros_like(frontier)
+            frontier[targets] = new
+            # Unpacks the non-empty words into blocks of 64 start stations to fill in the distances.
+            # (Row [target] is the same as column [target], as connections go both ways.)
+            target_rows, word_columns = np.nonzero(new)
+            bits = np.unpackbits(new[target_rows, word_columns].view(np.uint8).reshape(-1, 8), axis=1, bitorder="little").view(bool)
+            rows = targets[target_rows]
+            blocks = blocked[rows, word_columns]
+            np.copyto(blocks, level, where=bits)
+            blocked[rows, word_columns] = blocks
+        distances = np.ascontiguousarray(distances)
+        distances.flags.writeable = False
+        return distances
     
 
-    def station_reachability_checker_file_opener(self, file_name):
+    def tree(self, start_id):
         '''
-        Function for opening a connections file 
-        and returning a list of information (a list of tuples containing the pairs of station names)
-        for station_reachability_checker() to interprete.
+        Function that returns the distances from a start station to every station,
+        running a breadth-first search if it isn't cached.
+
+        Parameter: The start station's ID.
 
-        Parameter: A connections file name as a string.
         '''
-        with open(file_name, "r") as f:
-            return [tuple(line.strip().split(",")) for line in f]
+        import numpy as np
+        from collections import deque
+
+        if self.matrix is not None:
+            return self.matrix[start_id]
+        if start_id in self.trees:
+            self.trees.move_to_end(start_id)
+            return self.trees[start_id]
+        offsets = self.compiled.neighbour_offsets.tolist()
+        neighbours = self.compiled.neighbours.tolist()
+        distances = [-1] * len(offsets[:-1])
+        distances[start_id] = 0
+        queue = deque([start_id])
+        while queue:
+            station = queue.popleft()
+            distance = distances[station] + 1
+            for neighbour in neighbours[offsets[station]:offsets[station + 1]]:
+                if distances[neighbour] < 0:
+                    distances[neighbour] = distance
+                    queue.append(neighbour)
+        tree = np.array(distances, dtype=np.int32)
+        tree.flags.writeable = False
+        self.trees[start_id] = tree
+        # Forgets the least recently used tree if the cache is full.
+        if len(self.trees) > self.cache_size:
+            self.trees.popitem(last=False)
+        return tree
     
 
-    def station_reachability_checker(self, start, target, time_limit, connections):
+    def distance(self, start_id, target_id):
+        '''
+        Function that returns the hop distance between two stations, or -1 if it can't be reached.
+
+        Parameters: The start station's ID and the target station's ID.
+
+        '''
+        if self.matrix is not None:
+            return int(self.matrix[start_id, target_id])
+        return int(self.tree(start_id)[target_id])
+    
+
+    def reachable(self, start, target, time_limit):
         '''
         Function for determining if it's possible to reach a station from 
         another station within a given time frame/movement limit.
 
         Parameters: The start station's name as a string; the target station's name as a string;
-        the maximum amount of timesteps allowed, as an int; 
-        and a list of tuples that all contain a pair of connected stations.
-        
+        and the maximum amount of timesteps allowed, as an int.
+
         Returns: True if it's possible, otherwise False.
+
         '''
-        # Creates a queue to store the stations to visit
-        queue = [(start, 1)] # Updates the time to 1
-        visited = set()
-        # While stations in queue
-        while queue:
-            # Gets next station and the time it took to reach it.
-            station, time = queue.pop(0)
-            # If target station is reached, return True.
-            if station == target:
-                return True
-            # If failed to reach target before time limit, continue.
-            if time > time_limit:
-                continue
-            # Adds station to visited list.
-            visited.add(station)
-            # Counts all non-visited connections of the current station to the queue.
-            for connection in connections:
-                if connection[0] == station and connection[1] not in visited:
-                    queue.append((connection[1], time + 1)) # Updates time by 1
-                elif connection[1] == station and connection[0] not in visited:
-                    queue.append((connection[0], time + 1)) # Updates time by 1
-        # Returns False if all possible stations have been visited without reaching target.
-        return False
+        if start == target: # A station is always reachable from itself, even if it's not in the network.
+            return True
+        start_id = self.compiled.station_ids.get(start)
+        target_id = self.compiled.station_ids.get(target)
+        if start_id is None or target_id is None:
+            return False
+        distance = self.distance(start_id, target_id)
+        return 0 <= distance <= time_limit
+    
+
+    def reachable_batch(self, start_ids, target_ids, time_limits):
+        '''
+        Function that answers many route info questions at once, 
+        by looking up all the distances with one fancy-indexing operation.
+
+        Parameters: Arrays of start station IDs, target station IDs and time limits,
+        where the ID -1 means a station that isn't in the network.
+
+        Returns: An array of True/False answers, the same as reachable() would give.
+
+        Warning: Needs the numpy module to work.
+
+        '''
+        import numpy as np
+
+        start_ids = np.asarray(start_ids, dtype=np.int64)
+        target_ids = np.asarray(target_ids, dtype=np.int64)
+        known = (start_ids >= 0) & (target_ids >= 0)
+        distances = np.full(len(start_ids), -1, dtype=np.int64)
+        if self.matrix is not None:
+            distances[known] = self.matrix[start_ids[known], target_ids[known]]
+        else:
+            # Looks up one BFS tree per start station.
+            known_rows = np.flatnonzero(known)
+            order = known_rows[np.argsort(start_ids[known_rows], kind="stable")]
+            starts, first = np.unique(start_ids[order], return_index=True)
+            for start_id, rows in zip(starts, np.split(order, first[1:])):
+                distances[rows] = self.tree(int(start_id))[target_ids[rows]]
+        return (start_ids == target_ids) & known | (distances >= 0) & (distances <= time_limits)
+
+
+class CounterRNG:
+    '''
+    The CounterRNG class draws random numbers with the Philox4x32-10 counter-based generator
+    (see RailNetwork.use_counter_rng()). A counter-based generator has no state to advance: every draw is
+    the encryption of a counter with the seed as the key, so it's a pure function of (seed, train ID, time unit, stream).
+
+    That makes any train's draws computable on their own, in any order and in any process, so the object, array
+    and parallel engines (and any number of workers) give bit-identical trajectories for the same seed.
+
+    Attributes:
+
+    seed: The 64-bit seed (the generator's key).
+
+    Warning: Needs the numpy module to work.
 
+    '''
+    # The streams keep the draws made for different purposes apart (the counter's top 8 bits).
+    DELAY = 0 # Whether a train gets delayed in a time unit.
+    STAY = 1 # How long the event engine keeps a train at a station it arrives at.
+    STATION = 2 # The station a new train starts at.
+    DIRECTION = 3 # The direction a new train starts in.
+    LINE = 4 # The line a new train starts on, if its station is on several.
+
+    MULTIPLIERS = (0xD2511F53, 0xCD9E8D57)
+    WEYL = (0x9E3779B9, 0xBB67AE85) # Added to the key between rounds.
+    ROUNDS = 10
+
+
+    def __init__(self, seed):
+        '''
+        Function that initializes the CounterRNG object.
+
+        Parameter: The seed, an integer (only its lowest 64 bits are used).
+
+        '''
+        self.seed = seed & 0xFFFFFFFFFFFFFFFF
     
-    def get_start_line(self, station):
+
+    @classmethod
+    def philox(cls, counter, key, rounds=ROUNDS):
         '''
-        Function for finding and returning a line/lines from a station.
+        Function that encrypts a batch of 128-bit counters with Philox4x32.
 
-        Parameters: A Station object.
-        
-        Returns: A (randomly choosen) line.
+        Parameters: The four 32-bit words of the counters (integers or arrays, broadcast together);
+        the two 32-bit words of the key; and the number of rounds (10 by default).
 
-        The function randomly chooses a line in case a station exists
-        on more than one line (such as the case for station C in Map 1),
-        so that you don't get multiple lines from the same station.
+        Returns: The four 32-bit words of the results, as uint32 arrays.
 
-        Warning: Needs the random module to work.
+        '''
+        import numpy as np
+
+        # The words are kept in uint64, so the 32 x 32-bit products don't overflow.
+        mask = np.uint64(0xFFFFFFFF)
+        c0, c1, c2, c3 = np.broadcast_arrays(*(np.asarray(word, dtype=np.uint64) for word in counter))
+        m0, m1 = (np.uint64(m) for m in cls.MULTIPLIERS)
+        k0, k1 = key
+        for r in range(rounds):
+            if r:
+                k0 = (k0 + cls.WEYL[0]) & 0xFFFFFFFF
+                k1 = (k1 + cls.WEYL[1]) & 0xFFFFFFFF
+            p0 = c0 * m0
+            p1 = c2 * m1
+            c0 = p1 >> np.uint64(32)
+            c0 ^= c1
+            c0 ^= np.uint64(k0)
+            c2 = p0 >> np.uint64(32)
+            c2 ^= c3
+            c2 ^= np.uint64(k1)
+            c1 = p1 & mask
+            c3 = p0 & mask
+        return tuple(word.astype(np.uint32) for word in (c0, c1, c2, c3))
+    
 
+    def words(self, train_ids, tick, stream):
         '''
-        matching_lines = []
+        Function that returns the raw draws of some trains in a time unit.
+
+        Parameters: The train IDs (an integer or an array); the time unit (an integer or an array); and the stream.
 
-        for line in self.lines.values():
-            for s in line.stations:
-                if s == station.name:
-                    matching_lines.append(line)
+        Returns: The four 32-bit words of each draw, as uint32 arrays.
 
-        return random.choice(matching_lines)
+        '''
+        import numpy as np
 
+        train_ids = np.asarray(train_ids).astype(np.uint64)
+        tick = np.asarray(tick).astype(np.uint64)
+        mask = np.uint64(0xFFFFFFFF)
+        counter = (train_ids & mask, train_ids >> np.uint64(32), tick & mask,
+                   (tick >> np.uint64(32)) & np.uint64(0xFFFFFF) | np.uint64(stream << 24))
+        return self.philox(counter, (self.seed & 0xFFFFFFFF, self.seed >> 32))
     
-    def generate_train_map(self, connections_file):
+
+    def uniform(self, train_ids, tick, stream):
         '''
-        Function for creating a map of rail network by plotting the trains, stations and lines.
+        Function that draws one number in [0, 1) for each of some trains in a time unit.
 
-        Parameters: A connections file.
-        
-        Output: Displays a map of the rail network.
+        Parameters: As for words().
 
-        Warning: Needs matplotlib.pyplot, networkx modules and the defaultdict to work.
+        Returns: An array of floats (with 53 random bits each, like random.random()).
 
         '''
-        # Collects all the Train ojects in a list.
-        all_trains = [train_obj for train_obj in self.trains.values()]
+        import numpy as np
 
-        # Reads the connections file.
-        with open(connections_file, "r") as f:
-            connections = f.readlines()
+        x0, x1, _, _ = self.words(train_ids, tick, stream)
+        return ((x0 >> 5).astype(np.float64) * 67108864.0 + (x1 >> 6)) / 9007199254740992.0
+    
 
-        # Creates the graph.
-        G = nx.MultiDiGraph()
+    def choice(self, train_id, tick, stream, count):
+        '''
+        Function that picks one of count options for a train.
 
-        for line in connections:
-            source, target, line_name, direction = line.strip().split(',')
-            G.add_edge(source, target, line=line_name, direction=direction)
+        Parameters: The train ID; the time unit; the stream; and the number of options.
 
-        # Sets the positions of the nodes using the Fruchterman-Reingold algorithm.
-        position = nx.spring_layout(G, k=1, seed=666)
+        Returns: The index of the option.
 
-        # Draws the nodes.
-        nx.draw_networkx_nodes(G, position, node_size=300, node_color="w")
+        '''
+        return int(self.uniform(train_id, tick, stream) * count)
 
-        # Draws the edges.
-        edge_colors = []
-        for _, _, attrs in G.edges(data=True):
-            if "line" in attrs:
-                edge_colors.append(attrs["line"])
-            else:
-                edge_colors.append("black") # Makes black the default color of the lines if the station's name isn't a color.
-        nx.draw_networkx_edges(G, position, edge_color=edge_colors, width=2, arrowsize=20, arrowstyle="-")
 
-        # Adds labels to the nodes.
-        nx.draw_networkx_labels(G, position, font_size=10, font_family="sans-serif")
+class TrainArrays:
+    '''
+    The TrainArrays class stores the state of every train in the network as
+    a struct of arrays (one array per attribute instead of one object per train),
+    so that the array engine can advance all trains in one batched pass.
 
-        # Gets the trains on each station.
-        station_trains = defaultdict(list)
-        for train in all_trains:
-            station_trains[train.station].append(train)
+    Attributes:
 
-        # Adds the trains' IDs to the map.
-        for station, all_trains in station_trains.items():
-            train_labels = [train.train_id for train in all_trains]
-            x, y = position[station.name]
-            plt.text(x, y - 0.03, "\n".join(str(train_label) for train_label in train_labels), fontsize=8, ha="center", va="center", bbox=dict(facecolor="white", edgecolor="none", alpha=0.7))
+    train_ids: The trains' ID numbers, in the same order as the other arrays.
+    line: Index of the line each train is running on.
+    position: Index of the train's station along its line.
+    direction: The train's direction, -1 for North and 1 for South.
+    delayed: The trains' delayed statuses (True or False).
 
-        # Sets the axis limits and removes them.
-        plt.axis("off")
-        plt.xlim(-1.2, 1.2)
-        plt.ylim(-1.2, 1.2)
-        plt.title("Rail Network Map")
+    Warning: Needs the numpy module to work.
 
-        # Shows the plot.
-        plt.show()
+    '''
+    NORTH = -1
+    SOUTH = 1
 
 
-    def simulate(self):
+    def __init__(self, network, train_ids, line, position, direction, delayed):
         '''
-        Function that initiates the train simulation. 
+        Function that initializes the TrainArrays object.
 
-        Continue simulation [1]: Simulates one time unit in the simulation.
-        Trains move from one station to the next according to their direction (unless delayed), 
-        when they reach an end of a line, they switch direction.
-        
-        Train info [2]: Shows information about each train in the simulation.
+        Parameters: A RailNetwork, and the arrays described above.
 
-        Route info [3]: Determines if it's possible to reach a station from another station 
-        within the given time frame.
+        Uses the network's compiled topology for the line tables, and stores the
+        delay probability of every line position next to it.
 
-        Show rail network map [4]: Shows a map of the entire network, along with all the trains and what station they're on.
+        '''
+        import numpy as np
+
+        compiled = network.compile()
+        self.compiled = compiled
+        self.stations = [network.stations[name] for name in compiled.station_names]
+        station_delay = np.array([station.delay_probability for station in self.stations], dtype=np.float64)
+        self.position_delay = station_delay[compiled.line_stations]
+
+        self.train_ids = train_ids
+        self.line = line
+        self.position = position
+        self.direction = direction
+        self.delayed = delayed
+        self.index = None # Train ID to array index, built when first needed.
+    
 
+    @classmethod
+    def from_trains(cls, network):
         '''
-        input_prompt = "Continue simulation [1], train info [2], route info [3], show rail network map [4], exit [q].\nSelect an option: "
-        # Main simulation loop.
-        while True:
-            # Makes input case insensitive, and allows spaces and dots, for less strict inputs.
-            choice = input(input_prompt).lower().replace(" ","").replace(".","")
-            # Input checkpoint
-            while not choice == "1" and choice != "2" and not choice == "3" and choice != "4" and not choice == "q":
+        Function that makes a TrainArrays object from the Train objects currently in the network.
+
+        Parameter: A RailNetwork.
+
+        '''
+        import numpy as np
+
+        compiled = network.compile()
+        trains = list(network.trains.values())
+        count = len(trains)
+        line = np.empty(count, dtype=np.int64)
+        position = np.empty(count, dtype=np.int64)
+        direction = np.empty(count, dtype=np.int8)
+        delayed = np.zeros(count, dtype=bool)
+        for i, train in enumerate(trains):
+            line_id = compiled.line_ids[train.line.name]
+            line[i] = line_id
+            position[i] = compiled.position(line_id, compiled.station_ids[train.station.name])
+            direction[i] = cls.NORTH if train.direction == "North" else cls.SOUTH
+            delayed[i] = train.train_delayed
+        train_ids = np.array([train.train_id for train in trains], dtype=np.int64)
+        return cls(network, train_ids, line, position, direction, delayed)
+    
+
+    @classmethod
+    def random_fleet(cls, network, count, generator):
+        '''
+        Function that makes a TrainArrays object with randomly placed trains (ID numbers 1 to count),
+        without making any Train objects.
+
+        Places trains the same way the program does at the start: a random station, 
+        a random direction, and a random line out of the lines the station is on.
+        Stations that aren't on any line are skipped, as no train can run there.
+
+        Parameters: A RailNetwork; the number of trains; and a numpy random Generator.
+
+        '''
+        import numpy as np
+
+        compiled = network.compile()
+        lines_per_station = np.diff(compiled.station_line_offsets)
+        served = np.flatnonzero(lines_per_station > 0)
+        station = served[generator.integers(0, len(served), count)]
+        direction = np.where(generator.random(count) < 0.5, cls.NORTH, cls.SOUTH).astype(np.int8)
+        # Picks one of the station's lines, and looks up the station's position on it.
+        choice = compiled.station_line_offsets[station] + (generator.random(count) * lines_per_station[station]).astype(np.int64)
+        line = compiled.station_lines[choice].copy()
+        position = compiled.station_line_positions[choice].copy()
+        train_ids = np.arange(1, count + 1, dtype=np.int64)
+        return cls(network, train_ids, line, position, direction, np.zeros(count, dtype=bool))
+    
+
+    @classmethod
+    def from_tables(cls, compiled, position_delay, train_ids, line, position, direction, delayed):
+        '''
+        Function that makes a TrainArrays object from a compiled topology and the delay probability
+        of every line position instead of a RailNetwork, for worker processes that only step trains
+        (station_of() and sync_train() need the network, so they can't be used).
+
+        Parameters: A CompiledNetwork; the delay probabilities; and the arrays described above.
+
+        '''
+        arrays = cls.__new__(cls)
+        arrays.compiled = compiled
+        arrays.stations = None
+        arrays.position_delay = position_delay
+        arrays.train_ids = train_ids
+        arrays.line = line
+        arrays.position = position
+        arrays.direction = direction
+        arrays.delayed = delayed
+        arrays.index = None
+        return arrays
+    
+
+    def __len__(self):
+        '''
+        Function that returns the number of trains stored in the arrays.
+
+        '''
+        return len(self.train_ids)
+    
+
+    def step(self, generator, spent=None, tick=None):
+        '''
+        Function that advances every train by one time unit in one batched pass.
+        Follows the same rules as RailNetwork.advance_time().
+
+        Parameters: A numpy random Generator or a CounterRNG used for the delay draws; optionally a dictionary
+        of SimulationStats phase names to add the time spent in each phase to; and the time unit
+        being simulated (only needed with a CounterRNG, whose draws depend on it).
+
+        '''
+        import numpy as np
+
+        if spent is not None:
+            from time import perf_counter as clock
+            lap = clock()
+        compiled = self.compiled
+        length = compiled.line_lengths[self.line]
+        # Switches direction if an end station is reached.
+        self.direction[self.position == 0] = self.SOUTH
+        self.direction[self.position == length - 1] = self.NORTH
+        if spent is not None:
+            now = clock()
+            spent["lookup"] += now - lap
+            lap = now
+
+        # Simulates delays by comparing one draw per train with the delay probability of its position.
+        if isinstance(generator, CounterRNG):
+            draws = generator.uniform(self.train_ids, tick, CounterRNG.DELAY)
+        else:
+            draws = generator.random(len(self.train_ids))
+        self.delayed = draws < self.position_delay[compiled.line_offsets[self.line] + self.position]
+        if spent is not None:
+            now = clock()
+            spent["delay"] += now - lap
+            lap = now
+
+        # Moves every train that didn't get delayed one station in its direction
+        # (wrapping around on lines with a single station, like advance_time() does).
+        self.position = (self.position + np.where(self.delayed, 0, self.direction)) % length
+        if spent is not None:
+            spent["move"] += clock() - lap
+    
+
+    @classmethod
+    def moved(cls, position, direction, length, delayed):
+        '''
+        Function that works out where trains are after a time unit from whether they got delayed in it,
+        as the rest of step()'s rules don't need any random numbers (used to record and replay simulations, see ReplayRecorder).
+
+        Parameters: The trains' positions and directions before the time unit, the lengths of their lines,
+        and their delayed statuses in it, as arrays.
+
+        Returns: (the new positions, the new directions), as new arrays.
+
+        '''
+        import numpy as np
+
+        direction = np.where(position == length - 1, np.int8(cls.NORTH), np.where(position == 0, np.int8(cls.SOUTH), direction))
+        position = np.where(delayed, position, position + direction)
+        # After switching direction a train can only leave its line on a line with a single station, where step() wraps it back to 0.
+        return np.maximum(position, 0, out=position), direction
+    
+
+    def station_ids(self):
+        '''
+        Function that returns the ID of the station every train is at, as an array.
+
+        '''
+        return self.compiled.line_stations[self.compiled.line_offsets[self.line] + self.position]
+    
+
+    def row(self, train_id):
+        '''
+        Function that returns the array index of a train.
+
+        Parameter: The train's ID number.
+
+        '''
+        if self.index is None:
+            self.index = {train_id: i for i, train_id in enumerate(self.train_ids.tolist())}
+        return self.index[train_id]
+    
+
+    def station_of(self, i):
+        '''
+        Function that returns the Station object the train at index i is at.
+
+        '''
+        return self.stations[self.compiled.station_at(self.line[i], self.position[i])]
+    
+
+    def sync_train(self, train):
+        '''
+        Function that copies the array state of a train back into its Train object,
+        moving it between the stations' train lists if it changed station.
+
+        Parameter: A Train object.
+
+        '''
+        i = self.row(train.train_id)
+        station = self.station_of(i)
+        if station is not train.station:
+            train.station.remove_train(train)
+            station.add_train(train)
+            train.station = station
+        train.direction = "North" if self.direction[i] == self.NORTH else "South"
+        train.train_delayed = bool(self.delayed[i])
+
+
+class DepartureQueue:
+    '''
+    The DepartureQueue class is the state of the event engine (see RailNetwork.advance_time_event()).
+
+    A train's stay at a station is a geometric random variable, as it gets delayed with the station's
+    delay probability in every time unit. So instead of drawing a delay for every train in every time unit,
+    the event engine draws each train's whole stay once when it arrives, keeps the trains in a priority queue
+    ordered by departure, and jumps from departure to departure, which costs O(departures) instead of
+    O(time units · trains). The queue is a calendar queue: departures are whole time units, so the trains
+    are kept in a bucket for each time unit, and only the time units with departures are in a heap.
+
+    Attributes:
+
+    arrays: The TrainArrays the queue moves trains in (and keeps the directions and delayed statuses of up to date).
+    arrival: The time unit each train arrived at its station, as an array.
+    buckets: The indexes of the trains that depart in each time unit, by time unit.
+    heap: The time units that have a bucket, kept as a heapq.
+    spells: A list that every departure is added to as train index, line position and time unit
+    (three items each), for DelayStatistics (None to not record them).
+    rng: The CounterRNG the stays are drawn with (None to draw them with the random module).
+
+    Warning: Needs the numpy module to work.
+
+    '''
+    NEVER = -1
+
+
+    def __init__(self, arrays, tick, arrival=None, departure=None, rng=None):
+        '''
+        Function that initializes the DepartureQueue object, drawing every train's stay at its current station
+        (unless the arrival and departure arrays of a saved queue are given, see departures()).
+
+        Parameters: A TrainArrays object; the current time unit; optionally the arrival and departure arrays;
+        and optionally a CounterRNG to draw the stays with.
+
+        Warning: Needs the math, heapq and random modules to work.
+
+        '''
+        import heapq
+        import math
+        import numpy as np
+
+        self.arrays = arrays
+        self.rng = rng
+        self.log = math.log
+        compiled = arrays.compiled
+        self.lengths = compiled.line_lengths.tolist()
+        self.offsets = compiled.line_offsets.tolist()
+        # Stays are drawn by inversion, floor(log(U) / log(p)), so 1 / log(p) is stored for every line position
+        # (0 if trains are never delayed there, and None if they're always delayed).
+        self.scale = [None if p >= 1 else 0.0 if p <= 0 else 1 / math.log(p) for p in arrays.position_delay.tolist()]
+        # Python lists of the trains' state, which are much faster to update one train at a time than arrays.
+        self.line = arrays.line.tolist()
+        self.position = arrays.position.tolist()
+        self.direction = arrays.direction.tolist()
+
+        if departure is None:
+            # A train that got delayed in the last time unit has been at its station since before it.
+            self.arrival = np.where(arrays.delayed, tick - 1, tick).astype(np.int64)
+            offsets = self.offsets
+            draws = rng.uniform(arrays.train_ids, tick, CounterRNG.STAY).tolist() if rng is not None else [None] * len(arrays)
+            departure = [self.leave(tick, offsets[j] + p, u) for j, p, u in zip(self.line, self.position, draws)]
+        else:
+            self.arrival = np.array(arrival, dtype=np.int64)
+            departure = departure.tolist()
+        self.buckets = defaultdict(list)
+        for i, leave in enumerate(departure):
+            if leave != self.NEVER:
+                self.buckets[leave].append(i)
+        self.buckets = dict(self.buckets)
+        self.heap = list(self.buckets)
+        heapq.heapify(self.heap)
+        self.spells = None
+    
+
+    def leave(self, tick, slot, u=None):
+        '''
+        Function that draws when a train that is at a line position in a time unit will leave it.
+
+        Parameters: The time unit; the line position (line offset + position);
+        and optionally the uniform draw to use (one from the random module if None).
+
+        Returns: The time unit it departs in, or NEVER.
+
+        '''
+        scale = self.scale[slot]
+        if scale is None:
+            return self.NEVER
+        if u is None:
+            u = random.random()
+        # The number of time units it gets delayed for (1 - u is never 0, so the log always exists).
+        return tick + 1 + int(self.log(1.0 - u) * scale)
+    
+
+    def departures(self):
+        '''
+        Function that returns the time unit every train departs in (NEVER if it won't), for saving the queue.
+
+        Returns: An array.
+
+        '''
+        import numpy as np
+
+        departure = np.full(len(self.position), self.NEVER, dtype=np.int64)
+        for leave, rows in self.buckets.items():
+            departure[rows] = leave
+        return departure
+    
+
+    def advance(self, until):
+        '''
+        Function that moves every train that departs up to and including a time unit, in order of departure,
+        and draws how long each one will stay at its next station.
+
+        Parameter: The time unit to advance to.
+
+        Returns: (the indexes of the trains that moved, the indexes of the trains that switched direction before moving).
+
+        '''
+        import numpy as np
+        from heapq import heappop, heappush
+
+        line, position, direction = self.line, self.position, self.direction
+        buckets, heap = self.buckets, self.heap
+        lengths, offsets, scale, log, draw = self.lengths, self.offsets, self.scale, self.log, random.random
+        north, south = TrainArrays.NORTH, TrainArrays.SOUTH
+        spells = self.spells
+        rng, train_ids = self.rng, self.arrays.train_ids
+        draws = None
+        moved = []
+        arrived = []
+        reversals = []
+        while heap and heap[0] <= until:
+            tick = heappop(heap)
+            # Trains that depart in the same time unit go in order, so the order never depends on the history.
+            bucket = sorted(buckets.pop(tick))
+            moved.extend(bucket)
+            arrived.extend([tick] * len(bucket))
+            if rng is not None:
+                # The stays of the bucket's trains at their next stations, keyed by train ID and arrival time unit.
+                draws = rng.uniform(train_ids[bucket], tick, CounterRNG.STAY).tolist()
+            for k, i in enumerate(bucket):
+                j = line[i]
+                current = position[i]
+                length = lengths[j]
+                # Switches direction if an end station is reached (like TrainArrays.step()).
+                heading = direction[i]
+                if current == 0:
+                    heading = south
+                if current == length - 1:
+                    heading = north
+                if heading != direction[i]:
+                    direction[i] = heading
+                    reversals.append(i)
+                if spells is not None:
+                    spells += (i, offsets[j] + current, tick)
+                current = (current + heading) % length
+                position[i] = current
+                # Draws its stay at the next station (like leave(), which is inlined here for speed).
+                stay = scale[offsets[j] + current]
+                if stay is not None:
+                    leave = tick + 1 + int(log(1.0 - (draw() if draws is None else draws[k])) * stay)
+                    later = buckets.get(leave)
+                    if later is None:
+                        buckets[leave] = [i]
+                        heappush(heap, leave)
+                    else:
+                        later.append(i)
+
+        # Copies the new state of the trains that moved into the arrays
+        # (a train that moved several times gets its last state, as later assignments win).
+        if moved:
+            rows = np.array(moved, dtype=np.int64)
+            arrays = self.arrays
+            arrays.position[rows] = [position[i] for i in moved]
+            arrays.direction[rows] = [direction[i] for i in moved]
+            self.arrival[rows] = arrived
+        return moved, reversals
+    
+
+    def refresh(self, tick):
+        '''
+        Function that brings the directions and delayed statuses of the trains that didn't move up to a time unit:
+        a train waiting at the end of its line has switched direction since the time unit after it arrived.
+
+        Parameter: The current time unit.
+
+        Returns: The indexes of the trains that switched direction.
+
+        '''
+        import numpy as np
+
+        arrays = self.arrays
+        waiting = self.arrival < tick
+        length = arrays.compiled.line_lengths[arrays.line]
+        direction = arrays.direction.copy()
+        direction[waiting & (arrays.position == 0)] = TrainArrays.SOUTH
+        direction[waiting & (arrays.position == length - 1)] = TrainArrays.NORTH
+        reversals = np.flatnonzero(direction != arrays.direction)
+        arrays.direction[reversals] = direction[reversals]
+        for i, heading in zip(reversals.tolist(), direction[reversals].tolist()):
+            self.direction[i] = heading
+        arrays.delayed = self.arrival != tick
+        return reversals
+
+
+class TrainSnapshot:
+    '''
+    The TrainSnapshot class is an immutable copy of every train's state after a completed time unit
+    (see RailNetwork.snapshot()). Its arrays are read-only, and the simulation never changes them,
+    so any number of readers can use a snapshot without a lock while the next time units are simulated.
+
+    Attributes:
+
+    tick: The time unit the snapshot was taken after.
+    compiled: The CompiledNetwork the line and position indexes refer to.
+    train_ids, line, position, direction, delayed: The trains' state, as in TrainArrays.
+
+    Warning: Needs the numpy module to work.
+
+    '''
+
+    def __init__(self, tick, compiled, rows, train_ids, line, position, direction, delayed):
+        '''
+        Function that initializes the TrainSnapshot object.
+
+        Parameters: The time unit; the CompiledNetwork; a dictionary of train ID -> array index;
+        and the read-only arrays.
+
+        '''
+        self.tick = tick
+        self.compiled = compiled
+        self.rows = rows
+        self.train_ids = train_ids
+        self.line = line
+        self.position = position
+        self.direction = direction
+        self.delayed = delayed
+    
+
+    def __len__(self):
+        '''
+        Function that returns the number of trains in the snapshot.
+
+        '''
+        return len(self.train_ids)
+    
+
+    def station_ids(self):
+        '''
+        Function that returns the ID of the station every train is at, as an array.
+
+        '''
+        return self.compiled.line_stations[self.compiled.line_offsets[self.line] + self.position]
+    
+
+    def occupancy(self):
+        '''
+        Function that returns the number of trains at every station, as an array (by station ID).
+
+        '''
+        import numpy as np
+
+        return np.bincount(self.station_ids(), minlength=len(self.compiled.station_names))
+    
+
+    def train_state(self, train_id):
+        '''
+        Function that returns the state of one train, like RailNetwork.train_state() does.
+
+        Parameter: The train's ID number.
+
+        Returns: A dictionary (raises a KeyError if there is no such train).
+
+        '''
+        i = self.rows[train_id]
+        compiled = self.compiled
+        return {"train_id": train_id, "line": compiled.line_names[self.line[i]],
+                "station": compiled.station_names[compiled.station_at(self.line[i], self.position[i])],
+                "direction": "North" if self.direction[i] == TrainArrays.NORTH else "South", "delayed": bool(self.delayed[i])}
+
+
+class SnapshotBuffers:
+    '''
+    The SnapshotBuffers class publishes a TrainSnapshot after every time unit with two sets of buffers:
+    the state is copied into the back buffer, which then becomes the front one, so publishing costs one
+    array copy of the positions, directions and delayed statuses (10 bytes per train) instead of a deep copy.
+    The train IDs and lines only change when trains are added, so they are only copied then.
+
+    A back buffer is only reused if no reader still has its snapshot (or a view of its arrays),
+    otherwise a new one is made, so a snapshot never changes however long it is kept.
+
+    Attributes:
+
+    latest: The TrainSnapshot of the last completed time unit.
+    buffers: The two sets of arrays, as dictionaries of attribute name -> array.
+    front: The index of the buffer set the latest snapshot uses.
+
+    Warning: Needs the numpy and sys modules to work.
+
+    '''
+    CHANGING = ("position", "direction", "delayed")
+    # References to a buffer array that aren't readers' when in_use() counts them:
+    # the buffer dictionary, the loop variable and sys.getrefcount()'s argument.
+    OWN_REFERENCES = 3
+    
+
+    def __init__(self):
+        '''
+        Function that initializes the SnapshotBuffers object, without any snapshot yet.
+
+        '''
+        self.latest = None
+        self.buffers = [None, None]
+        self.front = 0
+        self.sources = None # The train ID and line arrays the constant arrays were copied from.
+        self.constant = None # Read-only copies of the train IDs and lines, with the train ID -> index dictionary.
+    
+
+    def in_use(self, buffer):
+        '''
+        Function that checks whether a reader still has a snapshot made from a set of buffers.
+
+        Parameter: A set of buffers (a dictionary of attribute name -> array).
+
+        Returns: True if any of its arrays is still referenced from outside, otherwise False.
+
+        '''
+        for array in buffer.values():
+            if sys.getrefcount(array) > self.OWN_REFERENCES:
+                return True
+        return False
+    
+
+    def publish(self, arrays, tick):
+        '''
+        Function that copies the state of every train into the back buffer and makes it the latest snapshot.
+
+        Parameters: The TrainArrays with the state, and the time unit it's the state after.
+
+        Returns: The TrainSnapshot.
+
+        '''
+        import numpy as np
+
+        if self.sources is None or (self.sources[0] is not arrays.train_ids or self.sources[1] is not arrays.line) and not (
+                np.array_equal(self.sources[0], arrays.train_ids) and np.array_equal(self.sources[1], arrays.line)):
+            # The trains have changed, so the constant arrays and the index are copied again (and both buffers dropped).
+            train_ids, line = arrays.train_ids.copy(), arrays.line.copy()
+            train_ids.flags.writeable = line.flags.writeable = False
+            self.constant = (train_ids, line, {train_id: i for i, train_id in enumerate(train_ids.tolist())})
+            self.buffers = [None, None]
+        self.sources = (arrays.train_ids, arrays.line)
+
+        back = 1 - self.front
+        buffer = self.buffers[back]
+        if buffer is None or self.in_use(buffer):
+            buffer = {name: np.empty_like(getattr(arrays, name)) for name in self.CHANGING}
+            self.buffers[back] = buffer
+        views = {}
+        for name in self.CHANGING:
+            np.copyto(buffer[name], getattr(arrays, name))
+            views[name] = buffer[name].view()
+            views[name].flags.writeable = False
+        train_ids, line, rows = self.constant
+        self.latest = TrainSnapshot(tick, arrays.compiled, rows, train_ids, line, views["position"], views["direction"], views["delayed"])
+        self.front = back
+        return self.latest
+
+
+class OccupancyIndex:
+    '''
+    The OccupancyIndex class keeps counts of where the trains are and which are delayed,
+    updated after every time unit from only the trains that changed (see RailNetwork.occupancy_index()),
+    so that questions like "how many trains are at station X", "how many trains on the red line are delayed"
+    or "which are the busiest stations" don't need a pass over every train.
+
+    The lists of trains at a station and of delayed trains on a line are kept as compressed sparse rows
+    (the train indexes sorted by station or line, plus where each one starts), built again the first time
+    they're asked for after a time unit, and then answered in time proportional to the answer.
+
+    Attributes:
+
+    slot_counts: The number of trains at every line position (line offset + position), so each line's
+    slice of it is that line's occupancy vector.
+    station_counts: The number of trains at every station, by station ID.
+    line_delayed: The number of delayed trains on every line, by line ID.
+    delayed_total: The number of delayed trains.
+    tick: The time unit the index is up to date with (None if it has to be built again).
+
+    Warning: Needs the numpy module to work.
+
+    '''
+    RECOUNT = 8 # Every train is counted again instead if more than 1 / RECOUNT of them changed.
+
+
+    def __init__(self, arrays, tick):
+        '''
+        Function that initializes the OccupancyIndex object by counting every train once.
+
+        Parameters: The TrainArrays to index, and the current time unit.
+
+        '''
+        import numpy as np
+
+        compiled = arrays.compiled
+        self.compiled = compiled
+        self.train_ids = arrays.train_ids
+        self.line = arrays.line
+        self.offsets = compiled.line_offsets[arrays.line]
+        # The last indexed state, to find the trains that changed.
+        self.position = arrays.position.copy()
+        self.delayed = arrays.delayed.copy()
+        self.slot_counts = np.bincount(self.offsets + self.position, minlength=len(compiled.line_stations))
+        self.station_counts = np.bincount(compiled.line_stations[self.offsets + self.position], minlength=len(compiled.station_names))
+        self.line_delayed = np.bincount(self.line[self.delayed], minlength=len(compiled.line_names))
+        self.delayed_total = int(np.count_nonzero(self.delayed))
+        self.by_station = None # (train indexes sorted by station, start of every station), built when first needed.
+        self.delayed_by_line = None # (delayed train indexes sorted by line, start of every line), built when first needed.
+        self.tick = tick
+    
+
+    def indexes(self, arrays):
+        '''
+        Function that checks whether the index covers the same trains as some TrainArrays, in the same order.
+
+        Parameter: A TrainArrays object.
+
+        Returns: True if it does, otherwise False.
+
+        '''
+        import numpy as np
+
+        if arrays.compiled is not self.compiled:
+            return False
+        if arrays.train_ids is self.train_ids and arrays.line is self.line:
+            return True
+        return np.array_equal(arrays.train_ids, self.train_ids) and np.array_equal(arrays.line, self.line)
+    
+
+    def update(self, arrays, tick):
+        '''
+        Function that brings the index up to date with a later state of the same trains,
+        changing the counts only for the trains that moved or whose delayed status changed.
+
+        Parameters: The TrainArrays, and the current time unit.
+
+        '''
+        import numpy as np
+
+        stations = self.compiled.line_stations
+        changed = arrays.position != self.position
+        count = np.count_nonzero(changed)
+        if count > len(self.position) // self.RECOUNT:
+            # When most trains moved (as with the array engine), counting them all again is cheaper.
+            np.copyto(self.position, arrays.position)
+            self.slot_counts = np.bincount(self.offsets + self.position, minlength=len(stations))
+        elif count:
+            rows = np.flatnonzero(changed)
+            before = self.offsets[rows] + self.position[rows]
+            after = self.offsets[rows] + arrays.position[rows]
+            # Subtracts the trains from where they were and adds them where they are.
+            self.slot_counts += np.bincount(after, minlength=len(stations)) - np.bincount(before, minlength=len(stations))
+            self.position[rows] = arrays.position[rows]
+        if count:
+            # Adds up the line positions of every station, which doesn't depend on the number of trains.
+            self.station_counts = np.bincount(stations, weights=self.slot_counts, minlength=len(self.station_counts)).astype(np.int64)
+            self.by_station = None
+
+        flipped = arrays.delayed != self.delayed
+        count = np.count_nonzero(flipped)
+        if count > len(self.delayed) // self.RECOUNT:
+            np.copyto(self.delayed, arrays.delayed)
+            self.line_delayed = np.bincount(self.line[self.delayed], minlength=len(self.line_delayed))
+            self.delayed_total = int(np.count_nonzero(self.delayed))
+        elif count:
+            rows = np.flatnonzero(flipped)
+            became = arrays.delayed[rows]
+            lines = self.line[rows]
+            self.line_delayed += (np.bincount(lines[became], minlength=len(self.line_delayed))
+                                  - np.bincount(lines[~became], minlength=len(self.line_delayed)))
+            self.delayed_total += 2 * int(np.count_nonzero(became)) - len(rows)
+            self.delayed[rows] = became
+        if count:
+            self.delayed_by_line = None
+        self.tick = tick
+    
+
+    def grouped(self, keys, rows, counts):
+        '''
+        Function that sorts some train indexes by a key, and finds where the trains of each key start.
+
+        Parameters: The key of every train; the train indexes to sort; and how many trains each key has.
+
+        Returns: (the sorted train indexes, the start of every key, with the end as the last one).
+
+        '''
+        import numpy as np
+
+        order = rows[np.argsort(keys[rows], kind="stable")]
+        starts = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=starts[1:])
+        return order, starts
+    
+
+    def trains_at(self, station_id):
+        '''
+        Function that returns the IDs of the trains at a station.
+
+        Parameter: The station's ID.
+
+        Returns: An array of train IDs (in the order of the train arrays).
+
+        '''
+        import numpy as np
+
+        if self.by_station is None:
+            stations = self.compiled.line_stations[self.offsets + self.position]
+            self.by_station = self.grouped(stations, np.arange(len(stations)), self.station_counts)
+        order, starts = self.by_station
+        return self.train_ids[order[starts[station_id]:starts[station_id + 1]]]
+    
+
+    def delayed_trains(self, line_id=None):
+        '''
+        Function that returns the IDs of the delayed trains, on one line or on every line.
+
+        Parameter: The line's ID (optional).
+
+        Returns: An array of train IDs (sorted by line, then in the order of the train arrays).
+
+        '''
+        import numpy as np
+
+        if self.delayed_by_line is None:
+            self.delayed_by_line = self.grouped(self.line, np.flatnonzero(self.delayed), self.line_delayed)
+        order, starts = self.delayed_by_line
+        if line_id is None:
+            return self.train_ids[order]
+        return self.train_ids[order[starts[line_id]:starts[line_id + 1]]]
+    
+
+    def line_occupancy(self, line_id):
+        '''
+        Function that returns the number of trains at every position of a line.
+
+        Parameter: The line's ID.
+
+        Returns: A read-only array, from the line's first station to its last.
+
+        '''
+        start = self.compiled.line_offsets[line_id]
+        occupancy = self.slot_counts[start:start + self.compiled.line_lengths[line_id]].view()
+        occupancy.flags.writeable = False
+        return occupancy
+    
+
+    def busiest(self, count):
+        '''
+        Function that returns the stations with the most trains.
+
+        Parameter: The number of stations.
+
+        Returns: An array of station IDs, the busiest first.
+
+        '''
+        import numpy as np
+
+        counts = self.station_counts
+        count = min(count, len(counts))
+        if count <= 0:
+            return np.zeros(0, dtype=np.int64)
+        top = np.argpartition(-counts, count - 1)[:count]
+        return top[np.lexsort((top, -counts[top]))]
+
+
+class EventLog:
+    '''
+    The EventLog class records what happens to the trains during a simulation 
+    (departures, arrivals, delays and direction reversals) to a file.
+
+    Events are buffered and written in large blocks, either as JSON lines 
+    or as compact fixed-width binary records (see EVENT_DTYPE and read_event_log()).
+
+    A binary log starts with b"RNEV", the format version and the length of a JSON header 
+    (with the station, line and event names) as little-endian 32-bit integers, then the header,
+    then one 16 byte record per event.
+
+    Warning: Needs the numpy module to work.
+
+    '''
+    KINDS = ("departure", "arrival", "delay", "reversal")
+    DEPARTURE, ARRIVAL, DELAY, REVERSAL = range(4)
+    EVENT_DTYPE = [("tick", "<u4"), ("train", "<u4"), ("station", "<u4"), ("line", "<u2"), ("kind", "u1"), ("direction", "i1")]
+    MAGIC = b"RNEV"
+    VERSION = 1
+
+
+    def __init__(self, file, compiled, format="jsonl", buffer_events=1 << 16):
+        '''
+        Function that initializes the EventLog object and opens its file.
+
+        Parameters: A file name; the CompiledNetwork the station and line IDs belong to;
+        the format ("jsonl" or "binary"); and how many events to buffer before writing them.
+
+        '''
+        import json
+        import struct
+
+        if format not in ("jsonl", "binary"):
+            raise ValueError(f"Unknown event log format {format!r}, choose jsonl or binary")
+        self.format = format
+        self.compiled = compiled
+        self.buffer_events = buffer_events
+        self.pending = [] # Single events, as tuples in EVENT_DTYPE order.
+        self.batches = [] # Batches of events, as arrays.
+        self.buffered = 0
+        self.file = open(file, "wb", buffering=1 << 20)
+        if format == "binary":
+            header = json.dumps({"stations": compiled.station_names, "lines": compiled.line_names, "kinds": self.KINDS}).encode()
+            self.file.write(self.MAGIC + struct.pack("<II", self.VERSION, len(header)) + header)
+        else:
+            # Station and line names already encoded as JSON strings.
+            self.station_json = [json.dumps(name) for name in compiled.station_names]
+            self.line_json = [json.dumps(name) for name in compiled.line_names]
+    
+
+    def record(self, tick, kind, train_id, station_id, line_id, direction):
+        '''
+        Function that records one event.
+
+        Parameters: The time unit; the kind of event (see KINDS); the train's ID number;
+        the station and line IDs; and the train's direction after the event (-1 North, 1 South).
+
+        '''
+        self.pending.append((tick, train_id, station_id, line_id, kind, direction))
+        self.buffered += 1
+        if self.buffered >= self.buffer_events:
+            self.flush()
+    
+
+    def record_batch(self, tick, kind, train_ids, station_ids, line_ids, directions):
+        '''
+        Function that records one kind of event for many trains at once.
+
+        Parameters: The time unit; the kind of event; and arrays of train ID numbers,
+        station IDs, line IDs and directions, one element per event.
+
+        '''
+        import numpy as np
+
+        if not len(train_ids):
+            return
+        batch = np.empty(len(train_ids), dtype=self.EVENT_DTYPE)
+        batch["tick"] = tick
+        batch["train"] = train_ids
+        batch["station"] = station_ids
+        batch["line"] = line_ids
+        batch["kind"] = kind
+        batch["direction"] = directions
+        self.batches.append(batch)
+        self.buffered += len(batch)
+        if self.buffered >= self.buffer_events:
+            self.flush()
+    
+
+    def flush(self):
+        '''
+        Function that writes the buffered events to the file in one block.
+
+        '''
+        import numpy as np
+
+        if self.pending:
+            self.batches.append(np.array(self.pending, dtype=self.EVENT_DTYPE))
+            self.pending = []
+        if not self.batches:
+            return
+        events = np.concatenate(self.batches)
+        self.batches = []
+        self.buffered = 0
+        if self.format == "binary":
+            self.file.write(events.tobytes())
+        else:
+            kinds, stations, lines = self.KINDS, self.station_json, self.line_json
+            directions = {-1: "North", 1: "South"}
+            self.file.write("".join(
+                f'{{"tick": {tick}, "event": "{kinds[kind]}", "train": {train}, "station": {stations[station]}, "line": {lines[line]}, "direction": "{directions[direction]}"}}\n'
+                for tick, train, station, line, kind, direction in events.tolist()).encode())
+    
+
+    def close(self):
+        '''
+        Function that writes the remaining events and closes the file.
+
+        '''
+        self.flush()
+        self.file.close()
+
+
+def pack_strings(strings):
+    '''
+    Function that packs strings into one UTF-8 byte array, and an array of where each string ends.
+
+    Parameter: A sequence of strings.
+
+    Warning: Needs the numpy module to work.
+
+    '''
+    import numpy as np
+
+    encoded = [string.encode() for string in strings]
+    ends = np.cumsum([len(string) for string in encoded], dtype=np.int64)
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), ends
+
+
+def unpack_strings(blob, ends):
+    '''
+    Function that unpacks the strings packed by pack_strings().
+
+    Parameters: The byte array and the array of where each string ends.
+
+    Returns: A list of strings.
+
+    '''
+    data = bytes(blob)
+    starts = [0] + ends.tolist()
+    return [data[start:end].decode() for start, end in zip(starts, starts[1:])]
+
+
+def read_event_log(file):
+    '''
+    Function that opens a binary event log without loading it into memory.
+
+    Parameter: The file name of a binary EventLog.
+
+    Returns: The JSON header (station, line and event names) and a memory-mapped
+    array of the events, with the fields of EventLog.EVENT_DTYPE.
+
+    Warning: Needs the numpy module to work.
+
+    '''
+    import json
+    import struct
+    import numpy as np
+
+    with open(file, "rb") as f:
+        magic = f.read(4)
+        if magic != EventLog.MAGIC:
+            raise ValueError(f"{file} is not a binary event log")
+        version, header_length = struct.unpack("<II", f.read(8))
+        if version != EventLog.VERSION:
+            raise ValueError(f"{file} is an event log of version {version}, only version {EventLog.VERSION} can be read")
+        header = json.loads(f.read(header_length))
+    offset = 12 + header_length
+    events = np.memmap(file, dtype=EventLog.EVENT_DTYPE, mode="r", offset=offset) if os.path.getsize(file) > offset \
+        else np.empty(0, dtype=EventLog.EVENT_DTYPE)
+    return header, events
+
+
+class ReplayRecorder:
+    '''
+    The ReplayRecorder class records a simulation to a file that Replay can seek in (see RailNetwork.record_replay()).
+
+    Trains only ever move one station along their line, or switch direction at its ends, and where a train is
+    after a time unit only depends on where it was, its direction and whether it got delayed (see TrainArrays.moved()).
+    So every time unit is recorded as one bit per train, its delayed status, and every train's whole state
+    is only recorded as a keyframe every interval time units (or when something else changed the trains, like add_train()).
+
+    The file starts with b"RNRP", the format version and the length of a JSON header (the stations, their delay
+    probabilities, the connections and the interval) as little-endian 32-bit integers, then the header.
+    Then come the records, each starting with its kind and time unit (a byte and a 64-bit integer):
+
+    K (keyframe): the number of trains, then their IDs, lines, positions, directions and delayed statuses (see KEYFRAME).
+    D (delta): every train's delayed status as one bit (see numpy.packbits()), in the order of the last keyframe.
+    I (index, written by close()): the number of keyframes, then their time units and file offsets as 64-bit integers,
+    followed by the index's offset and b"RNRI" at the very end of the file.
+
+    Attributes:
+
+    interval: The number of time units between keyframes.
+    tick: The last time unit recorded.
+    keyframes: The (time unit, file offset) of every keyframe.
+
+    Warning: Needs the numpy module to work.
+
+    '''
+    MAGIC = b"RNRP"
+    INDEX_MAGIC = b"RNRI"
+    VERSION = 1
+    KEYFRAME = (("train_ids", "<i8"), ("line", "<i4"), ("position", "<i4"), ("direction", "i1"), ("delayed", "u1"))
+
+
+    def __init__(self, file, network, arrays, tick, interval=200):
+        '''
+        Function that initializes the ReplayRecorder object, opens its file and records the first keyframe.
+
+        Parameters: A file name; the RailNetwork; its TrainArrays; the current time unit;
+        and the number of time units between keyframes.
+
+        '''
+        import json
+        import struct
+
+        if interval < 1:
+            raise ValueError("The keyframe interval has to be at least 1")
+        compiled = network.compile()
+        self.compiled = compiled
+        self.interval = interval
+        self.keyframes = []
+        names = compiled.station_names
+        header = {"stations": names, "delay_probabilities": [network.stations[name].delay_probability for name in names],
+                  "lines": compiled.line_names, "interval": interval,
+                  "connections": [[names[source], names[target], compiled.line_names[line], direction] for source, target, line, direction in
+                                  zip(compiled.edge_sources.tolist(), compiled.edge_targets.tolist(), compiled.edge_lines.tolist(), compiled.edge_directions)]}
+        encoded = json.dumps(header).encode()
+        self.file = open(file, "wb", buffering=1 << 20)
+        self.file.write(self.MAGIC + struct.pack("<II", self.VERSION, len(encoded)) + encoded)
+        self.keyframe(arrays, tick)
+    
+
+    def keyframe(self, arrays, tick):
+        '''
+        Function that records the whole state of every train.
+
+        Parameters: The TrainArrays, and the time unit.
+
+        '''
+        import struct
+        import numpy as np
+
+        self.keyframes.append((tick, self.file.tell()))
+        self.file.write(struct.pack("<cqq", b"K", tick, len(arrays)))
+        for name, dtype in self.KEYFRAME:
+            self.file.write(np.ascontiguousarray(getattr(arrays, name), dtype=dtype).tobytes())
+        # The state the next time unit is worked out from, to check that it only moved the trains.
+        self.train_ids = arrays.train_ids
+        self.line = arrays.line
+        self.length = self.compiled.line_lengths[arrays.line]
+        self.position = arrays.position.copy()
+        self.direction = arrays.direction.copy()
+        self.key_tick = self.tick = tick
+    
+
+    def record(self, arrays, tick):
+        '''
+        Function that records a time unit, as the delayed status of every train,
+        or as a keyframe if it's time for one or the trains changed in some other way.
+
+        Parameters: The TrainArrays after the time unit, and the time unit.
+
+        '''
+        import struct
+        import numpy as np
+
+        same = tick == self.tick + 1 and tick - self.key_tick < self.interval and len(arrays) == len(self.position) and (
+            arrays.train_ids is self.train_ids and arrays.line is self.line or
+            np.array_equal(arrays.train_ids, self.train_ids) and np.array_equal(arrays.line, self.line))
+        if same:
+            position, direction = TrainArrays.moved(self.position, self.direction, self.length, arrays.delayed)
+            same = np.array_equal(position, arrays.position) and np.array_equal(direction, arrays.direction)
+        if not same:
+            self.keyframe(arrays, tick)
+            return
+        self.file.write(struct.pack("<cq", b"D", tick) + np.packbits(arrays.delayed).tobytes())
+        self.position, self.direction = position, direction
+        self.tick = tick
+    
+
+    def close(self):
+        '''
+        Function that writes the keyframe index and closes the file.
+
+        '''
+        import struct
+        import numpy as np
+
+        offset = self.file.tell()
+        ticks = np.array([tick for tick, _ in self.keyframes], dtype="<i8")
+        offsets = np.array([start for _, start in self.keyframes], dtype="<i8")
+        self.file.write(struct.pack("<cqq", b"I", self.tick, len(self.keyframes)) + ticks.tobytes() + offsets.tobytes())
+        self.file.write(struct.pack("<q", offset) + self.INDEX_MAGIC)
+        self.file.close()
+
+
+class Replay:
+    '''
+    The Replay class reads a simulation recorded by ReplayRecorder. It seeks to any recorded time unit
+    by decoding at most one keyframe interval of time units from the keyframe before it,
+    and steps forward one delta at a time (or backward by seeking again).
+
+    The file is memory-mapped, so only the records that are needed are read. A file that wasn't closed
+    (so has no index) is scanned for its keyframes instead, up to the last whole record.
+
+    Attributes:
+
+    network: A RailNetwork with the recorded stations and connections (and no trains).
+    compiled: Its CompiledNetwork, which the line and position indexes refer to.
+    interval: The number of time units between keyframes.
+    keyframe_ticks: The time unit of every keyframe, as an array.
+    first_tick, last_tick: The first and last recorded time units.
+    tick: The time unit the replay is at (the first one to begin with).
+    arrays: The TrainArrays of every train's state at that time unit.
+
+    Warning: Needs the numpy module to work.
+
+    '''
+    KEYFRAME_BYTES = 8 + 4 + 4 + 1 + 1 # Per train, see ReplayRecorder.KEYFRAME.
+
+
+    def __init__(self, file):
+        '''
+        Function that initializes the Replay object and seeks to the first recorded time unit.
+
+        Parameter: The file name of a recording.
+
+        '''
+        import json
+        import struct
+        import numpy as np
+
+        with open(file, "rb") as f:
+            if f.read(len(ReplayRecorder.MAGIC)) != ReplayRecorder.MAGIC:
+                raise ValueError(f"{file} is not a replay recording")
+            version, header_length = struct.unpack("<II", f.read(8))
+            if version != ReplayRecorder.VERSION:
+                raise ValueError(f"{file} is a recording of version {version}, only version {ReplayRecorder.VERSION} can be read")
+            header = json.loads(f.read(header_length))
+        self.start = len(ReplayRecorder.MAGIC) + 8 + header_length
+        self.interval = header["interval"]
+        self.network = RailNetwork()
+        for name, delay_probability in zip(header["stations"], header["delay_probabilities"]):
+            self.network.add_station(Station(name, delay_probability))
+        for source, target, line, direction in header["connections"]:
+            self.network.add_connection(source, target, line, direction)
+        self.compiled = self.network.compile()
+
+        self.data = np.memmap(file, dtype=np.uint8, mode="r")
+        data = self.data
+        if len(data) >= self.start + 12 and bytes(data[-4:]) == ReplayRecorder.INDEX_MAGIC:
+            offset = struct.unpack("<q", bytes(data[-12:-4]))[0]
+            _, self.last_tick, count = struct.unpack_from("<cqq", data, offset)
+            self.keyframe_ticks = np.frombuffer(data, dtype="<i8", count=count, offset=offset + 17)
+            self.keyframe_offsets = np.frombuffer(data, dtype="<i8", count=count, offset=offset + 17 + 8 * count)
+        else:
+            self.scan()
+        if not len(self.keyframe_ticks):
+            raise ValueError(f"{file} has no recorded time units")
+        self.first_tick = int(self.keyframe_ticks[0])
+        self.segment = None
+        self.seek(self.first_tick)
+    
+
+    def scan(self):
+        '''
+        Function that finds the keyframes and the last time unit of a recording without an index,
+        stopping at the first incomplete record.
+
+        '''
+        import struct
+        import numpy as np
+
+        data = self.data
+        size = len(data)
+        ticks, offsets = [], []
+        offset = self.start
+        count = None
+        self.last_tick = None
+        while offset + 9 <= size:
+            kind, tick = struct.unpack_from("<cq", data, offset)
+            if kind == b"K" and offset + 17 <= size:
+                count = struct.unpack_from("<q", data, offset + 9)[0]
+                end = offset + 17 + count * self.KEYFRAME_BYTES
+                if end > size:
+                    break
+                ticks.append(tick)
+                offsets.append(offset)
+            elif kind == b"D" and count is not None:
+                end = offset + 9 + (count + 7) // 8
+                if end > size:
+                    break
+            else:
+                break
+            self.last_tick = tick
+            offset = end
+        self.keyframe_ticks = np.array(ticks, dtype=np.int64)
+        self.keyframe_offsets = np.array(offsets, dtype=np.int64)
+    
+
+    def load_keyframe(self, segment):
+        '''
+        Function that sets the state to a keyframe.
+
+        Parameter: The keyframe's number.
+
+        '''
+        import struct
+        import numpy as np
+
+        offset = int(self.keyframe_offsets[segment])
+        _, tick, count = struct.unpack_from("<cqq", self.data, offset)
+        offset += 17
+        fields = {}
+        for name, dtype in ReplayRecorder.KEYFRAME:
+            fields[name] = np.frombuffer(self.data, dtype=dtype, count=count, offset=offset)
+            offset += count * fields[name].itemsize
+        self.arrays = TrainArrays(self.network, fields["train_ids"].astype(np.int64), fields["line"].astype(np.int64),
+                                  fields["position"].astype(np.int64), fields["direction"].astype(np.int8), fields["delayed"].astype(bool))
+        self.length = self.compiled.line_lengths[self.arrays.line]
+        self.segment = segment
+        self.deltas = offset # Where the first delta after the keyframe starts.
+        self.delta_bytes = 9 + (count + 7) // 8
+        self.rows = None
+        self.tick = tick
+    
+
+    def apply_delta(self):
+        '''
+        Function that moves the state on by one time unit, with the delta recorded after it.
+
+        '''
+        import struct
+        import numpy as np
+
+        tick = self.tick + 1
+        offset = self.deltas + (tick - int(self.keyframe_ticks[self.segment]) - 1) * self.delta_bytes
+        kind, recorded = struct.unpack_from("<cq", self.data, offset)
+        if kind != b"D" or recorded != tick:
+            raise ValueError(f"The recording is damaged at time unit {tick}")
+        arrays = self.arrays
+        delayed = np.unpackbits(np.frombuffer(self.data, dtype=np.uint8, count=self.delta_bytes - 9, offset=offset + 9), count=len(arrays)).astype(bool)
+        arrays.position, arrays.direction = TrainArrays.moved(arrays.position, arrays.direction, self.length, delayed)
+        arrays.delayed = delayed
+        self.tick = tick
+    
+
+    def seek(self, tick):
+        '''
+        Function that moves the replay to a time unit, from the keyframe before it
+        (or from where it is, if that's later in the same keyframe interval).
+
+        Parameter: The time unit (between first_tick and last_tick).
+
+        Returns: A TrainSnapshot of the state at that time unit.
+
+        '''
+        import numpy as np
+
+        if not self.first_tick <= tick <= self.last_tick:
+            raise ValueError(f"Time unit {tick} wasn't recorded, choose one from {self.first_tick} to {self.last_tick}")
+        segment = int(np.searchsorted(self.keyframe_ticks, tick, side="right")) - 1
+        if segment != self.segment or self.tick > tick:
+            self.load_keyframe(segment)
+        while self.tick < tick:
+            self.apply_delta()
+        return self.snapshot()
+    
+
+    def step(self, ticks=1):
+        '''
+        Function that moves the replay forward (or backward, if negative) by some time units.
+
+        Parameter: The number of time units (1 by default).
+
+        Returns: A TrainSnapshot of the state at the new time unit.
+
+        '''
+        return self.seek(self.tick + ticks)
+    
+
+    def snapshot(self):
+        '''
+        Function that returns a TrainSnapshot of the state at the current time unit,
+        which stays the same however the replay moves afterwards.
+
+        '''
+        arrays = self.arrays
+        if self.rows is None:
+            self.rows = {train_id: i for i, train_id in enumerate(arrays.train_ids.tolist())}
+        copies = []
+        for name in ("train_ids", "line", "position", "direction", "delayed"):
+            copies.append(getattr(arrays, name).copy())
+            copies[-1].flags.writeable = False
+        return TrainSnapshot(self.tick, self.compiled, self.rows, *copies)
+
+
+class PositionHistory:
+    '''
+    The PositionHistory class records where every train is and whether it's delayed after every time unit
+    to columnar memory-mapped .npy files (see RailNetwork.record_history()), for offline analysis
+    with PositionHistoryReader, which opens them without loading them.
+
+    Each column has its own files, preallocated chunk_ticks time units at a time: stations-000000.npy holds the
+    station IDs (int32) of the first chunk and delayed-000000.npy the delayed statuses, one row per time unit
+    and one column per train, in order of train ID. The directory also has train_ids.npy and lines.npy
+    (the trains' ID numbers and line IDs, in column order) and history.json (the station and line names,
+    the first time unit and the number of time units recorded, which is written again after every chunk).
+
+    The trains are the ones in the network when recording starts (trains added later aren't recorded).
+
+    Warning: Needs the numpy and json modules to work.
+
+    '''
+    COLUMNS = (("stations", "<i4"), ("delayed", "|b1"))
+    VERSION = 1
+
+
+    def __init__(self, directory, arrays, tick, chunk_ticks=1024):
+        '''
+        Function that initializes the PositionHistory object and records the trains' current state.
+
+        Parameters: The directory (made if it doesn't exist); the TrainArrays of the trains to record;
+        the current time unit; and the number of time units in each file.
+
+        '''
+        import numpy as np
+
+        if chunk_ticks < 1:
+            raise ValueError("The chunk size has to be at least 1 time unit")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.compiled = arrays.compiled
+        self.chunk_ticks = chunk_ticks
+        self.first_tick = tick
+        self.ticks = 0
+        self.chunk = None # The memory-mapped files of the current chunk, by column name.
+        self.order = np.argsort(arrays.train_ids, kind="stable")
+        self.train_ids = arrays.train_ids[self.order]
+        np.save(os.path.join(directory, "train_ids.npy"), self.train_ids)
+        np.save(os.path.join(directory, "lines.npy"), arrays.line[self.order].astype(np.int32))
+        self.sources = None # The train ID array the columns were worked out for.
+        self.record(arrays, tick)
+    
+
+    def file(self, name, chunk):
+        '''
+        Function that returns the path of a column's file.
+
+        Parameters: The column's name, and the chunk's number.
+
+        '''
+        return os.path.join(self.directory, f"{name}-{chunk:06d}.npy")
+    
+
+    def write_metadata(self):
+        '''
+        Function that writes history.json, replacing it in one step so a reader never sees half of it.
+
+        '''
+        import json
+
+        metadata = {"version": self.VERSION, "first_tick": self.first_tick, "ticks": self.ticks, "chunk_ticks": self.chunk_ticks,
+                    "trains": len(self.train_ids), "stations": self.compiled.station_names, "lines": self.compiled.line_names,
+                    "columns": dict(self.COLUMNS)}
+        path = os.path.join(self.directory, "history.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(metadata, f)
+        os.replace(path + ".tmp", path)
+    
+
+    def record(self, arrays, tick):
+        '''
+        Function that adds the state after a time unit as the next row.
+
+        Parameters: The TrainArrays, and the time unit (which has to be the next one).
+
+        '''
+        import numpy as np
+
+        if tick != self.first_tick + self.ticks:
+            raise ValueError(f"The history is at time unit {self.first_tick + self.ticks}, not {tick}")
+        if arrays.train_ids is not self.sources:
+            # Works out which column every array index goes to (-1 for trains that aren't recorded).
+            self.sources = arrays.train_ids
+            if np.array_equal(arrays.train_ids, self.train_ids):
+                self.columns = None
+            else:
+                columns = np.minimum(np.searchsorted(self.train_ids, arrays.train_ids), max(len(self.train_ids) - 1, 0))
+                recorded = self.train_ids[columns] == arrays.train_ids if len(self.train_ids) else np.zeros(len(arrays), dtype=bool)
+                self.rows = np.flatnonzero(recorded)
+                self.columns = columns[recorded]
+        row = self.ticks % self.chunk_ticks
+        if row == 0:
+            self.flush()
+            chunk = self.ticks // self.chunk_ticks
+            self.chunk = {name: np.lib.format.open_memmap(self.file(name, chunk), mode="w+", dtype=dtype,
+                                                          shape=(self.chunk_ticks, len(self.train_ids))) for name, dtype in self.COLUMNS}
+        values = {"stations": arrays.station_ids(), "delayed": arrays.delayed}
+        for name, _ in self.COLUMNS:
+            if self.columns is None:
+                self.chunk[name][row] = values[name]
+            else:
+                self.chunk[name][row, self.columns] = values[name][self.rows]
+        self.ticks += 1
+    
+
+    def flush(self):
+        '''
+        Function that writes the current chunk to disk and brings history.json up to date.
+
+        '''
+        if self.chunk is not None:
+            for column in self.chunk.values():
+                column.flush()
+        self.write_metadata()
+    
+
+    def close(self):
+        '''
+        Function that writes the last chunk and closes the files.
+
+        '''
+        self.flush()
+        self.chunk = None
+
+
+class PositionHistoryReader:
+    '''
+    The PositionHistoryReader class opens a history recorded by PositionHistory without loading it:
+    every file is memory-mapped, so only the time units and trains that are sliced get read.
+
+    Attributes:
+
+    train_ids: The trains' ID numbers, in column order (sorted).
+    lines: The trains' line IDs, in column order.
+    station_names, line_names: The names of the station and line IDs.
+    first_tick: The first time unit recorded.
+    ticks: The number of time units recorded.
+
+    Warning: Needs the numpy and json modules to work.
+
+    '''
+
+    def __init__(self, directory):
+        '''
+        Function that initializes the PositionHistoryReader object.
+
+        Parameter: The directory of a PositionHistory.
+
+        '''
+        import json
+        import numpy as np
+
+        with open(os.path.join(directory, "history.json")) as f:
+            metadata = json.load(f)
+        if metadata.get("version") != PositionHistory.VERSION:
+            raise ValueError(f"{directory} is a history of version {metadata.get('version')}, only version {PositionHistory.VERSION} can be read")
+        self.directory = directory
+        self.first_tick = metadata["first_tick"]
+        self.ticks = metadata["ticks"]
+        self.chunk_ticks = metadata["chunk_ticks"]
+        self.station_names = metadata["stations"]
+        self.line_names = metadata["lines"]
+        self.station_ids = {name: i for i, name in enumerate(self.station_names)}
+        self.train_ids = np.load(os.path.join(directory, "train_ids.npy"), mmap_mode="r")
+        self.lines = np.load(os.path.join(directory, "lines.npy"), mmap_mode="r")
+        self.chunks = {} # Memory-mapped chunks, opened when first needed, by (column name, chunk number).
+    
+
+    def chunk(self, name, number):
+        '''
+        Function that returns the recorded rows of one chunk of a column, memory-mapped.
+
+        Parameters: The column's name, and the chunk's number.
+
+        '''
+        import numpy as np
+
+        if (name, number) not in self.chunks:
+            column = np.load(os.path.join(self.directory, f"{name}-{number:06d}.npy"), mmap_mode="r")
+            self.chunks[(name, number)] = column[:min(self.chunk_ticks, self.ticks - number * self.chunk_ticks)]
+        return self.chunks[(name, number)]
+    
+
+    def columns(self, train_ids):
+        '''
+        Function that returns the columns of some trains.
+
+        Parameter: The trains' ID numbers.
+
+        Returns: An array of column indexes (raises a KeyError if a train wasn't recorded).
+
+        '''
+        import numpy as np
+
+        train_ids = np.asarray(train_ids, dtype=np.int64)
+        columns = np.minimum(np.searchsorted(self.train_ids, train_ids), max(len(self.train_ids) - 1, 0))
+        missing = ~(self.train_ids[columns] == train_ids) if len(self.train_ids) else np.ones(len(train_ids), dtype=bool)
+        if missing.any():
+            raise KeyError(f"Train {int(train_ids[missing][0])} wasn't recorded")
+        return columns
+    
+
+    def read(self, name, start=None, stop=None, train_ids=None):
+        '''
+        Function that slices a column by time unit range and trains.
+
+        Parameters: "stations" or "delayed"; the first and last + 1 time unit (every recorded one by default);
+        and the trains' ID numbers (every train by default).
+
+        Returns: An array with a row for each time unit and a column for each train. A slice of every train
+        within one chunk is a read-only view of the file, anything else is read into memory.
+
+        '''
+        import numpy as np
+
+        if name not in dict(PositionHistory.COLUMNS):
+            raise ValueError(f"Unknown column {name!r}, choose one of {', '.join(dict(PositionHistory.COLUMNS))}")
+        start = self.first_tick if start is None else max(start, self.first_tick)
+        stop = self.first_tick + self.ticks if stop is None else min(stop, self.first_tick + self.ticks)
+        columns = self.columns(train_ids) if train_ids is not None else None
+        parts = []
+        first, last = start - self.first_tick, stop - self.first_tick
+        while first < last:
+            number = first // self.chunk_ticks
+            end = min(last, (number + 1) * self.chunk_ticks)
+            part = self.chunk(name, number)[first - number * self.chunk_ticks:end - number * self.chunk_ticks]
+            parts.append(part if columns is None else part[:, columns])
+            first = end
+        if len(parts) == 1:
+            return parts[0]
+        if not parts:
+            return np.zeros((0, len(self.train_ids) if columns is None else len(columns)), dtype=dict(PositionHistory.COLUMNS)[name])
+        return np.concatenate(parts)
+    
+
+    def station_counts(self, station, start=None, stop=None):
+        '''
+        Function that counts the trains at a station in every time unit, one chunk at a time.
+
+        Parameters: The station's name; and the first and last + 1 time unit (every recorded one by default).
+
+        Returns: An array with the number of trains for each time unit.
+
+        '''
+        import numpy as np
+
+        station_id = self.station_ids[station]
+        start = self.first_tick if start is None else max(start, self.first_tick)
+        stop = self.first_tick + self.ticks if stop is None else min(stop, self.first_tick + self.ticks)
+        counts = []
+        first = start
+        while first < stop:
+            # Up to the end of the chunk, so every read is a view.
+            end = min(stop, first + self.chunk_ticks - (first - self.first_tick) % self.chunk_ticks)
+            counts.append(np.count_nonzero(self.read("stations", first, end) == station_id, axis=1))
+            first = end
+        return np.concatenate(counts) if counts else np.zeros(0, dtype=np.int64)
+
+
+class SimulationStats:
+    '''
+    The SimulationStats class collects timings and counters from a RailNetwork while it runs (see RailNetwork.enable_stats()).
+
+    Attributes:
+
+    phase_seconds: Time spent in each phase of advancing time, by phase name (see PHASES).
+    counters: Trains moved, delayed and reversed, time units advanced and route questions answered, by name (see COUNTERS).
+    tick_seconds: Time spent advancing time.
+    latency_counts: Number of route questions answered within each LATENCY_BUCKETS_US bound (the last one is anything slower).
+
+    '''
+    __slots__ = ("clock", "phase_seconds", "counters", "tick_seconds", "latency_counts", "latency_seconds", "started")
+
+    # Phases of a time unit: finding where the trains are (and switching direction at the end of a line),
+    # drawing delays, moving trains between stations, and recording events.
+    # (The event engine draws a train's stay as it moves it, so that's all counted as moving.)
+    PHASES = ("lookup", "delay", "move", "output")
+    COUNTERS = ("ticks", "moved", "delayed", "reversed", "route_queries")
+    LATENCY_BUCKETS_US = tuple(2 ** i for i in range(21)) # 1 µs to about 1 second, doubling.
+
+
+    def __init__(self):
+        '''
+        Function that initializes the SimulationStats object with everything at zero.
+
+        '''
+        import time
+
+        self.clock = time.perf_counter
+        self.reset()
+    
+
+    def reset(self):
+        '''
+        Function that sets every timer and counter back to zero.
+
+        '''
+        self.phase_seconds = dict.fromkeys(self.PHASES, 0.0)
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.tick_seconds = 0.0
+        self.latency_counts = [0] * (len(self.LATENCY_BUCKETS_US) + 1)
+        self.latency_seconds = 0.0
+        self.started = self.clock()
+    
+
+    def add_tick(self, seconds, phase_seconds, moved, delayed, reversals, ticks=1):
+        '''
+        Function that adds the timings and counts of one time unit (or of several, when the event engine jumps ahead).
+
+        Parameters: The time it took; the time spent in each phase, by phase name;
+        the number of trains moved, delayed and reversed; and the number of time units.
+
+        '''
+        self.tick_seconds += seconds
+        for phase, spent in phase_seconds.items():
+            self.phase_seconds[phase] += spent
+        counters = self.counters
+        counters["ticks"] += ticks
+        counters["moved"] += moved
+        counters["delayed"] += delayed
+        counters["reversed"] += reversals
+    
+
+    def add_route_queries(self, seconds, count=1):
+        '''
+        Function that adds the latency of answered route questions to the histogram.
+
+        Parameters: The time it took; and how many questions were answered in that time
+        (each is counted with the average latency).
+
+        '''
+        from bisect import bisect_left
+
+        self.counters["route_queries"] += count
+        self.latency_seconds += seconds
+        self.latency_counts[bisect_left(self.LATENCY_BUCKETS_US, seconds / count * 1e6)] += count
+    
+
+    def latency_percentile(self, fraction):
+        '''
+        Function that estimates a route question latency percentile from the histogram.
+
+        Parameter: The fraction of questions (0.5 for the median, 0.99 for the 99th percentile).
+
+        Returns: The upper bound of the bucket it falls in, in microseconds (None if there are no questions
+        or it's slower than every bucket).
+
+        '''
+        total = sum(self.latency_counts)
+        if not total:
+            return None
+        seen = 0
+        for bound, count in zip(self.LATENCY_BUCKETS_US, self.latency_counts):
+            seen += count
+            if seen >= fraction * total:
+                return bound
+        return None
+    
+
+    def snapshot(self):
+        '''
+        Function that returns every timer and counter, for showing or scraping.
+
+        Returns: A dictionary that can be saved as JSON.
+
+        '''
+        ticks = self.counters["ticks"]
+        queries = self.counters["route_queries"]
+        phase_total = sum(self.phase_seconds.values())
+        return {
+            "elapsed_seconds": self.clock() - self.started,
+            "tick_seconds": self.tick_seconds,
+            "ticks_per_second": ticks / self.tick_seconds if self.tick_seconds else None,
+            "phases": {phase: {"seconds": spent, "share": spent / phase_total if phase_total else 0.0,
+                               "us_per_tick": spent / ticks * 1e6 if ticks else 0.0}
+                       for phase, spent in self.phase_seconds.items()},
+            "counters": dict(self.counters),
+            "route_query_latency": {
+                "mean_us": self.latency_seconds / queries * 1e6 if queries else None,
+                "p50_us": self.latency_percentile(0.5),
+                "p99_us": self.latency_percentile(0.99),
+                "buckets_us": [{"le": bound, "count": count} for bound, count in zip(self.LATENCY_BUCKETS_US + (None,), self.latency_counts)],
+            },
+        }
+    
+
+    def __str__(self):
+        '''
+        Function that returns the statistics as a readable table.
+
+        '''
+        snapshot = self.snapshot()
+        counters = snapshot["counters"]
+        ticks_per_second = snapshot["ticks_per_second"]
+        lines = [f"Time units: {counters['ticks']} ({ticks_per_second:.1f} per second)" if ticks_per_second else f"Time units: {counters['ticks']}",
+                 f"Trains moved: {counters['moved']}, delayed: {counters['delayed']}, reversed: {counters['reversed']}"]
+        for phase, values in snapshot["phases"].items():
+            lines.append(f"  {phase:<8} {values['seconds']:10.4f} s {values['share']:7.1%} {values['us_per_tick']:12.1f} µs per time unit")
+        latency = snapshot["route_query_latency"]
+        if counters["route_queries"]:
+            lines.append(f"Route questions: {counters['route_queries']}, mean {latency['mean_us']:.1f} µs, "
+                         f"median under {latency['p50_us']} µs, 99% under {latency['p99_us']} µs")
+        else:
+            lines.append("Route questions: 0")
+        return "\n".join(lines)
+
+
+class RunningMoments:
+    '''
+    The RunningMoments class keeps the count, sum, mean, variance and maximum of integer samples
+    in many groups at once (such as the dwell times at every station), in constant memory per group.
+
+    Batches of samples are merged in with Chan's parallel form of Welford's algorithm, which stays
+    accurate however many samples there are (unlike keeping the sum of squares).
+
+    Attributes:
+
+    count: The number of samples in every group.
+    total: The sum of the samples in every group.
+    mean: The mean of the samples in every group.
+    m2: The sum of squared differences from the mean in every group.
+    max: The largest sample in every group (0 if it has none).
+
+    Warning: Needs the numpy module to work.
+
+    '''
+    SPARSE = 16 # Batches with fewer samples than 1 / SPARSE of the groups are grouped by sorting instead of counting.
+    
+
+    def __init__(self, groups):
+        '''
+        Function that initializes the RunningMoments object with no samples.
+
+        Parameter: The number of groups.
+
+        '''
+        import numpy as np
+
+        self.count = np.zeros(groups, dtype=np.int64)
+        self.total = np.zeros(groups, dtype=np.int64)
+        self.mean = np.zeros(groups, dtype=np.float64)
+        self.m2 = np.zeros(groups, dtype=np.float64)
+        self.max = np.zeros(groups, dtype=np.int64)
+    
+
+    def add(self, groups, values):
+        '''
+        Function that adds a batch of samples.
+
+        Parameters: The group of every sample, and the samples (integers), as arrays.
+
+        '''
+        import numpy as np
+
+        if len(values) == 0:
+            return
+        if len(values) * self.SPARSE < len(self.count):
+            # Only looks at the groups in the batch.
+            touched, groups = np.unique(groups, return_inverse=True)
+        else:
+            touched = slice(None)
+        size = len(self.count) if isinstance(touched, slice) else len(touched)
+        n = np.bincount(groups, minlength=size)
+        values = values.astype(np.float64)
+        sums = np.bincount(groups, weights=values, minlength=size)
+        batch_mean = sums / np.maximum(n, 1)
+        # Within a batch the squares of the (integer) samples are exact, so their sum gives the spread.
+        batch_m2 = np.maximum(np.bincount(groups, weights=values * values, minlength=size) - sums * batch_mean, 0)
+        highest = np.zeros(size, dtype=np.float64)
+        np.maximum.at(highest, groups, values)
+
+        count = self.count[touched]
+        combined = count + n
+        delta = batch_mean - self.mean[touched]
+        share = n / np.maximum(combined, 1)
+        self.mean[touched] += delta * share
+        self.m2[touched] += batch_m2 + delta ** 2 * count * share
+        self.count[touched] = combined
+        self.total[touched] += np.rint(sums).astype(np.int64)
+        self.max[touched] = np.maximum(self.max[touched], highest.astype(np.int64))
+    
+
+    def add_each(self, added, values):
+        '''
+        Function that adds one sample to some of the groups (faster than add() when the groups are unique).
+
+        Parameters: Whether each group gets a sample, and the sample of every group (ignored where it doesn't), as arrays.
+
+        '''
+        import numpy as np
+
+        samples = values * added # 0 for the groups without a sample.
+        self.count += added
+        self.total += samples
+        np.maximum(self.max, samples, out=self.max)
+        delta = samples - self.mean
+        delta *= added
+        self.mean += delta / np.maximum(self.count, 1)
+        samples = samples - self.mean
+        samples *= delta # Welford's update, (x - old mean) * (x - new mean), is 0 where delta is.
+        self.m2 += samples
+    
+
+    def variance(self):
+        '''
+        Function that returns the sample variance of every group (NaN for groups with fewer than 2 samples).
+
+        '''
+        import numpy as np
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.count > 1, self.m2 / (self.count - 1), np.nan)
+    
+
+    def take(self, rows, fill):
+        '''
+        Function that returns new RunningMoments with some of the groups, for when the groups are reordered.
+
+        Parameters: For every new group, the old group it gets the samples of;
+        and which new groups get those samples (the others start empty).
+
+        '''
+        import numpy as np
+
+        moments = RunningMoments(len(fill))
+        for name in ("count", "total", "mean", "m2", "max"):
+            getattr(moments, name)[fill] = getattr(self, name)[rows[fill]]
+        return moments
+
+
+class DwellSketch:
+    '''
+    The DwellSketch class is a quantile sketch of integer samples in many groups: a histogram whose bins
+    are exact up to EXACT and then split every power of two into SPLITS bins, so it has the same number
+    of bins (and memory) however many samples it gets, and its quantiles are within 1 / SPLITS of the true ones.
+
+    Attributes:
+
+    counts: The number of samples in every bin of every group, as a (groups, BINS) array.
+
+    Warning: Needs the numpy module to work.
+
+    '''
+    EXACT = 16
+    SPLITS = 4
+    BINS = EXACT + (63 - 4) * SPLITS # Enough for any 64-bit sample.
+    
+
+    def __init__(self, groups):
+        '''
+        Function that initializes the DwellSketch object with no samples.
+
+        Parameter: The number of groups.
+
+        '''
+        import numpy as np
+
+        self.counts = np.zeros((groups, self.BINS), dtype=np.int64)
+    
+
+    @classmethod
+    def bins(cls, values):
+        '''
+        Function that returns the bin of every sample.
+
+        Parameter: The samples (positive integers), as an array.
+
+        '''
+        import numpy as np
+
+        values = np.asarray(values, dtype=np.int64)
+        bins = values.copy()
+        large = np.flatnonzero(values >= cls.EXACT)
+        if len(large):
+            values = values[large]
+            power = np.frexp(values)[1].astype(np.int64) - 1 # floor(log2(value))
+            bins[large] = cls.EXACT + (power - 4) * cls.SPLITS + ((values >> (power - 2)) & (cls.SPLITS - 1))
+        return bins
+    
+
+    @classmethod
+    def bin_values(cls):
+        '''
+        Function that returns the value every bin stands for (the middle of the values in it).
+
+        '''
+        import numpy as np
+
+        values = np.arange(cls.BINS, dtype=np.float64)
+        power = (np.arange(cls.BINS) - cls.EXACT) // cls.SPLITS + 4
+        split = (np.arange(cls.BINS) - cls.EXACT) % cls.SPLITS
+        lowest = (cls.SPLITS + split) * 2.0 ** (power - 2)
+        width = 2.0 ** (power - 2)
+        return np.where(values < cls.EXACT, values, lowest + (width - 1) / 2)
+    
+
+    def add(self, groups, values):
+        '''
+        Function that adds a batch of samples.
+
+        Parameters: The group of every sample, and the samples, as arrays.
+
+        '''
+        import numpy as np
+
+        cells = np.asarray(groups, dtype=np.int64) * self.BINS + self.bins(values)
+        if len(cells) * RunningMoments.SPARSE < self.counts.size:
+            np.add.at(self.counts.reshape(-1), cells, 1)
+        else:
+            self.counts += np.bincount(cells, minlength=self.counts.size).reshape(self.counts.shape)
+    
+
+    def quantiles(self, quantiles):
+        '''
+        Function that returns quantiles of every group.
+
+        Parameter: The quantiles (between 0 and 1).
+
+        Returns: A (groups, quantiles) array (NaN for groups without samples).
+
+        '''
+        import numpy as np
+
+        cumulative = np.cumsum(self.counts, axis=1)
+        totals = cumulative[:, -1]
+        result = np.full((len(self.counts), len(quantiles)), np.nan)
+        values = self.bin_values()
+        for group in np.flatnonzero(totals):
+            ranks = np.maximum(np.ceil(np.asarray(quantiles) * totals[group]), 1)
+            result[group] = values[np.searchsorted(cumulative[group], ranks)]
+        return result
+
+
+class DelayStatistics:
+    '''
+    The DelayStatistics class accumulates delay statistics over a whole run without keeping any history
+    (see RailNetwork.enable_delay_stats()).
+
+    A train's dwell time is the number of time units it spends at a station, from the time unit it arrived
+    to the one it left in, so it's 1 plus the number of times it got delayed there. Every dwell time
+    is added to running moments and a quantile sketch of its station and line, and to running moments of its train,
+    when the train leaves. Every time unit a train spends at a station is one draw against the station's
+    delay_probability, so the observed delay probability of a station is its delays over its time units.
+
+    Trains that were already waiting when the statistics started are counted from then.
+
+    Attributes:
+
+    stations, lines, trains: The RunningMoments of the dwell times at every station, on every line and of every train.
+    station_sketch, line_sketch: The DwellSketch of every station and line.
+    arrival: The time unit every train arrived at its station (or the statistics started).
+    started: The time unit the statistics started.
+
+    Warning: Needs the numpy module to work.
+
+    '''
+    QUANTILES = (0.5, 0.9, 0.99)
+    
+
+    def __init__(self, arrays, tick):
+        '''
+        Function that initializes the DelayStatistics object with no dwell times yet.
+
+        Parameters: The TrainArrays of the current state, and the current time unit.
+
+        '''
+        import numpy as np
+
+        compiled = arrays.compiled
+        self.compiled = compiled
+        self.train_ids = arrays.train_ids
+        self.line = arrays.line
+        self.station = arrays.station_ids()
+        self.arrival = np.full(len(self.train_ids), tick, dtype=np.int64)
+        self.stations = RunningMoments(len(compiled.station_names))
+        self.lines = RunningMoments(len(compiled.line_names))
+        self.trains = RunningMoments(len(self.train_ids))
+        self.station_sketch = DwellSketch(len(compiled.station_names))
+        self.line_sketch = DwellSketch(len(compiled.line_names))
+        self.started = tick
+    
+
+    def rebind(self, arrays, tick):
+        '''
+        Function that follows the trains to new TrainArrays (when trains have been added,
+        or an engine has put them in another order), keeping every train's statistics.
+
+        Parameters: The TrainArrays, and the current time unit.
+
+        '''
+        import numpy as np
+
+        if arrays.train_ids is self.train_ids:
+            return
+        if np.array_equal(arrays.train_ids, self.train_ids) and np.array_equal(arrays.line, self.line):
+            self.train_ids, self.line = arrays.train_ids, arrays.line
+            return
+        # Finds every train's old index (if it had one) by binary search in the sorted old IDs.
+        rows = np.zeros(len(arrays.train_ids), dtype=np.int64)
+        known = np.zeros(len(arrays.train_ids), dtype=bool)
+        if len(self.train_ids):
+            order = np.argsort(self.train_ids, kind="stable")
+            rows = order[np.minimum(np.searchsorted(self.train_ids[order], arrays.train_ids), len(order) - 1)]
+            known = self.train_ids[rows] == arrays.train_ids
+        self.trains = self.trains.take(rows, known)
+        arrival = np.full(len(arrays.train_ids), tick, dtype=np.int64)
+        arrival[known] = self.arrival[rows[known]]
+        self.arrival = arrival
+        self.train_ids = arrays.train_ids
+        self.line = arrays.line
+        self.station = arrays.station_ids()
+    
+
+    def observe(self, arrays, tick, departures=None):
+        '''
+        Function that adds the dwell times of the trains that left their station,
+        after one time unit (or after several, for the event engine).
+
+        Parameters: The TrainArrays of the new state; the current time unit; and for the event engine,
+        its departures as a flat list of train index, line position and time unit in the order they happened
+        (otherwise every train that didn't get delayed in the last time unit left).
+
+        '''
+        import numpy as np
+
+        self.rebind(arrays, tick)
+        if departures is None:
+            # Works on whole arrays, as most trains move in every time unit.
+            moved = ~arrays.delayed
+            stays = tick - self.arrival
+            dwell = stays[moved]
+            stations = self.station[moved]
+            lines = self.line[moved]
+            self.trains.add_each(moved, stays)
+            self.arrival[moved] = tick
+            self.station = np.where(moved, arrays.station_ids(), self.station)
+        else:
+            records = np.array(departures, dtype=np.int64).reshape(-1, 3)
+            # Groups the departures by train, in the order they happened,
+            # so each one's dwell time is measured from the train's previous departure.
+            order = np.argsort(records[:, 0], kind="stable")
+            rows, slots, ticks = records[order, 0], records[order, 1], records[order, 2]
+            first = np.ones(len(rows), dtype=bool)
+            first[1:] = rows[1:] != rows[:-1]
+            last = np.ones(len(rows), dtype=bool)
+            last[:-1] = first[1:]
+            previous = np.empty(len(rows), dtype=np.int64)
+            previous[1:] = ticks[:-1]
+            previous[first] = self.arrival[rows[first]]
+            dwell = ticks - previous
+            stations = self.compiled.line_stations[slots]
+            lines = self.line[rows]
+            self.trains.add(rows, dwell)
+            rows = rows[last]
+            self.arrival[rows] = ticks[last]
+            self.station[rows] = self.compiled.line_stations[self.compiled.line_offsets[self.line[rows]] + arrays.position[rows]]
+        self.stations.add(stations, dwell)
+        self.lines.add(lines, dwell)
+        self.station_sketch.add(stations, dwell)
+        self.line_sketch.add(lines, dwell)
+    
+
+    def summary(self, tick, delay_probabilities=None, trains=False):
+        '''
+        Function that summarizes the statistics so far.
+
+        Parameters: The current time unit; the configured delay probability of every station, by station ID (optional);
+        and whether to add every train's statistics too.
+
+        Returns: A dictionary that can be saved as JSON, with the number of time units, and for every station and line,
+        the time units trains spent there, how many of them were delays, the observed delay probability
+        (and the configured one, with the observed one's distance from it in standard errors, for stations),
+        and the number, mean, variance, maximum and quantiles of the finished dwell times.
+
+        '''
+        import math
+        import numpy as np
+
+        compiled = self.compiled
+        # The trains still waiting have been delayed in every time unit since they arrived.
+        waiting = tick - self.arrival
+        station_waiting = np.bincount(self.station, weights=waiting, minlength=len(compiled.station_names))
+        line_waiting = np.bincount(self.line, weights=waiting, minlength=len(compiled.line_names))
+
+        def groups(names, moments, sketch, waiting, configured):
+            variance = moments.variance()
+            quantiles = sketch.quantiles(self.QUANTILES)
+            result = {}
+            for i, name in enumerate(names):
+                ticks = int(moments.total[i] + round(waiting[i]))
+                delays = ticks - int(moments.count[i]) # Every finished dwell ended with a time unit that wasn't a delay.
+                entry = {"train_ticks": ticks, "delays": delays, "observed_probability": delays / ticks if ticks else None}
+                if configured is not None:
+                    p = float(configured[i])
+                    entry["configured_probability"] = p
+                    error = math.sqrt(p * (1 - p) / ticks) if ticks else 0.0
+                    entry["z_score"] = (delays / ticks - p) / error if error else None
+                count = int(moments.count[i])
+                entry["dwell"] = {"count": count, "mean": float(moments.mean[i]) if count else None,
+                                  "variance": None if math.isnan(variance[i]) else float(variance[i]),
+                                  "max": int(moments.max[i]) if count else None}
+                for q, value in zip(self.QUANTILES, quantiles[i].tolist()):
+                    entry["dwell"][f"p{round(q * 100)}"] = None if math.isnan(value) else value
+                result[name] = entry
+            return result
+
+        summary = {"ticks": tick - self.started,
+                   "stations": groups(compiled.station_names, self.stations, self.station_sketch, station_waiting, delay_probabilities),
+                   "lines": groups(compiled.line_names, self.lines, self.line_sketch, line_waiting, None)}
+        summary["train_ticks"] = sum(station["train_ticks"] for station in summary["stations"].values())
+        summary["delays"] = sum(station["delays"] for station in summary["stations"].values())
+        if trains:
+            variance = self.trains.variance()
+            summary["trains"] = {train_id: {"dwells": count, "mean_dwell": mean if count else None,
+                                            "variance": None if math.isnan(spread) else spread, "max_dwell": highest if count else None}
+                                 for train_id, count, mean, spread, highest in zip(self.train_ids.tolist(), self.trains.count.tolist(),
+                                                                                 self.trains.mean.tolist(), variance.tolist(), self.trains.max.tolist())}
+        return summary
+
+
+class NetworkFileError(ValueError):
+    '''
+    The NetworkFileError class is the error raised when a stations or connections file 
+    can't be interpreted. It lists every malformed line, not just the first one.
+
+    Attributes:
+
+    filename: The file's name.
+    problems: A list of (line number, description) tuples, up to MAX_PROBLEMS of them.
+    problem_count: The number of problems found, including the ones that weren't listed.
+
+    '''
+    MAX_PROBLEMS = 100
+
+
+    def __init__(self, filename, problems, problem_count):
+        '''
+        Function that initializes the NetworkFileError object.
+
+        '''
+        self.filename = filename
+        self.problems = problems
+        self.problem_count = problem_count
+        lines = [f"{filename} cannot be interpreted, {problem_count} problem{'s' if problem_count != 1 else ''} found:"]
+        lines += [f"  line {line_number}: {description}" for line_number, description in problems]
+        if problem_count > len(problems):
+            lines.append(f"  ... and {problem_count - len(problems)} more")
+        super().__init__("\n".join(lines))
+
+
+class FileProblems:
+    '''
+    The FileProblems class collects the problems found while reading a file,
+    keeping at most NetworkFileError.MAX_PROBLEMS of them so memory stays bounded.
+
+    '''
+    def __init__(self, filename):
+        '''
+        Function that initializes the FileProblems object.
+
+        Parameter: The file's name.
+
+        '''
+        self.filename = filename
+        self.problems = []
+        self.count = 0
+    
+
+    def add(self, line_number, description):
+        '''
+        Function that records a problem on a line of the file.
+
+        '''
+        self.count += 1
+        if len(self.problems) < NetworkFileError.MAX_PROBLEMS:
+            self.problems.append((line_number, description))
+    
+
+    def check(self):
+        '''
+        Function that raises a NetworkFileError if any problems were found.
+
+        '''
+        if self.count:
+            raise NetworkFileError(self.filename, self.problems, self.count)
+
+
+def read_rows(filename, fields, problems):
+    '''
+    Function that reads a comma separated file one line at a time, skipping empty lines.
+
+    Parameters: The file name; the number of comma separated fields each line must have;
+    and a FileProblems object to record lines with the wrong number of fields in.
+
+    Yields: (line number, list of fields) for every line with the right number of fields.
+
+    '''
+    line_number = 0
+    with open(filename, "r", buffering=1 << 20) as f:
+        try:
+            for line_number, line in enumerate(f, 1):
+                parts = line.strip().split(",")
+                if len(parts) != fields:
+                    if line.strip():
+                        problems.add(line_number, f"expected {fields} comma separated values, found {len(parts)}: {line.strip()!r}")
+                    continue
+                yield line_number, parts
+        except UnicodeDecodeError:
+            problems.add(line_number + 1, "not a text file (it can't be decoded)")
+
+
+LAYOUT_CACHE_DIR = os.environ.get("RAIL_LAYOUT_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "rail-network-simulator"))
+_layout_cache = {} # Map layouts already computed (or loaded) in this process, by topology hash.
+
+
+def topology_hash(connections):
+    '''
+    Function that hashes the topology of a rail network (its connections, in order, and the layout settings),
+    so that a map layout can be reused for as long as the network hasn't changed.
+
+    Parameters: A list of connections (source, target, line name, direction).
+
+    Returns: A hexadecimal SHA-256 digest.
+
+    '''
+    import hashlib
+    import networkx as nx
+
+    digest = hashlib.sha256(f"spring_layout k=1 seed=666 networkx={nx.__version__}\n".encode())
+    for connection in connections:
+        digest.update(("\x1f".join(connection) + "\n").encode())
+    return digest.hexdigest()
+
+
+def network_layout(connections, cache_dir=None):
+    '''
+    Function that builds the graph of a rail network and places its stations with the Fruchterman-Reingold algorithm,
+    reusing an earlier layout of the same topology from memory or from the cache directory when there is one.
+
+    Parameters: A list of connections (source, target, line name, direction); and the directory to keep
+    layouts in (LAYOUT_CACHE_DIR by default, or "" to only cache them in memory).
+
+    Returns: (the networkx MultiDiGraph, a dictionary of station name -> (x, y)).
+
+    Warning: Needs the networkx module to work.
+
+    '''
+    import json
+    import networkx as nx
+
+    key = topology_hash(connections)
+    if key in _layout_cache:
+        return _layout_cache[key]
+
+    G = nx.MultiDiGraph()
+    for source, target, line_name, direction in connections:
+        G.add_edge(source, target, line=line_name, direction=direction)
+
+    position = None
+    if cache_dir is None:
+        cache_dir = LAYOUT_CACHE_DIR
+    cache_file = os.path.join(cache_dir, f"layout-{key}.json") if cache_dir else None
+    if cache_file and os.path.exists(cache_file):
+        try:
+            with open(cache_file, "r") as f:
+                position = {name: (x, y) for name, x, y in json.load(f)}
+            if position.keys() != set(G): # A damaged or foreign cache file is recomputed.
+                position = None
+        except (OSError, ValueError, TypeError):
+            position = None
+
+    if position is None:
+        # O(V²) per iteration, which is why the result is cached.
+        position = {name: (float(x), float(y)) for name, (x, y) in nx.spring_layout(G, k=1, seed=666).items()}
+        if cache_file:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                # Written to a temporary file first, so other processes never read half a layout.
+                temporary = f"{cache_file}.{os.getpid()}.tmp"
+                with open(temporary, "w") as f:
+                    json.dump([[name, x, y] for name, (x, y) in position.items()], f)
+                os.replace(temporary, cache_file)
+            except OSError:
+                pass # The cache is only an optimisation, so a read-only disk is fine.
+
+    _layout_cache[key] = (G, position)
+    return G, position
+
+
+def start_train_map(base, limits=None):
+    '''
+    Function that draws the parts of a train map that don't change as time passes (the connections, the stations
+    and their names) on a new figure, so an animation only draws them once (see RailNetwork.export_animation()).
+
+    Parameters: The map's base (see RailNetwork.train_map_base()); and the lowest and highest number of trains
+    the colours of a big map's occupied stations go from and to (without a colour bar if None).
+
+    Returns: (the matplotlib Figure, its Axes).
+
+    Warning: Needs the matplotlib and numpy modules to work.
+
+    '''
+    import numpy as np
+    from matplotlib.cm import ScalarMappable
+    from matplotlib.collections import LineCollection
+    from matplotlib.colors import Normalize
+    from matplotlib.figure import Figure
+
+    names, xy, placed, small = base["names"], base["xy"], base["placed"], base["small"]
+    figure = Figure(figsize=(10, 10))
+    axes = figure.add_subplot()
+
+    # Draws every connection as one LineCollection, in the colour of its line.
+    axes.add_collection(LineCollection(base["segments"], colors=base["edge_colors"], linewidths=2 if small else 0.5, zorder=1))
+    # Draws every station as one scatter.
+    axes.scatter(xy[placed, 0], xy[placed, 1], s=300 if small else max(1, 10000 / len(names)), c="white",
+                 edgecolors="black", linewidths=0.5, zorder=2)
+    if small:
+        # Adds the names of the stations.
+        for i in np.flatnonzero(placed):
+            axes.text(xy[i, 0], xy[i, 1], names[i], fontsize=10, ha="center", va="center", zorder=4)
+    elif limits is not None:
+        figure.colorbar(ScalarMappable(Normalize(*limits), "viridis"), ax=axes, shrink=0.6, label="Trains")
+
+    axes.autoscale()
+    axes.margins(0.05)
+    axes.set_aspect("equal")
+    axes.axis("off")
+    return figure, axes
+
+
+def draw_train_frame(base, axes, counts, labels, limits=None):
+    '''
+    Function that draws the parts of a train map that change as time passes (the occupied stations of a big map,
+    coloured by their number of trains, and the train labels) on the Axes of start_train_map().
+
+    Parameters: The map's base; the Axes; the number of trains at every station (by station ID);
+    the labels as (station ID, text) pairs (see RailNetwork.train_map_labels()); and the colour limits, as for start_train_map().
+
+    Returns: A list of the matplotlib artists drawn, so they can be removed for the next frame.
+
+    Warning: Needs the matplotlib and numpy modules to work.
+
+    '''
+    import numpy as np
+    from matplotlib.colors import Normalize
+
+    xy = base["xy"]
+    artists = []
+    if not base["small"]:
+        occupied = np.flatnonzero((counts > 0) & base["placed"])
+        if len(occupied):
+            artists.append(axes.scatter(xy[occupied, 0], xy[occupied, 1], s=max(1, 20000 / len(base["names"])), c=counts[occupied],
+                                        cmap="viridis", norm=Normalize(*limits) if limits is not None else None, linewidths=0, zorder=3))
+    for i, text in labels:
+        artists.append(axes.text(xy[i, 0], xy[i, 1] - 0.03, text, fontsize=8, ha="center", va="top", zorder=5,
+                                 bbox=dict(facecolor="white", edgecolor="none", alpha=0.7)))
+    return artists
+
+
+_animation_state = None # The figure of an animation worker process, see init_animation_worker().
+
+
+def init_animation_worker(base, limits, dpi):
+    '''
+    Function that draws the parts of the map that don't change as time passes on an animation worker process's figure,
+    once per process, so every frame it renders only adds the trains (see RailNetwork.export_animation()).
+
+    Parameters: The map's base; the colour limits (see start_train_map()); and the resolution of the frames.
+
+    Warning: Needs the matplotlib and numpy modules to work.
+
+    '''
+    global _animation_state
+    figure, axes = start_train_map(base, limits)
+    _animation_state = (base, figure, axes, limits, dpi)
+
+
+def render_animation_frame(file, title, counts, labels):
+    '''
+    Function that renders one frame of an animation to a PNG file on the figure of init_animation_worker(),
+    and takes the frame's trains off it again afterwards.
+
+    Parameters: The file name; the frame's title; the number of trains at every station; and the train labels.
+
+    Returns: The file name.
+
+    '''
+    base, figure, axes, limits, dpi = _animation_state
+    artists = draw_train_frame(base, axes, counts, labels, limits)
+    axes.set_title(title)
+    # Without a tight bounding box, so every frame has the same size.
+    figure.savefig(file, dpi=dpi)
+    for artist in artists:
+        artist.remove()
+    return file
+
+
+class RailNetwork:
+    '''
+    The RailNetwork class is the main class the whole simulation takes place in.
+    It represents the entire network.
+    
+    '''
+    ENGINES = ("object", "array", "event", "parallel")
+
+
+    def __init__(self, engine="object", workers=None):
+        '''
+        Function that initializes the RailStation object.
+        Stores a dictionary of lines, with the line names as keys;
+        a dictionary of stations, with the station names as keys;
+        and a dictionary of trains, with the their ID numbers as keys.
+
+        Parameter: The engine used to advance time, "object" (default) steps one
+        Train object at a time, "array" steps every train at once with numpy (see TrainArrays),
+        "event" jumps from departure to departure (see DepartureQueue), and "parallel" steps
+        the lines in worker processes (see ParallelStepper); and the number of worker processes of
+        the parallel engine (every CPU core if None).
+
+        '''
+        self.lines = {}
+        self.stations = {}
+        self.trains = {}
+        self.connections = [] # The connections as (source, target, line name, direction) tuples.
+        self.compiled = None # Compiled topology, built by compile() when first needed.
+        self.reachability_index = None # Route info index, built by reachability() when first needed.
+        self.tick = 0 # Time units simulated so far.
+        self.event_log = None # Optional EventLog, see open_event_log().
+        self.train_arrays = None # Array engine state, built when first needed.
+        self.generator = None # Random generator for the array engine.
+        self.counter_rng = None # Optional CounterRNG every engine draws from instead, see use_counter_rng().
+        self.departures = None # Event engine state (a DepartureQueue), built when first needed.
+        self.parallel = None # Parallel engine state (a ParallelStepper), built when first needed.
+        self.parallel_resume = None # Partitions and generator states of a loaded checkpoint's parallel engine.
+        self.workers = workers # Number of worker processes of the parallel engine.
+        self.stats = None # Optional SimulationStats, see enable_stats().
+        self.snapshots = None # Optional SnapshotBuffers, see snapshot().
+        self.occupancy = None # Optional OccupancyIndex, see occupancy_index().
+        self.delays = None # Optional DelayStatistics, see enable_delay_stats().
+        self.recorder = None # Optional ReplayRecorder, see record_replay().
+        self.history = None # Optional PositionHistory, see record_history().
+        self.set_engine(engine, workers)
+    
+    def __str__(self):
+        '''
+        Function that returns a string representation of the RailNetwork object, 
+        with relevant information about the rail network, such as amount of lines,
+        amount of stations, and amount of trains in it.
+
+        '''
+        return f"Rail network with {len(self.lines)} lines, {len(self.stations)} stations, and {self.train_count()} trains"
+    
+    def train_count(self):
+        '''
+        Function that returns the number of trains in the network, 
+        including trains that only exist in the array engine so far (see materialize_trains()).
+
+        '''
+        if self.train_arrays is not None:
+            return len(self.train_arrays)
+        return len(self.trains)
+    
+
+    def add_line(self, line):
+        '''
+        Function that adds a line to the network.
+        
+        Parameter: a line.
+
+        '''
+        self.compiled = None
+        self.lines[line.name] = line
+    
+    def add_station(self, station):
+        '''
+        Function that adds a station to the network.
+        
+        Parameter: a station.
+        
+        '''
+        self.compiled = None
+        self.stations[station.name] = station
+    
+    def add_train(self, train, train_id):
+        '''
+        Function that adds a train to the network.
+        
+        Parameters: a train and its ID number.
+        
+        '''
+        # The array state no longer covers every train, so it gets rebuilt on the next step.
+        self.sync_trains()
+        self.close_parallel()
+        self.parallel_resume = None
+        if self.occupancy is not None:
+            self.occupancy.tick = None # Built again the next time it's used.
+        self.train_arrays = None
+        self.departures = None
+        self.trains[train_id] = train
+    
+
+    def add_random_trains(self, num_trains):
+        '''
+        Function that populates the network with trains, each on a random station 
+        heading in a random direction, with ID numbers continuing from the trains already in it.
+
+        With a counter-based generator (see use_counter_rng()) each train's placement only depends on
+        the seed and its ID number, so it doesn't matter how many trains are added at a time.
+
+        Parameter: The number of trains to add.
+
+        Warning: Needs the random module to work.
+
+        '''
+        first_id = len(self.trains) + 1
+        station_names = [key for key in self.stations.keys()]
+        rng = self.counter_rng
+        for train_id in range(first_id, first_id + num_trains):
+            if rng is None:
+                # Assigns a station for each train by random.
+                station_name = random.choice(station_names)
+                # Assigns a direction for each train by random.
+                direction = random.choice(["North","South"])
+            else:
+                station_name = station_names[rng.choice(train_id, 0, CounterRNG.STATION, len(station_names))]
+                direction = ["North","South"][rng.choice(train_id, 0, CounterRNG.DIRECTION, 2)]
+
+            station = self.stations[station_name]
+            # Finds a line to assign to each train
+            # This is to prevent issues with stations that exist on more than 1 line
+            line = self.get_start_line(station, train_id)
+
+            # Creates the Train object
+            train = Train(station, direction, line, train_id, False)
+
+            # Adds the train and its ID to the network. 
+            self.add_train(train, train_id)
+            station.add_train(train)
+    
+
+    def summary(self):
+        '''
+        Function that returns summary statistics of the current state of the simulation:
+        the number of trains, stations, lines and delayed trains, and the number of trains
+        at each station and on each line.
+
+        Returns: A dictionary that can be saved as JSON.
+
+        '''
+        self.sync_trains()
+        trains_per_line = {name: 0 for name in self.lines}
+        for train in self.trains.values():
+            trains_per_line[train.line.name] += 1
+        return {
+            "tick": self.tick,
+            "trains": len(self.trains),
+            "stations": len(self.stations),
+            "lines": len(self.lines),
+            "delayed_trains": sum(1 for train in self.trains.values() if train.train_delayed),
+            "trains_per_station": {name: len(station.trains) for name, station in self.stations.items()},
+            "trains_per_line": trains_per_line,
+        }
+    
+
+    def train_states(self):
+        '''
+        Function that returns the current state of every train, as a list of dictionaries 
+        with the train's ID, line, station, direction and delayed status.
+
+        '''
+        self.sync_trains()
+        return [{"train_id": train.train_id, "line": train.line.name, "station": train.station.name,
+                 "direction": train.direction, "delayed": train.train_delayed} for train in self.trains.values()]
+    
+
+    def train_state(self, train_id):
+        '''
+        Function that returns the current state of one train, like train_states() does,
+        but reading the array based engines' state directly instead of updating the Train objects.
+
+        Parameter: The train's ID number.
+
+        Returns: A dictionary (raises a KeyError if there is no such train).
+
+        '''
+        arrays = self.train_arrays
+        if arrays is None:
+            train = self.trains[train_id]
+            return {"train_id": train.train_id, "line": train.line.name, "station": train.station.name,
+                    "direction": train.direction, "delayed": train.train_delayed}
+        i = arrays.row(train_id)
+        compiled = arrays.compiled
+        return {"train_id": train_id, "line": compiled.line_names[arrays.line[i]],
+                "station": compiled.station_names[compiled.station_at(arrays.line[i], arrays.position[i])],
+                "direction": "North" if arrays.direction[i] == TrainArrays.NORTH else "South", "delayed": bool(arrays.delayed[i])}
+    
+
+    def delayed_count(self):
+        '''
+        Function that returns the number of trains that got delayed in the last time unit.
+
+        '''
+        if self.train_arrays is not None:
+            return int(self.train_arrays.delayed.sum())
+        return sum(1 for train in self.trains.values() if train.train_delayed)
+    
+
+    def set_engine(self, engine, workers=None):
+        '''
+        Function that selects the engine used by advance_time().
+
+        Parameters: "object", "array", "event" or "parallel";
+        and the number of worker processes of the parallel engine (every CPU core if None).
+
+        '''
+        if engine not in self.ENGINES:
+            raise ValueError(f"Unknown engine {engine!r}, choose one of {', '.join(self.ENGINES)}")
+        if engine != "parallel" or workers != self.workers:
+            # The worker processes are stopped, and the arrays moved back out of shared memory.
+            self.close_parallel()
+        if engine != "parallel":
+            self.parallel_resume = None
+        self.workers = workers
+        if engine == "object":
+            # The object engine works on the Train objects, so they need to be up to date.
+            self.sync_trains()
+            self.train_arrays = None
+        if engine != "event":
+            # The arrays are up to date after every time unit, so only the drawn stays are dropped.
+            self.departures = None
+        self.engine = engine
+    
+
+    def use_counter_rng(self, seed):
+        '''
+        Function that makes every engine draw its random numbers from a counter-based generator (see CounterRNG)
+        keyed by the seed, the train's ID number and the time unit, instead of the random module
+        or the engines' own generators. The object, array and parallel engines then give bit-identical
+        trajectories, for any number of workers, and new trains are placed the same way by every engine.
+
+        Parameter: The seed, an integer (None to go back to the random module).
+
+        Warning: Needs the numpy module to work.
+
+        '''
+        self.counter_rng = CounterRNG(seed) if seed is not None else None
+    
+
+    CHECKPOINT_MAGIC = b"RNCK"
+    CHECKPOINT_VERSION = 1
+    CHECKPOINT_ALIGNMENT = 64
+
+
+    def save_checkpoint(self, file):
+        '''
+        Function that saves the whole simulation (topology, station delay probabilities,
+        every train's state, the event engine's drawn stays, the time unit and the random generators' states) to a binary checkpoint file.
+
+        The file starts with b"RNCK", the format version and the length of a JSON header
+        as little-endian 32-bit integers, then the header, which lists the sections that follow:
+        each section is one contiguous array starting at a 64 byte boundary, so load_checkpoint()
+        can memory-map it instead of reading it.
+
+        Parameter: The file name of the checkpoint.
+
+        Warning: Needs the numpy module to work.
+
+        '''
+        import json
+        import struct
+        import numpy as np
+
+        compiled = self.compile()
+        arrays = self.train_arrays if self.train_arrays is not None else TrainArrays.from_trains(self)
+        sections = {}
+        sections["station_names"], sections["station_name_offsets"] = pack_strings(compiled.station_names)
+        sections["line_names"], sections["line_name_offsets"] = pack_strings(compiled.line_names)
+        sections["edge_directions"], sections["edge_direction_offsets"] = pack_strings(compiled.edge_directions)
+        sections["delay_probabilities"] = np.array([self.stations[name].delay_probability for name in compiled.station_names], dtype="<f8")
+        sections["edge_sources"] = compiled.edge_sources
+        sections["edge_targets"] = compiled.edge_targets
+        sections["edge_lines"] = compiled.edge_lines
+        for name in ("train_ids", "line", "position", "direction", "delayed"):
+            sections["train_" + name if name != "train_ids" else name] = getattr(arrays, name)
+        if self.departures is not None and self.departures.arrays is arrays:
+            # The event engine's drawn stays, so that it continues exactly the same way.
+            sections["train_arrival"] = self.departures.arrival
+            sections["train_departure"] = self.departures.departures()
+
+        header = {"engine": self.engine, "tick": self.tick, "random_state": random.getstate(),
+                  "generator_state": self.generator.bit_generator.state if self.generator is not None else None,
+                  "counter_seed": self.counter_rng.seed if self.counter_rng is not None else None,
+                  "sections": {}}
+        if self.parallel is not None and self.parallel.arrays is arrays:
+            # The parallel engine's partitions and their generators, so that it continues exactly the same way.
+            header["parallel"] = {"partition_lines": self.parallel.partition_lines, "states": self.parallel.states}
+        offset = 0
+        for name, array in sections.items():
+            array = np.ascontiguousarray(array)
+            array = array.astype(array.dtype.newbyteorder("<"), copy=False)
+            sections[name] = array
+            header["sections"][name] = {"offset": offset, "dtype": array.dtype.str, "length": len(array)}
+            offset += -(-array.nbytes // self.CHECKPOINT_ALIGNMENT) * self.CHECKPOINT_ALIGNMENT
+        encoded = json.dumps(header).encode()
+        start = len(self.CHECKPOINT_MAGIC) + 8 + len(encoded)
+        padding = -start % self.CHECKPOINT_ALIGNMENT
+        with open(file, "wb") as f:
+            f.write(self.CHECKPOINT_MAGIC + struct.pack("<II", self.CHECKPOINT_VERSION, len(encoded)) + encoded + b"\0" * padding)
+            for name, array in sections.items():
+                f.write(array.tobytes())
+                f.write(b"\0" * (-array.nbytes % self.CHECKPOINT_ALIGNMENT))
+    
+
+    @classmethod
+    def load_checkpoint(cls, file):
+        '''
+        Function that resumes a simulation saved by save_checkpoint().
+
+        The train state is memory-mapped (copy-on-write, so the file itself never changes),
+        and the Train objects are only made when something asks for them (see materialize_trains()),
+        so even huge fleets load almost instantly. The random module's state is restored too.
+
+        Parameter: The file name of the checkpoint.
+
+        Returns: A RailNetwork.
+
+        Warning: Needs the numpy module to work.
+
+        '''
+        import json
+        import struct
+        import numpy as np
+
+        with open(file, "rb") as f:
+            if f.read(len(cls.CHECKPOINT_MAGIC)) != cls.CHECKPOINT_MAGIC:
+                raise ValueError(f"{file} is not a rail network checkpoint")
+            version, header_length = struct.unpack("<II", f.read(8))
+            if version != cls.CHECKPOINT_VERSION:
+                raise ValueError(f"{file} is a checkpoint of version {version}, only version {cls.CHECKPOINT_VERSION} can be loaded")
+            header = json.loads(f.read(header_length))
+        start = len(cls.CHECKPOINT_MAGIC) + 8 + header_length
+        start += -start % cls.CHECKPOINT_ALIGNMENT
+        mapped = np.memmap(file, dtype=np.uint8, mode="c")
+        sections = {}
+        for name, section in header["sections"].items():
+            dtype = np.dtype(section["dtype"])
+            offset = start + section["offset"]
+            sections[name] = mapped[offset:offset + section["length"] * dtype.itemsize].view(dtype)
+
+        network = cls(header["engine"])
+        station_names = unpack_strings(sections["station_names"], sections["station_name_offsets"])
+        line_names = unpack_strings(sections["line_names"], sections["line_name_offsets"])
+        directions = unpack_strings(sections["edge_directions"], sections["edge_direction_offsets"])
+        for name, delay_probability in zip(station_names, sections["delay_probabilities"].tolist()):
+            network.add_station(Station(name, delay_probability))
+        for source, target, line, direction in zip(sections["edge_sources"].tolist(), sections["edge_targets"].tolist(),
+                                                   sections["edge_lines"].tolist(), directions):
+            network.add_connection(station_names[source], station_names[target], line_names[line], direction)
+
+        network.tick = header["tick"]
+        network.train_arrays = TrainArrays(network, sections["train_ids"], sections["train_line"], sections["train_position"],
+                                           sections["train_direction"], sections["train_delayed"])
+        if "train_departure" in sections:
+            network.departures = DepartureQueue(network.train_arrays, network.tick, sections["train_arrival"], sections["train_departure"])
+        if header.get("counter_seed") is not None:
+            network.use_counter_rng(header["counter_seed"])
+        if "parallel" in header:
+            network.parallel_resume = header["parallel"]
+        state = header["random_state"]
+        random.setstate((state[0], tuple(state[1]), state[2]))
+        if header["generator_state"] is not None:
+            network.generator = np.random.default_rng()
+            network.generator.bit_generator.state = header["generator_state"]
+        if network.engine == "object":
+            # The object engine only works on Train objects.
+            network.set_engine("object")
+        return network
+    
+
+    def open_event_log(self, file, format="jsonl", buffer_events=1 << 16):
+        '''
+        Function that starts recording train events (departures, arrivals, delays and direction reversals)
+        to a file, for both engines. See EventLog.
+
+        Parameters: A file name; "jsonl" or "binary"; and how many events to buffer before writing them.
+
+        '''
+        self.close_event_log()
+        self.event_log = EventLog(file, self.compile(), format, buffer_events)
+    
+
+    def close_event_log(self):
+        '''
+        Function that stops recording train events, and writes the remaining ones to the file.
+
+        '''
+        if self.event_log is not None:
+            self.event_log.close()
+            self.event_log = None
+    
+
+    def record_replay(self, file, interval=200):
+        '''
+        Function that starts recording the simulation to a file that can be replayed from any time unit (see ReplayRecorder and Replay),
+        with a keyframe of every train's state every interval time units and one bit per train for every other time unit.
+
+        Parameters: A file name, and the number of time units between keyframes.
+
+        Returns: The ReplayRecorder.
+
+        '''
+        self.close_replay()
+        arrays = self.train_arrays if self.train_arrays is not None else TrainArrays.from_trains(self)
+        self.recorder = ReplayRecorder(file, self, arrays, self.tick, interval)
+        return self.recorder
+    
+
+    def close_replay(self):
+        '''
+        Function that stops recording the replay, and writes its keyframe index to the file.
+
+        '''
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+    
+
+    def record_history(self, directory, chunk_ticks=1024):
+        '''
+        Function that starts recording the station and delayed status of every train after every time unit
+        to memory-mapped .npy files, for offline analysis (see PositionHistory and PositionHistoryReader).
+
+        Parameters: The directory to record to, and the number of time units in each file.
+
+        Returns: The PositionHistory.
+
+        '''
+        self.close_history()
+        arrays = self.train_arrays if self.train_arrays is not None else TrainArrays.from_trains(self)
+        self.history = PositionHistory(directory, arrays, self.tick, chunk_ticks)
+        return self.history
+    
+
+    def close_history(self):
+        '''
+        Function that stops recording the position history, and writes the rest of it to disk.
+
+        '''
+        if self.history is not None:
+            self.history.close()
+            self.history = None
+    
+
+    def enable_stats(self):
+        '''
+        Function that starts collecting timings and counters while the simulation runs
+        (nothing is timed while they're off).
+
+        Returns: The SimulationStats (the same one if they were already on).
+
+        '''
+        if self.stats is None:
+            self.stats = SimulationStats()
+        return self.stats
+    
+
+    def disable_stats(self):
+        '''
+        Function that stops collecting timings and counters.
+
+        '''
+        self.stats = None
+    
+
+    def enable_delay_stats(self):
+        '''
+        Function that starts accumulating delay and dwell time statistics of every station, line and train
+        while the simulation runs, in constant memory however long it runs (see DelayStatistics).
+
+        Returns: The DelayStatistics (the same one if they were already on).
+
+        '''
+        if self.delays is None:
+            arrays = self.train_arrays if self.train_arrays is not None else TrainArrays.from_trains(self)
+            self.delays = DelayStatistics(arrays, self.tick)
+        return self.delays
+    
+
+    def disable_delay_stats(self):
+        '''
+        Function that stops accumulating delay statistics.
+
+        '''
+        self.delays = None
+        if self.departures is not None:
+            self.departures.spells = None
+    
+
+    def delay_summary(self, trains=False):
+        '''
+        Function that summarizes the delay statistics since enable_delay_stats(), comparing every station's
+        observed delay probability with its configured delay_probability.
+
+        Parameter: Whether to add every train's statistics too (False by default, as there can be millions).
+
+        Returns: A dictionary that can be saved as JSON (see DelayStatistics.summary()), or None if they're off.
+
+        '''
+        if self.delays is None:
+            return None
+        configured = [self.stations[name].delay_probability for name in self.compile().station_names]
+        return self.delays.summary(self.tick, configured, trains)
+    
+
+    def snapshot(self):
+        '''
+        Function that returns the state of every train after the last completed time unit as a TrainSnapshot,
+        which never changes, so other threads can read it while the simulation continues.
+
+        The first call starts publishing a snapshot after every time unit (see SnapshotBuffers),
+        so it should be made before any reader threads start.
+
+        Returns: The latest TrainSnapshot.
+
+        '''
+        if self.snapshots is None:
+            self.snapshots = SnapshotBuffers()
+            self.publish_snapshot()
+        return self.snapshots.latest
+    
+
+    def disable_snapshots(self):
+        '''
+        Function that stops publishing snapshots (the ones readers have stay valid).
+
+        '''
+        self.snapshots = None
+    
+
+    def publish_snapshot(self):
+        '''
+        Function that publishes the current state as the latest snapshot, if snapshots are on.
+
+        '''
+        if self.snapshots is not None:
+            arrays = self.train_arrays if self.train_arrays is not None else TrainArrays.from_trains(self)
+            self.snapshots.publish(arrays, self.tick)
+    
+
+    def finish_tick(self):
+        '''
+        Function that updates the optional delay statistics and occupancy index, publishes the optional snapshot
+        and records the time unit in the optional replay and position history, after every completed time unit
+        (nothing happens if they're all off).
+
+        '''
+        if self.snapshots is None and self.occupancy is None and self.delays is None and self.recorder is None and self.history is None:
+            return
+        arrays = self.train_arrays if self.train_arrays is not None else TrainArrays.from_trains(self)
+        if self.delays is not None:
+            if self.engine == "event":
+                # The event engine recorded its departures, as it may have jumped over several time units.
+                departures, self.departures.spells = self.departures.spells, []
+                self.delays.observe(arrays, self.tick, departures)
+            else:
+                self.delays.observe(arrays, self.tick)
+        if self.occupancy is not None:
+            self.refresh_occupancy(arrays)
+        if self.snapshots is not None:
+            self.snapshots.publish(arrays, self.tick)
+        if self.recorder is not None:
+            self.recorder.record(arrays, self.tick)
+        if self.history is not None:
+            self.history.record(arrays, self.tick)
+    
+
+    def refresh_occupancy(self, arrays):
+        '''
+        Function that brings the occupancy index up to date with some TrainArrays of the current state,
+        building it again if the trains have changed.
+
+        '''
+        if self.occupancy.tick is not None and self.occupancy.indexes(arrays):
+            self.occupancy.update(arrays, self.tick)
+        else:
+            self.occupancy = OccupancyIndex(arrays, self.tick)
+    
+
+    def occupancy_index(self):
+        '''
+        Function that returns the OccupancyIndex of the current state. The first call builds it,
+        and from then on it's updated after every time unit with only the trains that changed.
+
+        Returns: An OccupancyIndex.
+
+        '''
+        if self.occupancy is None or self.occupancy.tick != self.tick:
+            arrays = self.train_arrays if self.train_arrays is not None else TrainArrays.from_trains(self)
+            if self.occupancy is None:
+                self.occupancy = OccupancyIndex(arrays, self.tick)
+            else:
+                self.refresh_occupancy(arrays)
+        return self.occupancy
+    
+
+    def trains_at(self, station):
+        '''
+        Function that returns the ID numbers of the trains at a station, using the occupancy index.
+
+        Parameter: The station's name.
+
+        Returns: A list of train ID numbers (raises a KeyError if there is no such station).
+
+        '''
+        return self.occupancy_index().trains_at(self.compile().station_ids[station]).tolist()
+    
+
+    def delayed_trains(self, line=None):
+        '''
+        Function that returns the ID numbers of the trains delayed in the last time unit, using the occupancy index.
+
+        Parameter: A line's name, to only get the trains on that line (optional).
+
+        Returns: A list of train ID numbers (raises a KeyError if there is no such line).
+
+        '''
+        line_id = None if line is None else self.compile().line_ids[line]
+        return self.occupancy_index().delayed_trains(line_id).tolist()
+    
+
+    def line_delayed_count(self, line):
+        '''
+        Function that returns how many trains on a line were delayed in the last time unit, using the occupancy index.
+
+        Parameter: The line's name.
+
+        '''
+        return int(self.occupancy_index().line_delayed[self.compile().line_ids[line]])
+    
+
+    def line_occupancy(self, line):
+        '''
+        Function that returns how many trains are at each station of a line, using the occupancy index.
+
+        Parameter: The line's name.
+
+        Returns: A list of (station name, number of trains) tuples, from the line's first station to its last.
+
+        '''
+        compiled = self.compile()
+        line_id = compiled.line_ids[line]
+        counts = self.occupancy_index().line_occupancy(line_id).tolist()
+        return [(compiled.station_names[compiled.station_at(line_id, position)], count) for position, count in enumerate(counts)]
+    
+
+    def busiest_stations(self, count=10):
+        '''
+        Function that returns the stations with the most trains, using the occupancy index.
+
+        Parameter: The number of stations (10 by default).
+
+        Returns: A list of (station name, number of trains) tuples, the busiest first.
+
+        '''
+        index = self.occupancy_index()
+        names = self.compile().station_names
+        return [(names[i], int(index.station_counts[i])) for i in index.busiest(count).tolist()]
+    
+
+    def close_parallel(self):
+        '''
+        Function that stops the parallel engine's worker processes, keeping the train arrays
+        (moved back out of shared memory) for the other engines.
+
+        '''
+        if self.parallel is not None:
+            self.parallel.close()
+            self.parallel = None
+    
+
+    def station_occupancy(self):
+        '''
+        Function that returns the number of trains at every station, by station ID
+        (without creating Train objects for the array based engines).
+
+        Returns: An array.
+
+        Warning: Needs the numpy module to work.
+
+        '''
+        import numpy as np
+
+        compiled = self.compile()
+        if self.occupancy is not None and self.occupancy.tick == self.tick:
+            return self.occupancy.station_counts.copy()
+        if self.parallel is not None and self.parallel.arrays is self.train_arrays:
+            # Every worker already counted its own partition.
+            return self.parallel.occupancy()
+        if self.train_arrays is not None:
+            station_ids = self.train_arrays.station_ids()
+        else:
+            station_ids = np.fromiter((compiled.station_ids[train.station.name] for train in self.trains.values()),
+                                      dtype=np.int64, count=len(self.trains))
+        return np.bincount(station_ids, minlength=len(compiled.station_names))
+    
+
+    def sync_trains(self):
+        '''
+        Function that copies the array engine's state back into the Train and Station objects,
+        so that train info and the map show the current positions.
+
+        '''
+        if self.train_arrays is None:
+            return
+        self.materialize_trains()
+        for train in self.trains.values():
+            self.train_arrays.sync_train(train)
+    
+
+    def materialize_trains(self):
+        '''
+        Function that makes Train objects for the trains that so far only exist
+        in the array engine (such as trains loaded from a checkpoint), and adds them to their stations.
+
+        '''
+        arrays = self.train_arrays
+        if arrays is None or len(self.trains) == len(arrays):
+            return
+        compiled = arrays.compiled
+        stations = arrays.station_ids().tolist()
+        for i, train_id in enumerate(arrays.train_ids.tolist()):
+            if train_id in self.trains:
+                continue
+            station = arrays.stations[stations[i]]
+            line = self.lines[compiled.line_names[arrays.line[i]]]
+            direction = "North" if arrays.direction[i] == TrainArrays.NORTH else "South"
+            train = Train(station, direction, line, train_id, bool(arrays.delayed[i]))
+            self.trains[train_id] = train
+            station.add_train(train)
+    
+
+    def get_train(self, train_id):
+        '''
+        Function that returns an up to date Train object from the network.
+
+        Parameter: The train's ID number.
+
+        '''
+        if self.train_arrays is not None:
+            self.materialize_trains()
+            train = self.trains[train_id]
+            self.train_arrays.sync_train(train)
+            return train
+        return self.trains[train_id]
+    
+
+    def load_stations(self, filename):
+        '''
+        Function that loads and interpretes a stations file and adds its information into the Station object.
+        
+        Important for it to work: The txt file has to have a line for each station 
+        with its risk of causing a delay (written in decimal form, between 0 and 1) separated by a comma,
+        with no additional information. Empty lines are skipped.
+
+        The file is read and checked in one pass. If any line can't be interpreted,
+        nothing is added and a NetworkFileError listing every such line is raised.
+        
+        Parameter: The file name of the stations file as a string.
+        
+        '''
+        problems = FileProblems(filename)
+        stations = {}
+        for line_number, (name, delay_probability) in read_rows(filename, 2, problems): # Seperates information into variables.
+            try:
+                delay_probability = float(delay_probability) # Converts delay risk to a float
+            except ValueError:
+                problems.add(line_number, f"the delay probability of station {name!r} isn't a number: {delay_probability!r}")
+                continue
+            if not name:
+                problems.add(line_number, "the station has no name")
+            elif name in stations:
+                problems.add(line_number, f"station {name!r} is already on line {stations[name][0]}")
+            elif not 0 <= delay_probability <= 1:
+                problems.add(line_number, f"the delay probability of station {name!r} isn't between 0 and 1: {delay_probability}")
+            else:
+                stations[name] = (line_number, delay_probability)
+        problems.check()
+        for name, (_, delay_probability) in stations.items():
+            station = Station(name, delay_probability)
+            self.add_station(station) # Adds information to the Station object.
+    
+
+    def load_connections(self, filename):
+        '''
+        Function that loads and interpretes a connections file and adds its information into the Line object.
+        
+        Important for it to work: The txt file has to have a line for each connection 
+        with all of its information written in order (source station, target station, line name, direction) 
+        and separated by a comma, with no additional information. 
+        The stations have to be loaded first. Empty lines are skipped.
+
+        The file is read and checked in one pass. If any line can't be interpreted,
+        nothing is added and a NetworkFileError listing every such line is raised.
+        
+        Parameter: The file name of the connection file as a string.
+        
+        '''
+        problems = FileProblems(filename)
+        get_station = self.stations.get
+        connections = []
+        lines = {} # The stations of each line, in the order they're found.
+        for line_number, (source, target, line_name, direction) in read_rows(filename, 4, problems): # Seperates information into variables
+            # Assign the source station and target station.
+            source_station = get_station(source)
+            target_station = get_station(target)
+            if source_station is None or target_station is None:
+                unknown = [name for name in (source, target) if get_station(name) is None]
+                problems.add(line_number, f"unknown station{'s' if len(unknown) > 1 else ''} {', '.join(map(repr, unknown))}")
+                continue
+            if not line_name:
+                problems.add(line_number, "the connection has no line name")
+                continue
+            line_stations = lines.get(line_name)
+            if line_stations is None:
+                line_stations = lines[line_name] = {}
+            line_stations[source] = source_station
+            line_stations[target] = target_station
+            connections.append((source, target, line_name, direction))
+        problems.check()
+        # Creates new Line objects for new lines found, and adds the stations to the lines
+        # (the same as add_connection() for every connection, without the per call overhead).
+        for line_name, line_stations in lines.items():
+            if line_name not in self.lines:
+                self.add_line(Line(line_name))
+            self.lines[line_name].stations.update(line_stations)
+        self.connections.extend(connections)
+        self.compiled = None
+    
+
+    def add_connection(self, source, target, line_name, direction):
+        '''
+        Function that adds a connection between two stations in the network to its line.
+
+        Parameters: The source station's name, the target station's name, the line name and the direction.
+
+        '''
+        # Assign the source station and target station.
+        source_station = self.stations[source]
+        target_station = self.stations[target]
+
+        # Creates new Line objects for new lines found
+        # And adds them to the RailNetwork
+        if line_name not in self.lines:
+            line = Line(line_name)
+            self.add_line(line)
+        else:
+            line = self.lines[line_name]
+        # Adds the source station and target station 
+        line.add_station(source_station) 
+        line.add_station(target_station) 
+        self.connections.append((source, target, line_name, direction))
+        self.compiled = None
+    
+
+    def compile(self):
+        '''
+        Function that compiles the network's topology into a CompiledNetwork,
+        to be run after load_stations() and load_connections().
+
+        The result is cached until a station, line or connection is added.
+
+        Returns: The CompiledNetwork.
+
+        '''
+        if self.compiled is None:
+            self.compiled = CompiledNetwork(self)
+        return self.compiled
+    
+
+    def reachability(self):
+        '''
+        Function that returns the network's ReachabilityIndex, 
+        building it again if the topology has changed since it was built.
+
+        '''
+        compiled = self.compile()
+        if self.reachability_index is None or self.reachability_index.compiled is not compiled:
+            self.reachability_index = ReachabilityIndex(compiled)
+        return self.reachability_index
+    
+
+    def station_reachable(self, start, target, time_limit):
+        '''
+        Function for determining if it's possible to reach a station from 
+        another station within a given time frame/movement limit, using the loaded network
+        instead of a connections file (see ReachabilityIndex).
+
+        Parameters: The start station's name as a string; the target station's name as a string;
+        and the maximum amount of timesteps allowed, as an int.
+
+        Returns: True if it's possible, otherwise False.
+
+        '''
+        if self.stats is None:
+            return self.reachability().reachable(start, target, time_limit)
+        started = self.stats.clock()
+        reachable = self.reachability().reachable(start, target, time_limit)
+        self.stats.add_route_queries(self.stats.clock() - started)
+        return reachable
+    
+
+    def station_reachability_checker_file_opener(self, file_name):
+        '''
+        Function for opening a connections file 
+        and returning a list of information (a list of tuples containing the pairs of station names)
+        for station_reachability_checker() to interprete.
+
+        Parameter: A connections file name as a string.
+        '''
+        with open(file_name, "r") as f:
+            return [tuple(line.strip().split(",")) for line in f]
+    
+
+    def station_reachability_checker(self, start, target, time_limit, connections):
+        '''
+        Function for determining if it's possible to reach a station from 
+        another station within a given time frame/movement limit.
+
+        Parameters: The start station's name as a string; the target station's name as a string;
+        the maximum amount of timesteps allowed, as an int; 
+        and a list of tuples that all contain a pair of connected stations.
+        
+        Returns: True if it's possible, otherwise False.
+        '''
+        # Creates a queue to store the stations to visit
+        queue = [(start, 1)] # Updates the time to 1
+        visited = set()
+        # While stations in queue
+        while queue:
+            # Gets next station and the time it took to reach it.
+            station, time = queue.pop(0)
+            # If target station is reached, return True.
+            if station == target:
+                return True
+            # If failed to reach target before time limit, continue.
+            if time > time_limit:
+                continue
+            # Adds station to visited list.
+            visited.add(station)
+            # Counts all non-visited connections of the current station to the queue.
+            for connection in connections:
+                if connection[0] == station and connection[1] not in visited:
+                    queue.append((connection[1], time + 1)) # Updates time by 1
+                elif connection[1] == station and connection[0] not in visited:
+                    queue.append((connection[0], time + 1)) # Updates time by 1
+        # Returns False if all possible stations have been visited without reaching target.
+        return False
+
+    
+    def answer_route_queries(self, queries_file, output_file, chunk_size=100000, jsonl=None):
+        '''
+        Function that answers a file of route info questions in bulk, and streams the answers to another file.
+
+        Parameters: The file names of the questions and answers files as strings
+        (or file objects); how many questions to answer at a time;
+        and whether the files are JSONL instead of CSV (by default, if the questions file name ends in ".jsonl").
+
+        The questions can either be a CSV file with a line for each question 
+        (start station, target station, time limit, separated by commas, with an optional header line),
+        or a JSONL file with a "start", "target" and "time_limit" object on each line.
+        The answers are written in the same format, with a "reachable" column/key (True or False) added.
+
+        Questions are read, looked up (see ReachabilityIndex.reachable_batch()) and written 
+        one chunk at a time, so memory stays bounded however long the file is.
+
+        Returns: The number of questions answered.
+
+        Warning: Needs the numpy module to work.
+
+        '''
+        import numpy as np
+        from itertools import repeat
+
+        index = self.reachability()
+        station_ids = dict(index.compiled.station_ids)
+        if jsonl is None:
+            jsonl = isinstance(queries_file, str) and queries_file.endswith(".jsonl")
+        answered = 0
+        with open_text(queries_file, "r") as queries, open_text(output_file, "w") as output:
+            for rows, start_names, target_names, time_limits in read_route_queries(queries, chunk_size, jsonl):
+                if self.stats is not None:
+                    started = self.stats.clock()
+                starts = np.fromiter(map(station_ids.get, start_names, repeat(-1)), dtype=np.int64, count=len(rows))
+                targets = np.fromiter(map(station_ids.get, target_names, repeat(-1)), dtype=np.int64, count=len(rows))
+                answers = index.reachable_batch(starts, targets, parse_time_limits(time_limits, answered))
+                # A station is always reachable from itself, even if it isn't in the network.
+                for i in np.flatnonzero(starts < 0):
+                    if start_names[i] == target_names[i]:
+                        answers[i] = True
+                if self.stats is not None and len(rows):
+                    self.stats.add_route_queries(self.stats.clock() - started, len(rows))
+                write_route_answers(output, rows, answers.tolist(), jsonl)
+                answered += len(rows)
+        return answered
+    
+
+    def get_start_line(self, station, train_id=None):
+        '''
+        Function for finding and returning a line/lines from a station.
+
+        Parameters: A Station object, and the ID number of the train the line is for
+        (used to pick it with the counter-based generator, if there is one, see use_counter_rng()).
+        
+        Returns: A (randomly choosen) line.
+
+        The function randomly chooses a line in case a station exists
+        on more than one line (such as the case for station C in Map 1),
+        so that you don't get multiple lines from the same station.
+
+        Warning: Needs the random module to work.
+
+        '''
+        compiled = self.compile()
+        matching_lines = compiled.lines_of(compiled.station_ids[station.name])
+
+        if self.counter_rng is not None and train_id is not None:
+            return self.lines[compiled.line_names[matching_lines[self.counter_rng.choice(train_id, 0, CounterRNG.LINE, len(matching_lines))]]]
+        return self.lines[compiled.line_names[random.choice(matching_lines)]]
+
+    
+    def generate_train_map(self, connections_file=None):
+        '''
+        Function for creating a map of rail network by plotting the trains, stations and lines.
+
+        Parameters: A connections file (by default, the connections loaded into the network).
+        
+        Output: Displays a map of the rail network.
+
+        Warning: Needs matplotlib.pyplot and networkx modules to work.
+
+        '''
+        import matplotlib.pyplot as plt
+        import networkx as nx
+        from matplotlib.colors import is_color_like
+
+        self.sync_trains()
+
+        # Reads the connections file.
+        if connections_file is None:
+            connections = self.connections
+        else:
+            with open(connections_file, "r") as f:
+                connections = [tuple(line.strip().split(',')) for line in f]
+
+        # Creates the graph and sets the positions of the nodes using the Fruchterman-Reingold algorithm
+        # (or reuses them, if this network has been drawn before).
+        G, position = network_layout(connections)
+
+        # Draws the nodes.
+        nx.draw_networkx_nodes(G, position, node_size=300, node_color="w")
+
+        # Draws the edges.
+        edge_colors = []
+        for _, _, attrs in G.edges(data=True):
+            if "line" in attrs and is_color_like(attrs["line"]):
+                edge_colors.append(attrs["line"])
+            else:
+                edge_colors.append("black") # Makes black the default color of the lines if the station's name isn't a color.
+        nx.draw_networkx_edges(G, position, edge_color=edge_colors, width=2, arrowsize=20, arrowstyle="-")
+
+        # Adds labels to the nodes.
+        nx.draw_networkx_labels(G, position, font_size=10, font_family="sans-serif")
+
+        # Adds the trains' IDs to the map (every station already keeps a set of its trains).
+        for station in self.stations.values():
+            if not station.trains:
+                continue
+            train_labels = sorted(train.train_id for train in station.trains)
+            x, y = position[station.name]
+            plt.text(x, y - 0.03, "\n".join(str(train_label) for train_label in train_labels), fontsize=8, ha="center", va="center", bbox=dict(facecolor="white", edgecolor="none", alpha=0.7))
+
+        # Sets the axis limits and removes them.
+        plt.axis("off")
+        plt.xlim(-1.2, 1.2)
+        plt.ylim(-1.2, 1.2)
+        plt.title("Rail Network Map")
+
+        # Shows the plot.
+        plt.show()
+
+
+
+    def train_map_base(self, connections_file=None, label_limit=300):
+        '''
+        Function that works out the parts of a map of the rail network that don't change as time passes:
+        where every station goes, and every connection in the colour of its line (black if the line's name isn't a colour).
+
+        Parameters: A connections file (by default, the connections loaded into the network),
+        and the maximum number of stations to draw in full detail.
+
+        Returns: A dictionary (see start_train_map()), which can be sent to other processes.
+
+        Warning: Needs the matplotlib, networkx and numpy modules to work.
+
+        '''
+        import numpy as np
+        from matplotlib.colors import is_color_like
+
+        # Reads the connections file.
+        if connections_file is None:
+            connections = self.connections
+        else:
+            with open(connections_file, "r") as f:
+                connections = [tuple(line.strip().split(',')) for line in f]
+        _, position = network_layout(connections)
+
+        names = self.compile().station_names
+        placed = np.array([name in position for name in names], dtype=bool) # Stations on no line aren't on the map.
+        xy = np.array([position.get(name, (np.nan, np.nan)) for name in names], dtype=float).reshape(-1, 2)
+        colors = {}
+        segments = np.array([(position[source], position[target]) for source, target, _, _ in connections], dtype=float).reshape(-1, 2, 2)
+        edge_colors = [colors.setdefault(line_name, line_name if is_color_like(line_name) else "black")
+                       for _, _, line_name, _ in connections]
+        return {"names": names, "xy": xy, "placed": placed, "segments": segments, "edge_colors": edge_colors,
+                "small": len(names) <= label_limit, "label_limit": label_limit}
+    
+
+    def train_map_labels(self, base, counts, busiest=20, train_id_limit=3):
+        '''
+        Function that works out the train labels of a map: the trains' IDs (or how many there are) on the busiest stations
+        (on every occupied station of a map in full detail).
+
+        Parameters: The map's base (see train_map_base()); the number of trains at every station (see station_occupancy());
+        the number of stations to label on bigger maps; and the maximum number of train IDs to list on a station.
+
+        Returns: A list of (station ID, text) pairs.
+
+        Warning: Needs the numpy module to work.
+
+        '''
+        import numpy as np
+
+        occupied = np.flatnonzero((counts > 0) & base["placed"])
+        labelled = occupied[np.argsort(-counts[occupied], kind="stable")[:base["label_limit"] if base["small"] else busiest]]
+        listed = labelled[counts[labelled] <= train_id_limit]
+        ids = {}
+        if len(listed):
+            # Finds the trains on the listed stations (without creating Train objects for the array engine).
+            if self.train_arrays is not None:
+                station_ids = self.train_arrays.station_ids()
+                train_ids = self.train_arrays.train_ids
+            else:
+                compiled = self.compile()
+                station_ids = np.fromiter((compiled.station_ids[train.station.name] for train in self.trains.values()),
+                                          dtype=np.int64, count=len(self.trains))
+                train_ids = np.fromiter(self.trains, dtype=np.int64, count=len(self.trains))
+            rows = np.flatnonzero(np.isin(station_ids, listed))
+            ids = {i: train_ids[rows[station_ids[rows] == i]] for i in listed.tolist()}
+        return [(i, "\n".join(str(train_id) for train_id in ids[i]) if i in ids else f"{counts[i]} trains") for i in labelled.tolist()]
+    
+
+    def render_train_map(self, output, connections_file=None, label_limit=300, busiest=20, train_id_limit=3, dpi=150):
+        '''
+        Function that renders the map of the rail network straight to an image file (PNG, SVG, PDF, etc.
+        by its extension) without a display, so it also works on servers and for very large networks.
+
+        Stations and connections are each drawn as one batched collection instead of one artist per station.
+        Maps of at most label_limit stations look like generate_train_map(), with station names and train labels.
+        Bigger maps are drawn at a lower level of detail: the trains are one scatter coloured by how many trains
+        each station has, and only the busiest stations get a label. A train label lists the train IDs, or
+        the number of trains when there are more than train_id_limit of them.
+
+        Parameters: The image file name or file object; a connections file (by default, the connections loaded
+        into the network); the maximum number of stations to draw in full detail; the number of stations to label
+        on bigger maps; the maximum number of train IDs to list on a station; and the resolution of raster images.
+
+        Output: Saves the map to the file.
+
+        Warning: Needs the matplotlib, networkx and numpy modules to work.
+
+        '''
+        base = self.train_map_base(connections_file, label_limit)
+        # Counts the trains on each station (without creating Train objects for the array engine).
+        counts = self.station_occupancy()
+        labels = self.train_map_labels(base, counts, busiest, train_id_limit)
+        occupied = counts[(counts > 0) & base["placed"]]
+        limits = (occupied.min(), occupied.max()) if len(occupied) else None
+        figure, axes = start_train_map(base, limits)
+        draw_train_frame(base, axes, counts, labels, limits)
+        axes.set_title(f"Rail Network Map (time {self.tick}, {self.train_count()} trains)")
+        figure.savefig(output, dpi=dpi, bbox_inches="tight")
+    
+
+    VIDEO_FORMATS = (".mp4", ".webm", ".mkv", ".mov", ".avi")
+
+
+    def export_animation(self, output, ticks, every=1, workers=None, fps=10, dpi=100, connections_file=None,
+                         label_limit=300, busiest=20, train_id_limit=3):
+        '''
+        Function that simulates some time units and renders the map after every few of them as the frames of an animation,
+        like render_train_map() but without drawing the parts that don't change again for every frame.
+
+        The time units are simulated first, keeping only what the frames show (the number of trains at every station
+        and the train labels), then the frames are rendered by a pool of worker processes, each of which draws
+        the layout, connections and stations once and only adds and removes the trains of every frame it renders.
+        The colours of a big map's occupied stations go up to the most trains any station has in any frame,
+        so they mean the same in every frame.
+
+        Parameters: A directory to save the PNG frames to, or a .gif file (assembled with Pillow), or a video file
+        (.mp4, .webm, .mkv, .mov or .avi, encoded with ffmpeg, which has to be installed);
+        the number of time units to simulate; the number of time units between frames; the number of worker processes
+        (every CPU core if None, and 1 renders in this process); the frames per second of a GIF or video;
+        the resolution of the frames; and the rest as for render_train_map().
+
+        Returns: The number of frames.
+
+        Warning: Needs the matplotlib, networkx and numpy modules (and Pillow for a GIF) to work.
+
+        '''
+        import shutil
+        import subprocess
+        import tempfile
+        from concurrent.futures import ProcessPoolExecutor
+
+        global _animation_state
+
+        if every < 1:
+            raise ValueError("There has to be at least 1 time unit between frames")
+        extension = os.path.splitext(str(output))[1].lower()
+        ffmpeg = None
+        if extension in self.VIDEO_FORMATS:
+            # Checked first, so no time is spent rendering frames that can't be encoded.
+            ffmpeg = shutil.which("ffmpeg")
+            if ffmpeg is None:
+                raise ValueError(f"Saving a {extension} animation needs ffmpeg, save a .gif or a directory of PNG frames instead")
+
+        base = self.train_map_base(connections_file, label_limit)
+        frames = []
+        for frame in range(ticks // every + 1):
+            if frame:
+                self.advance_ticks(every)
+            counts = self.station_occupancy()
+            frames.append((f"Rail Network Map (time {self.tick}, {self.train_count()} trains)", counts,
+                           self.train_map_labels(base, counts, busiest, train_id_limit)))
+        limits = None
+        if not base["small"]:
+            limits = (1, max(1, max(int(counts[base["placed"]].max(initial=0)) for _, counts, _ in frames)))
+
+        encoded = extension == ".gif" or ffmpeg is not None
+        temporary = tempfile.TemporaryDirectory() if encoded else None
+        directory = temporary.name if encoded else output
+        os.makedirs(directory, exist_ok=True)
+        files = [os.path.join(directory, f"frame-{frame:06d}.png") for frame in range(len(frames))]
+        try:
+            workers = min(workers or os.cpu_count() or 1, len(frames))
+            if workers > 1:
+                with ProcessPoolExecutor(workers, initializer=init_animation_worker, initargs=(base, limits, dpi)) as pool:
+                    list(pool.map(render_animation_frame, files, *zip(*frames), chunksize=max(1, len(frames) // (workers * 4))))
+            else:
+                init_animation_worker(base, limits, dpi)
+                for file, frame in zip(files, frames):
+                    render_animation_frame(file, *frame)
+                _animation_state = None
+
+            if extension == ".gif":
+                from PIL import Image
+
+                # The frames are read one at a time while the GIF is written.
+                with Image.open(files[0]) as first:
+                    first.save(output, save_all=True, append_images=(Image.open(file) for file in files[1:]),
+                               duration=1000 / fps, loop=0)
+            elif ffmpeg is not None:
+                subprocess.run([ffmpeg, "-y", "-loglevel", "error", "-framerate", str(fps), "-i", os.path.join(directory, "frame-%06d.png"),
+                                "-pix_fmt", "yuv420p", str(output)], check=True)
+        finally:
+            if temporary is not None:
+                temporary.cleanup()
+        return len(frames)
+
+
+    def simulate(self):
+        '''
+        Function that initiates the train simulation. 
+
+        Continue simulation [1]: Simulates one time unit in the simulation.
+        Trains move from one station to the next according to their direction (unless delayed), 
+        when they reach an end of a line, they switch direction.
+        
+        Train info [2]: Shows information about each train in the simulation.
+
+        Route info [3]: Determines if it's possible to reach a station from another station 
+        within the given time frame.
+
+        Show rail network map [4]: Shows a map of the entire network, along with all the trains and what station they're on.
+
+        Statistics [5]: Shows where the time goes in each time unit, how many trains moved, got delayed and
+        switched direction, and how long route info takes (the statistics are collected from when it's first selected).
+
+        '''
+        input_prompt = "Continue simulation [1], train info [2], route info [3], show rail network map [4], statistics [5], exit [q].\nSelect an option: "
+        # Main simulation loop.
+        while True:
+            # Makes input case insensitive, and allows spaces and dots, for less strict inputs.
+            choice = input(input_prompt).lower().replace(" ","").replace(".","")
+            # Input checkpoint
+            while not choice == "1" and choice != "2" and not choice == "3" and choice != "4" and not choice == "5" and choice != "q":
                 print("\nInvalid input.\n")
                 choice = input(input_prompt).lower().replace(" ","").replace(".","") # New input if invalid
             if choice == "1": # Continue simulation [1]
                 self.advance_time()
                 print("\n", end="")
             elif choice == "2": # Train info [2]
+                num_trains = self.train_count()
                 train_id = (input("Which train [1 - {}]: ".format(num_trains)))
                 while True:
                     # Input checkpoint
@@ -430,7 +4418,7 @@ class RailNetwork:
                     else:
                         break # Input checkpoint clear
                 train_id = int(train_id)
-                train = self.trains[train_id]
+                train = self.get_train(train_id)
                 print(train)
             elif choice == "3": # Route info [3]
                 start_station_for_info = input("Select a start station: ")
@@ -441,72 +4429,1323 @@ class RailNetwork:
                     print("\nInvalid input. Input a valid integer.\n")
                     timesteps_for_info = input("Select timesteps: ")
                 timesteps_for_info = int(timesteps_for_info) # Input checkpoint clear
-                connections = self.station_reachability_checker_file_opener(connections_file) # Opens the connections file.
                 # Checks and prints if the stations can be reached in time.
-                if self.station_reachability_checker(start_station_for_info, end_station_for_info, timesteps_for_info, connections) == True:
+                if self.station_reachable(start_station_for_info, end_station_for_info, timesteps_for_info):
                     print(f"\nStation {end_station_for_info} is reachable from station {start_station_for_info} within {timesteps_for_info} timesteps.\n")
-                if self.station_reachability_checker(start_station_for_info, end_station_for_info, timesteps_for_info, connections) == False:
+                else:
                     print(f"\nStation {end_station_for_info} is not reachable from station {start_station_for_info} within {timesteps_for_info} timesteps.\n")
             elif choice == "4":
                 #print(f"Stations: {self.stations}")
                 #print(f"Lines: {self.lines}")
                 #print(f"Trains: {self.trains}")
-                self.generate_train_map(connections_file)
+                self.generate_train_map()
+            elif choice == "5": # Statistics [5]
+                if self.stats is None:
+                    self.enable_stats()
+                    print("\nStatistics are now being collected, continue the simulation and select [5] again to see them.\n")
+                else:
+                    print(f"\n{self.stats}\n")
             elif choice == "q": # Exits the program [q]
                 print("Thank you and goodbye!")
                 break
     
     
-    def advance_time(self):
+    def advance_time(self):
+        '''
+        Function that simulates the passage of time in the simulation. 
+
+        Trains move from one station to the next according to their direction (unless delayed), 
+        when they reach an end of a line, they switch direction.
+        
+        If a train gets delayed, it will stay in its station, and will gain a delay status of True,
+        which is visible on the train information for the train.
+
+        True delay statuses get reset when time advances again, 
+        but will be regained if the train gets delayed again.
+
+        Features two Dev features which can be uncommented for those that want them.
+
+        Uses the array, event or parallel engine instead if one has been selected (see set_engine()),
+        and updates the occupancy index and publishes a snapshot if they're on (see finish_tick()).
+
+        '''
+        self.tick += 1
+        stats = self.stats
+        if self.engine == "array":
+            self.advance_time_array()
+            self.finish_tick()
+            return
+        if self.engine == "event":
+            self.advance_time_event()
+            self.finish_tick()
+            return
+        if self.engine == "parallel":
+            self.advance_time_parallel()
+            self.finish_tick()
+            return
+        compiled = self.compile()
+        event_log = self.event_log
+        if stats is not None:
+            # Times each phase from one checkpoint (lap) to the next.
+            clock = stats.clock
+            spent = dict.fromkeys(SimulationStats.PHASES, 0.0)
+            reversals = 0
+            started = lap = clock()
+        draws = None
+        if self.counter_rng is not None:
+            # One draw per train by ID number, so it doesn't depend on the order of the trains (like TrainArrays.step()).
+            draws = dict(zip(self.trains, self.counter_rng.uniform(list(self.trains), self.tick, CounterRNG.DELAY).tolist()))
+        for train_id, train in self.trains.items():
+            train.train_delayed = False # Resets delay status to False
+            current_station = train.station
+            current_line = train.line
+            line_id = compiled.line_ids[current_line.name]
+            current_index = compiled.position(line_id, compiled.station_ids[current_station.name])
+            direction = train.direction
+
+            # Switches direction if an end station is reached.
+            if current_index == 0:
+                    train.direction = "South"
+            if current_index == compiled.line_lengths[line_id] - 1:
+                    train.direction = "North"
+            if stats is not None:
+                reversals += train.direction != direction
+                now = clock()
+                spent["lookup"] += now - lap
+                lap = now
+            if event_log is not None:
+                station_id = compiled.station_ids[current_station.name]
+                heading = TrainArrays.NORTH if train.direction == "North" else TrainArrays.SOUTH
+                if train.direction != direction:
+                    event_log.record(self.tick, EventLog.REVERSAL, train_id, station_id, line_id, heading)
+                if stats is not None:
+                    now = clock()
+                    spent["output"] += now - lap
+                    lap = now
+
+            # Simulates delay at current station
+            delayed = (random.uniform(0, 1) if draws is None else draws[train_id]) < current_station.delay_probability
+            if stats is not None:
+                now = clock()
+                spent["delay"] += now - lap
+                lap = now
+            if delayed:
+                # (Dev feature) Uncomment below to see delays as they happen.
+                #print(f"Train {train_id} is delayed at station {current_station.name}")
+                train.train_delayed = True
+                if event_log is not None:
+                    event_log.record(self.tick, EventLog.DELAY, train_id, station_id, line_id, heading)
+                    if stats is not None:
+                        now = clock()
+                        spent["output"] += now - lap
+                        lap = now
+            else:
+                # Find next station for the train.
+                if train.direction == "North":  
+                    next_index = current_index - 1
+                else:
+                    next_index = current_index + 1
+                
+                # Gets name of the next station and assigns it.
+                # (Wraps around like a list index would, for lines with a single station.)
+                next_index %= compiled.line_lengths[line_id]
+                next_station_name = compiled.station_names[compiled.station_at(line_id, next_index)]
+                next_station = current_line.get_station(next_station_name)
+
+                # Moves the train by removing it from current station
+                # and placing it on the next station.
+                train.station.remove_train(train)
+                next_station.add_train(train)
+                train.station = next_station
+                if stats is not None:
+                    now = clock()
+                    spent["move"] += now - lap
+                    lap = now
+                if event_log is not None:
+                    event_log.record(self.tick, EventLog.DEPARTURE, train_id, station_id, line_id, heading)
+                    event_log.record(self.tick, EventLog.ARRIVAL, train_id, compiled.station_ids[next_station_name], line_id, heading)
+                    if stats is not None:
+                        now = clock()
+                        spent["output"] += now - lap
+                        lap = now
+                # (Dev feature) Uncomment below to simultaneously see where each train went.
+                #print(f"Train {train_id} arrived at station {next_station.name}")
+        if stats is not None:
+            delayed_count = self.delayed_count()
+            stats.add_tick(clock() - started, spent, len(self.trains) - delayed_count, delayed_count, reversals)
+        self.finish_tick()
+    
+
+    def advance_time_array(self):
+        '''
+        Function that simulates the passage of time with the array engine.
+        Follows the same rules as advance_time(), but advances all trains at once
+        and only updates the Train objects when they are asked for.
+
+        The random generator is seeded from the random module the first time,
+        so random.seed() makes both engines reproducible
+        (a counter-based generator is used instead if there is one, see use_counter_rng()).
+
+        Warning: Needs the numpy module to work.
+
+        '''
+        import numpy as np
+
+        if self.train_arrays is None:
+            self.train_arrays = TrainArrays.from_trains(self)
+        if self.counter_rng is not None:
+            generator = self.counter_rng
+        else:
+            if self.generator is None:
+                self.generator = np.random.default_rng(random.getrandbits(64))
+            generator = self.generator
+        arrays = self.train_arrays
+        stats = self.stats
+        if self.event_log is None and stats is None:
+            arrays.step(generator, None, self.tick)
+            return
+        spent = None
+        if stats is not None:
+            spent = dict.fromkeys(SimulationStats.PHASES, 0.0)
+            started = stats.clock()
+        stations = arrays.station_ids() if self.event_log is not None else None
+        direction = arrays.direction.copy()
+        arrays.step(generator, spent, self.tick)
+        reversals = np.flatnonzero(arrays.direction != direction)
+        if self.event_log is not None:
+            # Records the events of the time unit, one kind at a time.
+            log = self.event_log
+            if stats is not None:
+                lap = stats.clock()
+            delayed = np.flatnonzero(arrays.delayed)
+            moved = np.flatnonzero(~arrays.delayed)
+            for kind, rows, station_ids in ((EventLog.REVERSAL, reversals, stations), (EventLog.DELAY, delayed, stations),
+                                            (EventLog.DEPARTURE, moved, stations), (EventLog.ARRIVAL, moved, arrays.station_ids())):
+                log.record_batch(self.tick, kind, arrays.train_ids[rows], station_ids[rows], arrays.line[rows], arrays.direction[rows])
+            if stats is not None:
+                spent["output"] += stats.clock() - lap
+        if stats is not None:
+            delayed_count = int(np.count_nonzero(arrays.delayed))
+            stats.add_tick(stats.clock() - started, spent, len(arrays) - delayed_count, delayed_count, len(reversals))
+
+
+    def advance_ticks(self, ticks):
+        '''
+        Function that simulates several time units at once. The event engine jumps straight
+        to the end and the parallel engine's workers step every time unit without waiting for each other
+        (unless an event log is open, a replay or position history is being recorded, or the parallel engine has delay statistics to collect),
+        the other engines call advance_time() for each.
+
+        Parameter: The number of time units.
+
+        '''
+        if self.engine not in ("event", "parallel") or self.event_log is not None or self.recorder is not None or \
+                self.history is not None or self.engine == "parallel" and self.delays is not None:
+            for _ in range(ticks):
+                self.advance_time()
+            return
+        if ticks > 0:
+            self.tick += ticks
+            if self.engine == "event":
+                self.advance_time_event(ticks)
+            else:
+                self.advance_time_parallel(ticks)
+            self.finish_tick()
+    
+
+    def advance_time_event(self, ticks=1):
+        '''
+        Function that simulates the passage of time with the event engine.
+        Follows the same rules as advance_time(), but instead of drawing a delay for every train
+        in every time unit, each train's stay at a station is drawn once when it arrives
+        and only the trains that depart are moved (see DepartureQueue).
+
+        Uses the random module, so random.seed() makes it reproducible,
+        and advancing several time units at once gives the same result as one at a time.
+        With a counter-based generator (see use_counter_rng()) each stay is drawn from the train's ID number
+        and arrival time unit instead, which is reproducible too, but as a stay is one draw instead of one per time unit,
+        the trajectories aren't the same as the other engines'.
+
+        Parameter: The number of time units that self.tick has been advanced by (1 unless called by advance_ticks()).
+
+        Warning: Needs the numpy module to work.
+
+        '''
+        import numpy as np
+
+        if self.train_arrays is None:
+            self.train_arrays = TrainArrays.from_trains(self)
+        if self.departures is None or self.departures.arrays is not self.train_arrays:
+            self.departures = DepartureQueue(self.train_arrays, self.tick - ticks, rng=self.counter_rng)
+        arrays = self.train_arrays
+        departures = self.departures
+        departures.rng = self.counter_rng
+        if self.delays is None:
+            departures.spells = None
+        elif departures.spells is None:
+            departures.spells = []
+        stats = self.stats
+        log = self.event_log
+        if stats is not None:
+            spent = dict.fromkeys(SimulationStats.PHASES, 0.0)
+            started = lap = stats.clock()
+        stations = arrays.station_ids() if log is not None else None
+        moved, turned = departures.advance(self.tick)
+        if stats is not None:
+            now = stats.clock()
+            spent["move"] += now - lap
+            lap = now
+        waited = departures.refresh(self.tick)
+        if stats is not None:
+            now = stats.clock()
+            spent["lookup"] += now - lap
+            lap = now
+        if log is not None:
+            # Records the events of the time unit, one kind at a time (like advance_time_array()).
+            moved = np.array(moved, dtype=np.int64)
+            reversals = np.concatenate([np.array(turned, dtype=np.int64), waited])
+            delayed = np.flatnonzero(arrays.delayed)
+            for kind, rows, station_ids in ((EventLog.REVERSAL, reversals, stations), (EventLog.DELAY, delayed, stations),
+                                            (EventLog.DEPARTURE, moved, stations), (EventLog.ARRIVAL, moved, arrays.station_ids())):
+                log.record_batch(self.tick, kind, arrays.train_ids[rows], station_ids[rows], arrays.line[rows], arrays.direction[rows])
+            if stats is not None:
+                spent["output"] += stats.clock() - lap
+        if stats is not None:
+            # Every train either moved or got delayed in every time unit.
+            stats.add_tick(stats.clock() - started, spent, len(moved), len(arrays) * ticks - len(moved),
+                           len(turned) + len(waited), ticks)
+
+
+    def advance_time_parallel(self, ticks=1):
+        '''
+        Function that simulates the passage of time with the parallel engine.
+        Follows the same rules as advance_time(), but the lines are split into partitions
+        that worker processes step at the same time in shared memory (see ParallelStepper),
+        and the station occupancy is reconciled from their counts afterwards.
+
+        Every partition has its own random generator, seeded from the random module the first time,
+        so random.seed() makes it reproducible for the same number of workers
+        (with a counter-based generator, see use_counter_rng(), it's the same for any number of workers).
+        The phase times in the statistics are added up over the workers.
+
+        Parameter: The number of time units that self.tick has been advanced by (1 unless called by advance_ticks()).
+
+        Warning: Needs the numpy module to work.
+
+        '''
+        import numpy as np
+
+        if self.parallel is None or self.parallel.arrays is not self.train_arrays:
+            self.close_parallel()
+            arrays = self.train_arrays if self.train_arrays is not None else TrainArrays.from_trains(self)
+            resume = self.parallel_resume or {}
+            self.parallel = ParallelStepper(self, arrays, self.workers, random.getrandbits(64), resume.get("partition_lines"), resume.get("states"))
+            self.parallel_resume = None
+            self.departures = None
+            self.train_arrays = self.parallel.arrays
+        arrays = self.train_arrays
+        stats = self.stats
+        log = self.event_log
+        if stats is not None:
+            started = stats.clock()
+        if log is not None:
+            stations = arrays.station_ids()
+            direction = arrays.direction.copy()
+        moved, delayed, reversals, spent = self.parallel.step(ticks, stats is not None, self.tick - ticks + 1, self.counter_rng)
+        if log is not None:
+            # Records the events of the time unit, one kind at a time (like advance_time_array()).
+            if stats is not None:
+                lap = stats.clock()
+            turned = np.flatnonzero(arrays.direction != direction)
+            rows_delayed = np.flatnonzero(arrays.delayed)
+            rows_moved = np.flatnonzero(~arrays.delayed)
+            for kind, rows, station_ids in ((EventLog.REVERSAL, turned, stations), (EventLog.DELAY, rows_delayed, stations),
+                                            (EventLog.DEPARTURE, rows_moved, stations), (EventLog.ARRIVAL, rows_moved, arrays.station_ids())):
+                log.record_batch(self.tick, kind, arrays.train_ids[rows], station_ids[rows], arrays.line[rows], arrays.direction[rows])
+            if stats is not None:
+                spent["output"] += stats.clock() - lap
+        if stats is not None:
+            stats.add_tick(stats.clock() - started, spent, moved, delayed, reversals, ticks)
+
+
+def run_headless(stations_file, connections_file, num_trains, ticks, seed=None, engine="array", output=None, tick_log=None,
+                 event_log=None, event_format="jsonl", map_file=None, stats=False, workers=None, delay_stats=False,
+                 counter_rng=False, replay=None, history=None):
+    '''
+    Function that runs a whole simulation at full speed without any prompts, for batch jobs and benchmarks.
+
+    Parameters: The stations and connections file names; the number of trains; the number of time units;
+    the seed for the random module (random if None); the engine (one of RailNetwork.ENGINES);
+    a file name or file object to save the final state and summary to as JSON (optional);
+    a file name or file object to write one JSON line per time unit to (optional,
+    with the time unit and the number of trains delayed in it);
+    a file name to record every train event to, with its format (optional, see EventLog);
+    an image file to render the final map to (optional, see RailNetwork.render_train_map());
+    whether to add the SimulationStats snapshot to the summary as "stats";
+    the number of worker processes of the parallel engine (every CPU core if None);
+    whether to add the delay statistics of every station and line to the summary as "delays" (see RailNetwork.delay_summary());
+    and whether to draw every random number from a counter-based generator keyed by the seed,
+    so that every engine gives the same result (see RailNetwork.use_counter_rng());
+    a file name to record the run to, so it can be replayed from any time unit (optional, see RailNetwork.record_replay());
+    and a directory to record every train's station and delayed status after every time unit to (optional, see RailNetwork.record_history()).
+
+    Returns: The RailNetwork and a summary dictionary (also saved to output).
+
+    '''
+    import json
+    import time
+
+    random.seed(seed)
+    network = RailNetwork(engine, workers)
+    if counter_rng:
+        network.use_counter_rng(seed if seed is not None else random.getrandbits(64))
+    network.load_stations(stations_file)
+    network.load_connections(connections_file)
+    network.add_random_trains(num_trains)
+    if event_log is not None:
+        network.open_event_log(event_log, event_format)
+    if stats:
+        network.enable_stats()
+    if delay_stats:
+        network.enable_delay_stats()
+    if replay is not None:
+        network.record_replay(replay)
+    if history is not None:
+        network.record_history(history)
+
+    start = time.perf_counter()
+    if tick_log is None:
+        network.advance_ticks(ticks)
+    else:
+        with open_text(tick_log, "w") as log:
+            for _ in range(ticks):
+                network.advance_time()
+                log.write(json.dumps({"tick": network.tick, "delayed_trains": network.delayed_count()}) + "\n")
+    network.close_event_log()
+    network.close_replay()
+    network.close_history()
+    elapsed = time.perf_counter() - start
+
+    summary = {"stations_file": stations_file, "connections_file": connections_file, "seed": seed, "engine": engine,
+               "counter_seed": network.counter_rng.seed if network.counter_rng is not None else None,
+               "elapsed_seconds": elapsed, "ticks_per_second": ticks / elapsed if elapsed else None}
+    summary.update(network.summary())
+    if stats:
+        summary["stats"] = network.stats.snapshot()
+    if delay_stats:
+        summary["delays"] = network.delay_summary()
+    if output is not None:
+        with open_text(output, "w") as f:
+            json.dump({"summary": summary, "final_state": network.train_states()}, f)
+            f.write("\n")
+    if map_file is not None:
+        network.render_train_map(map_file)
+    return network, summary
+
+
+def train_memory_budget(stations_file, connections_file, num_trains=100000):
+    '''
+    Function that measures how much memory each train takes in a network, with Train objects
+    (including their places in the network's and stations' dictionaries) and in the array engine.
+
+    Parameters: The stations and connections file names, and the number of trains to measure with.
+
+    Returns: A dictionary with the bytes per train of both 
+    (which is also the number of megabytes a fleet of a million trains takes).
+
+    Warning: Needs the tracemalloc module to work.
+
+    '''
+    import tracemalloc
+
+    network = RailNetwork()
+    network.load_stations(stations_file)
+    network.load_connections(connections_file)
+    network.compile()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        network.add_random_trains(num_trains)
+        objects = tracemalloc.get_traced_memory()[0] - before
+        before = tracemalloc.get_traced_memory()[0]
+        arrays = TrainArrays.from_trains(network)
+        array_bytes = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del arrays
+    return {"trains": num_trains, "object_bytes_per_train": objects / num_trains, "array_bytes_per_train": array_bytes / num_trains}
+
+
+_replication_network = None # The network a replication worker process runs its replications on.
+
+
+def init_replication_worker(network):
+    '''
+    Function that gives a replication worker process the network to run replications on,
+    so that it's only sent to each worker once.
+
+    Parameter: A RailNetwork.
+
+    '''
+    global _replication_network
+    _replication_network = network
+
+
+def replicate(num_trains, ticks, seed_sequence, network=None):
+    '''
+    Function that runs one independent simulation with the array engine and counts what happened in it.
+
+    Parameters: The number of trains; the number of time units to simulate;
+    a numpy SeedSequence for the run's random generator;
+    and the RailNetwork (by default, the one given to init_replication_worker()).
+
+    Returns: A dictionary of arrays: delays at each station and on each line,
+    train visits to each station (time units spent there, summed over the trains), 
+    and the number of trains at each station at the end.
+
+    Warning: Needs the numpy module to work.
+
+    '''
+    import numpy as np
+
+    network = network or _replication_network
+    compiled = network.compile()
+    generator = np.random.default_rng(seed_sequence)
+    arrays = TrainArrays.random_fleet(network, num_trains, generator)
+    station_count = len(compiled.station_names)
+    station_delays = np.zeros(station_count, dtype=np.int64)
+    line_delays = np.zeros(len(compiled.line_names), dtype=np.int64)
+    station_visits = np.zeros(station_count, dtype=np.int64)
+    for _ in range(ticks):
+        # Counts where the trains are when the time unit starts (where their delay is drawn).
+        station_visits += np.bincount(arrays.station_ids(), minlength=station_count)
+        arrays.step(generator)
+        # Delayed trains stay where they were delayed.
+        station_delays += np.bincount(arrays.station_ids()[arrays.delayed], minlength=station_count)
+        line_delays += np.bincount(arrays.line[arrays.delayed], minlength=len(compiled.line_names))
+    return {"station_delays": station_delays, "line_delays": line_delays, "station_visits": station_visits,
+            "final_trains": np.bincount(arrays.station_ids(), minlength=station_count)}
+
+
+def merge_replications(network, results):
+    '''
+    Function that merges the results of replicate() into one summary of means and standard deviations over the runs.
+
+    Parameters: A RailNetwork and a list of replicate() results.
+
+    Returns: A dictionary that can be saved as JSON.
+
+    Warning: Needs the numpy module to work.
+
+    '''
+    import numpy as np
+
+    compiled = network.compile()
+    merged = {key: np.stack([result[key] for result in results]) for key in results[0]}
+    total_delays = merged["station_delays"].sum(axis=1)
+    visits = merged["station_visits"].sum(axis=0)
+    observed = merged["station_delays"].sum(axis=0) / np.maximum(visits, 1)
+    stations = {}
+    for i, name in enumerate(compiled.station_names):
+        stations[name] = {
+            "delay_probability": network.stations[name].delay_probability,
+            "observed_delay_rate": float(observed[i]),
+            "delays_mean": float(merged["station_delays"][:, i].mean()),
+            "delays_std": float(merged["station_delays"][:, i].std()),
+            "visits_mean": float(merged["station_visits"][:, i].mean()),
+            "final_trains_mean": float(merged["final_trains"][:, i].mean()),
+        }
+    lines = {name: {"delays_mean": float(merged["line_delays"][:, i].mean()), 
+                    "delays_std": float(merged["line_delays"][:, i].std())}
+             for i, name in enumerate(compiled.line_names)}
+    return {"runs": len(results), "delays_mean": float(total_delays.mean()), "delays_std": float(total_delays.std()),
+            "stations": stations, "lines": lines}
+
+
+_parallel_state = None # The shared train arrays a parallel engine worker process steps (see init_parallel_worker()).
+
+
+def init_parallel_worker(compiled, position_delay, blocks):
+    '''
+    Function that attaches a parallel engine worker process to the shared memory train arrays,
+    so that the topology is only sent to each worker once.
+
+    Parameters: The CompiledNetwork; the delay probability of every line position;
+    and a dictionary of attribute name -> (shared memory name, dtype, length) for every shared array.
+
+    Warning: Needs the numpy module to work.
+
+    '''
+    import numpy as np
+    from multiprocessing import shared_memory
+
+    global _parallel_state
+    memory = {name: shared_memory.SharedMemory(name=block) for name, (block, _, _) in blocks.items()}
+    views = {name: np.ndarray(length, dtype=dtype, buffer=memory[name].buf) for name, (_, dtype, length) in blocks.items()}
+    _parallel_state = (compiled, position_delay, views, memory)
+
+
+def step_partition(partition, start, stop, ticks, state, timed=False, tick=None, rng=None):
+    '''
+    Function that advances one partition of a parallel engine (the trains start:stop, which run on lines
+    no other partition has) by some time units in place in the shared arrays, and counts its trains on each station.
+
+    Parameters: The partition's number; its first and last + 1 train; the number of time units;
+    the state of its random generator; whether to time the phases and count the trains;
+    and the first time unit with a CounterRNG to draw from instead of the generator (optional).
+
+    Returns: (the new generator state, the trains moved, delayed and reversed, and the time spent in each phase).
+
+    Warning: Needs the numpy module to work.
+
+    '''
+    import numpy as np
+
+    compiled, position_delay, views, _ = _parallel_state
+    part = TrainArrays.from_tables(compiled, position_delay, views["train_ids"][start:stop], views["line"][start:stop],
+                                   views["position"][start:stop], views["direction"][start:stop], views["delayed"][start:stop])
+    generator = np.random.default_rng()
+    generator.bit_generator.state = state
+    spent = dict.fromkeys(SimulationStats.PHASES, 0.0) if timed else None
+    moved = delayed = reversals = 0
+    for k in range(ticks):
+        if timed:
+            direction = part.direction.copy()
+        if rng is not None:
+            part.step(rng, spent, tick + k)
+        else:
+            part.step(generator, spent)
+        if timed:
+            delayed += int(np.count_nonzero(part.delayed))
+            moved += len(part) - int(np.count_nonzero(part.delayed))
+            reversals += int(np.count_nonzero(part.direction != direction))
+    # step() makes new position and delayed arrays, so they're copied back into the shared ones.
+    views["position"][start:stop] = part.position
+    views["delayed"][start:stop] = part.delayed
+    # This partition's share of the station occupancy, reconciled by ParallelStepper.occupancy().
+    views["occupancy"][partition * len(compiled.station_names):(partition + 1) * len(compiled.station_names)] = \
+        np.bincount(part.station_ids(), minlength=len(compiled.station_names))
+    return generator.bit_generator.state, moved, delayed, reversals, spent
+
+
+def release_parallel(pool, memory):
+    '''
+    Function that shuts down a parallel engine's worker processes and frees its shared memory.
+
+    Parameters: The ProcessPoolExecutor (or None), and a list of SharedMemory objects.
+
+    '''
+    if pool is not None:
+        pool.shutdown()
+    for block in memory:
+        try:
+            block.close()
+        except BufferError:
+            pass # Arrays still point into it, it's freed when they're gone.
+        try:
+            block.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class ParallelStepper:
+    '''
+    The ParallelStepper class is the state of the parallel engine (see RailNetwork.advance_time_parallel()).
+
+    Trains never leave their line, so the lines are split into partitions with about the same number
+    of trains each, and every partition is stepped by a worker process at the same time. The train arrays live in
+    shared memory (grouped by partition), so the workers step them in place and nothing is copied between processes
+    but the random generator states. Afterwards the partitions' station counts are reconciled into one occupancy.
+
+    Attributes:
+
+    arrays: The TrainArrays in shared memory, with the trains of each partition next to each other.
+    partition_lines: The line IDs of every partition.
+    partitions: The (first, last + 1) train of every partition.
+    states: The random generator state of every partition.
+
+    Warning: Needs the numpy module to work.
+
+    '''
+    SHARED = ("train_ids", "line", "position", "direction", "delayed")
+
+
+    def __init__(self, network, arrays, workers=None, seed=None, partition_lines=None, states=None):
+        '''
+        Function that initializes the ParallelStepper object: partitions the lines, copies the train arrays into
+        shared memory and starts the worker processes.
+
+        Parameters: A RailNetwork; its TrainArrays; the number of worker processes (every CPU core if None,
+        and 1 steps the partitions in this process instead); the seed of the partitions' random generators;
+        and optionally the partition lines and generator states of a saved ParallelStepper (see RailNetwork.save_checkpoint()).
+
+        '''
+        import numpy as np
+        import weakref
+        from concurrent.futures import ProcessPoolExecutor
+        from multiprocessing import shared_memory
+
+        compiled = arrays.compiled
+        if partition_lines is None:
+            workers = workers or os.cpu_count() or 1
+            # Gives the line with the most trains to the partition with the fewest so far (longest processing time first).
+            trains_per_line = np.bincount(arrays.line, minlength=len(compiled.line_names))
+            partition_lines = [[] for _ in range(min(workers, len(compiled.line_names)) or 1)]
+            load = [0] * len(partition_lines)
+            for line_id in np.argsort(-trains_per_line, kind="stable").tolist():
+                smallest = load.index(min(load))
+                partition_lines[smallest].append(line_id)
+                load[smallest] += int(trains_per_line[line_id])
+        self.partition_lines = partition_lines
+        workers = min(workers or os.cpu_count() or 1, len(partition_lines))
+
+        partition_of_line = np.zeros(len(compiled.line_names), dtype=np.int64)
+        for partition, lines in enumerate(partition_lines):
+            partition_of_line[lines] = partition
+        order = np.argsort(partition_of_line[arrays.line], kind="stable")
+        ends = np.searchsorted(partition_of_line[arrays.line][order], np.arange(len(partition_lines) + 1))
+        self.partitions = list(zip(ends[:-1].tolist(), ends[1:].tolist()))
+
+        # Copies the arrays (in partition order) into shared memory, plus one row of station counts per partition.
+        self.memory = []
+        blocks = {}
+        views = {}
+        sources = {name: getattr(arrays, name)[order] for name in self.SHARED}
+        sources["occupancy"] = np.zeros(len(partition_lines) * len(compiled.station_names), dtype=np.int64)
+        for name, source in sources.items():
+            block = shared_memory.SharedMemory(create=True, size=max(source.nbytes, 1))
+            self.memory.append(block)
+            views[name] = np.ndarray(len(source), dtype=source.dtype, buffer=block.buf)
+            views[name][:] = source
+            blocks[name] = (block.name, source.dtype.str, len(source))
+        self.arrays = TrainArrays(network, *(views[name] for name in self.SHARED))
+        self.counts = views["occupancy"].reshape(len(partition_lines), len(compiled.station_names))
+        station_ids = self.arrays.station_ids()
+        for partition, (start, stop) in enumerate(self.partitions):
+            self.counts[partition] = np.bincount(station_ids[start:stop], minlength=len(compiled.station_names))
+
+        if states is None:
+            states = [np.random.default_rng(child).bit_generator.state for child in np.random.SeedSequence(seed).spawn(len(partition_lines))]
+        self.states = states
+        if workers > 1:
+            self.pool = ProcessPoolExecutor(workers, initializer=init_parallel_worker,
+                                            initargs=(compiled, self.arrays.position_delay, blocks))
+        else:
+            self.pool = None
+            self.state = (compiled, self.arrays.position_delay, views, None)
+        self.finalizer = weakref.finalize(self, release_parallel, self.pool, self.memory)
+    
+
+    def step(self, ticks=1, timed=False, tick=None, rng=None):
+        '''
+        Function that advances every partition by some time units at the same time, and waits for all of them.
+
+        Parameters: The number of time units; whether to time the phases and count the trains;
+        and the first time unit with a CounterRNG to draw from instead of the partitions' generators (optional).
+
+        Returns: (the trains moved, delayed and reversed, and the time spent in each phase, added up over the partitions).
+
+        '''
+        global _parallel_state
+
+        if self.pool is None:
+            _parallel_state = self.state
+            results = [step_partition(i, start, stop, ticks, state, timed, tick, rng)
+                       for i, ((start, stop), state) in enumerate(zip(self.partitions, self.states))]
+        else:
+            futures = [self.pool.submit(step_partition, i, start, stop, ticks, state, timed, tick, rng)
+                       for i, ((start, stop), state) in enumerate(zip(self.partitions, self.states))]
+            results = [future.result() for future in futures]
+        self.states = [result[0] for result in results]
+        spent = dict.fromkeys(SimulationStats.PHASES, 0.0)
+        if timed:
+            for result in results:
+                for phase, seconds in result[4].items():
+                    spent[phase] += seconds
+        return sum(result[1] for result in results), sum(result[2] for result in results), sum(result[3] for result in results), spent
+    
+
+    def occupancy(self):
         '''
-        Function that simulates the passage of time in the simulation. 
+        Function that reconciles the station counts of the partitions after a step.
 
-        Trains move from one station to the next according to their direction (unless delayed), 
-        when they reach an end of a line, they switch direction.
-        
-        If a train gets delayed, it will stay in its station, and will gain a delay status of True,
-        which is visible on the train information for the train.
+        Returns: The number of trains at every station, as an array (by station ID).
 
-        True delay statuses get reset when time advances again, 
-        but will be regained if the train gets delayed again.
+        '''
+        return self.counts.sum(axis=0)
+    
 
-        Features two Dev features which can be uncommented for those that want them.
+    def close(self):
+        '''
+        Function that stops the worker processes and moves the train arrays out of shared memory,
+        so the network keeps working with another engine.
 
         '''
-        for train_id, train in self.trains.items():
-            train.train_delayed = False # Resets delay status to False
-            current_station = train.station
-            current_line = train.line
-            current_index = list(current_line.stations.keys()).index(current_station.name)
+        for name in self.SHARED:
+            setattr(self.arrays, name, getattr(self.arrays, name).copy())
+        self.counts = self.counts.copy()
+        self.state = None
+        self.finalizer()
 
-            # Switches direction if an end station is reached.
-            if current_index == 0:
-                    train.direction = "South"
-            if current_index == len(list(current_line.stations.keys())) - 1:
-                    train.direction = "North"
 
-            if random.uniform(0, 1) < current_station.delay_probability: # Simulates delay at current station
-                # (Dev feature) Uncomment below to see delays as they happen.
-                #print(f"Train {train_id} is delayed at station {current_station.name}")
-                train.train_delayed = True
-            else:
-                # Find next station for the train.
-                if train.direction == "North":  
-                    next_index = current_index - 1
-                else:
-                    next_index = current_index + 1
-                
-                # Gets name of the next station and assigns it.
-                next_station_name = list(current_line.stations.keys())[next_index]
-                next_station = current_line.get_station(next_station_name)
+def run_replications(network, num_trains, ticks, runs, seed=None, workers=None):
+    '''
+    Function that runs many independent simulations (Monte Carlo replications) of the network 
+    across several processes, and merges their results.
 
-                # Moves the train by removing it from current station
-                # and placing it on the next station.
-                train.station.remove_train(train)
-                next_station.add_train(train)
-                train.station = next_station
-                # (Dev feature) Uncomment below to simultaneously see where each train went.
-                #print(f"Train {train_id} arrived at station {next_station.name}")
+    Every run gets its own seed derived from the given seed, so the results
+    are the same for the same seed however many workers are used.
+
+    Parameters: A loaded RailNetwork; the number of trains; the number of time units per run;
+    the number of runs; the seed (random if None); and the number of worker processes
+    (all CPU cores if None, or 1 to run in this process).
+
+    Returns: The merge_replications() summary, with the settings added.
+
+    Warning: Needs the numpy module to work.
+
+    '''
+    import os
+    import numpy as np
+    from concurrent.futures import ProcessPoolExecutor
+
+    network.compile() # Compiled once here, and sent to the workers with the network.
+    seed_sequence = np.random.SeedSequence(seed)
+    seeds = seed_sequence.spawn(runs)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        results = [replicate(num_trains, ticks, run_seed, network) for run_seed in seeds]
+    else:
+        with ProcessPoolExecutor(min(workers, runs), initializer=init_replication_worker, initargs=(network,)) as pool:
+            results = list(pool.map(replicate, [num_trains] * runs, [ticks] * runs, seeds))
+    summary = merge_replications(network, results)
+    summary.update({"trains": num_trains, "ticks": ticks, "seed": seed_sequence.entropy})
+    return summary
+
+
+def open_text(file, mode):
+    '''
+    Function for opening a text file by name, or passing on an already open file object
+    (such as sys.stdin) without closing it afterwards.
+
+    Parameters: A file name or file object, and the mode to open it in.
+
+    '''
+    from contextlib import nullcontext
+
+    if isinstance(file, str):
+        return open(file, mode, newline="" if mode == "w" else None)
+    return nullcontext(file)
+
+
+def read_route_queries(queries, chunk_size, jsonl=False):
+    '''
+    Function that reads route info questions from a CSV or JSONL file, a chunk at a time.
+
+    Parameters: An open file; the number of questions per chunk;
+    and whether the file is JSONL instead of CSV.
+
+    Yields: (rows, starts, targets, time limits) for each chunk, where rows are the
+    CSV lines (without line endings) or JSONL objects, and the rest are lists of strings.
+
+    '''
+    import json
+    from itertools import islice
+
+    first = True
+    while True:
+        lines = list(islice(queries, chunk_size))
+        if not lines:
+            return
+        if jsonl:
+            rows = [json.loads(line) for line in lines if line.strip()]
+            columns = [[str(row[key]) for row in rows] for key in ("start", "target", "time_limit")]
+        else:
+            # Splits the whole chunk at once instead of line by line.
+            rows = "".join(lines).replace("\r", "").split("\n")
+            if "" in rows:
+                rows = [row for row in rows if row]
+            fields = ",".join(rows).split(",")
+            if len(fields) != 3 * len(rows):
+                for row in rows:
+                    if row.count(",") != 2:
+                        raise ValueError(f"A question doesn't have exactly a start station, target station and time limit: {row!r}")
+            columns = [fields[0::3], fields[1::3], fields[2::3]]
+            # Skips the header line of a CSV file.
+            if first and rows and not int_check(columns[2][0]):
+                rows = rows[1:]
+                columns = [column[1:] for column in columns]
+        first = False
+        if rows:
+            yield rows, columns[0], columns[1], columns[2]
+
+
+def parse_time_limits(values, first_row):
+    '''
+    Function that converts a chunk of time limits to an integer array.
+
+    Parameters: The time limits as strings, and how many questions came before the chunk
+    (so that errors can point out the question).
+
+    Raises a ValueError naming the first question with a time limit that isn't an integer.
+
+    Warning: Needs the numpy module to work.
+
+    '''
+    import numpy as np
+
+    try:
+        return np.fromiter(map(int, values), dtype=np.int64, count=len(values))
+    except ValueError:
+        for i, value in enumerate(values):
+            if not int_check(value):
+                raise ValueError(f"Question {first_row + i + 1} has a time limit that isn't an integer: {value!r}")
+        raise
+
+
+def write_route_answers(output, rows, answers, jsonl=False):
+    '''
+    Function that writes a chunk of route info answers, in the same format the questions were in.
+
+    Parameters: An open file; the question rows from read_route_queries(); 
+    their answers (True or False); and whether to write JSONL instead of CSV.
+
+    '''
+    import json
+
+    if jsonl:
+        for row, answer in zip(rows, answers):
+            row["reachable"] = answer
+        output.writelines(json.dumps(row) + "\n" for row in rows)
+    else:
+        endings = (",False\n", ",True\n")
+        output.writelines(map(str.__add__, rows, map(endings.__getitem__, answers)))
+
+
+class SimulationServer:
+    '''
+    The SimulationServer class runs a simulation as a long-lived local service instead of the input() loop of simulate().
+
+    Clients send one JSON object per line over TCP or a UNIX socket, such as {"id": 1, "op": "route", "start": "A",
+    "target": "B", "time_limit": 3}, and get one JSON object per line back in the same order,
+    {"id": 1, "result": true} (or {"id": 1, "error": "..."}). The operations are:
+
+    advance: Simulates "ticks" time units (1 if not given), returns the time unit.
+    train: Returns the state of the train "train_id" (see RailNetwork.train_state()).
+    route: Returns whether "target" can be reached from "start" within "time_limit" time units.
+    station: Returns the IDs of the trains at the station "station".
+    delayed: Returns the IDs of the delayed trains, on the line "line" if it's given.
+    busiest: Returns the "count" (10 if not given) stations with the most trains, as [name, trains] pairs.
+    stats: Returns the SimulationStats snapshot (null if they're off).
+    status: Returns the time unit, the number of trains and delayed trains, and whether time is running.
+    pause, resume: Stops and starts the background task.
+
+    Everything runs on one event loop and a time unit is never interrupted by a query,
+    so every answer sees the state between two time units. Route info comes from the network's ReachabilityIndex,
+    and the station and delay questions from its OccupancyIndex, which are built when the server starts,
+    so no files are read and no pass over every train is made while it runs.
+
+    Attributes:
+
+    network: The RailNetwork being simulated.
+    interval: Seconds between the time units the background task simulates (None to only advance when asked to).
+    running: Whether the background task is simulating.
+
+    Warning: Needs the asyncio and json modules to work.
+
+    '''
+
+    def __init__(self, network, interval=None):
+        '''
+        Function that initializes the SimulationServer object.
+
+        Parameters: A RailNetwork, and the seconds between the background task's time units (None for no background task).
+
+        '''
+        self.network = network
+        self.interval = interval
+        self.running = interval is not None
+        self.task = None
+        self.operations = {"advance": self.advance, "train": self.train, "route": self.route, "station": self.station,
+                           "delayed": self.delayed, "busiest": self.busiest, "stats": self.stats,
+                           "status": self.status, "pause": self.pause, "resume": self.resume}
+        # Built now instead of during the first query.
+        network.reachability()
+        network.occupancy_index()
+    
+
+    def advance(self, request):
+        '''
+        Function that simulates the time units a client asks for.
+
+        Parameter: The request, with the number of time units as "ticks" (optional, 1 by default).
+
+        Returns: The time unit.
+
+        '''
+        ticks = request.get("ticks", 1)
+        if not isinstance(ticks, int) or ticks < 0:
+            raise ValueError("ticks has to be a whole number of at least 0")
+        self.network.advance_ticks(ticks)
+        return self.network.tick
+    
+
+    def train(self, request):
+        '''
+        Function that returns the state of the train with the ID number "train_id".
+
+        '''
+        try:
+            return self.network.train_state(request.get("train_id"))
+        except (KeyError, TypeError):
+            raise ValueError(f"There is no train {request.get('train_id')!r}") from None
+    
+
+    def route(self, request):
+        '''
+        Function that answers a route info question with the keys "start", "target" and "time_limit".
+
+        Returns: True if "target" can be reached in time, otherwise False.
+
+        '''
+        if not isinstance(request.get("time_limit"), int):
+            raise ValueError("time_limit has to be a whole number")
+        return self.network.station_reachable(str(request.get("start")), str(request.get("target")), request["time_limit"])
+    
+
+    def station(self, request):
+        '''
+        Function that returns the IDs of the trains at the station "station".
+
+        '''
+        try:
+            return self.network.trains_at(request.get("station"))
+        except (KeyError, TypeError):
+            raise ValueError(f"There is no station {request.get('station')!r}") from None
+    
+
+    def delayed(self, request):
+        '''
+        Function that returns the IDs of the delayed trains, on the line "line" if it's given.
+
+        '''
+        try:
+            return self.network.delayed_trains(request.get("line"))
+        except (KeyError, TypeError):
+            raise ValueError(f"There is no line {request.get('line')!r}") from None
+    
+
+    def busiest(self, request):
+        '''
+        Function that returns the "count" stations with the most trains (10 if not given).
+
+        '''
+        count = request.get("count", 10)
+        if not isinstance(count, int):
+            raise ValueError("count has to be a whole number")
+        return self.network.busiest_stations(count)
+    
+
+    def stats(self, request):
+        '''
+        Function that returns the network's statistics, or None if they're off.
+
+        '''
+        return self.network.stats.snapshot() if self.network.stats is not None else None
+    
+
+    def status(self, request):
+        '''
+        Function that returns the time unit, the number of trains and delayed trains, and whether time is running.
+
+        '''
+        return {"tick": self.network.tick, "trains": self.network.train_count(),
+                "delayed_trains": self.network.delayed_count(), "running": self.running}
+    
+
+    def pause(self, request):
+        '''
+        Function that stops the background task from simulating.
+
+        '''
+        self.running = False
+        return self.status(request)
+    
+
+    def resume(self, request):
+        '''
+        Function that lets the background task simulate again (if the server has an interval).
+
+        '''
+        self.running = self.interval is not None
+        return self.status(request)
+    
+
+    def answer(self, line):
+        '''
+        Function that answers one request line.
+
+        Parameter: The line, as bytes.
+
+        Returns: The answer's JSON line, as bytes.
+
+        '''
+        import json
+
+        request = {}
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                request = {}
+                raise ValueError("A request has to be a JSON object")
+            operation = self.operations.get(request.get("op"))
+            if operation is None:
+                raise ValueError(f"Unknown op {request.get('op')!r}, choose one of {', '.join(self.operations)}")
+            answer = {"id": request.get("id"), "result": operation(request)}
+        except ValueError as error: # Also catches invalid JSON (json.JSONDecodeError is a ValueError).
+            answer = {"id": request.get("id"), "error": str(error)}
+        return (json.dumps(answer) + "\n").encode()
+    
+
+    async def client(self, reader, writer):
+        '''
+        Function that answers one client's requests until it disconnects.
+
+        Parameters: The client's asyncio StreamReader and StreamWriter.
+
+        '''
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    writer.write(self.answer(line))
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+    
+
+    async def step(self):
+        '''
+        Function that simulates a time unit every interval while the server is running (the background task).
+
+        '''
+        import asyncio
+
+        while True:
+            await asyncio.sleep(self.interval)
+            if self.running:
+                self.network.advance_time()
+    
+
+    async def start(self, host="127.0.0.1", port=0, path=None):
+        '''
+        Function that starts listening for clients, and starts the background task if there is an interval.
+
+        Parameters: The host and port to listen on (0 picks a free port), or the path of a UNIX socket to listen on instead.
+
+        Returns: The asyncio Server (its sockets tell the port).
+
+        '''
+        import asyncio
+
+        if path is not None:
+            server = await asyncio.start_unix_server(self.client, path)
+        else:
+            server = await asyncio.start_server(self.client, host, port)
+        if self.interval is not None and self.task is None: # One background task, however many sockets it listens on.
+            self.task = asyncio.create_task(self.step())
+        return server
+    
+
+    async def serve(self, host="127.0.0.1", port=0, path=None, started=None):
+        '''
+        Function that runs the server until it's cancelled (see start()).
+
+        Parameters: As for start(), and optionally a function that is called with the asyncio Server once it listens.
+
+        '''
+        server = await self.start(host, port, path)
+        if started is not None:
+            started(server)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if self.task is not None:
+                self.task.cancel()
+                self.task = None
+
+
+def command_line(arguments):
+    '''
+    Function that runs the program from the command line without any prompts,
+    for example: "python trains.py routes stations.txt connections.txt questions.csv -o answers.csv".
+
+    Commands:
+
+    run: Runs a whole simulation without prompts and saves the final state and summary as JSON (see run_headless()).
+    routes: Answers a file of route info questions in bulk (see RailNetwork.answer_route_queries()).
+    memory: Measures how much memory each train takes (see train_memory_budget()).
+    replicate: Runs many independent simulations in parallel and saves a summary as JSON (see run_replications()).
+    replay: Prints the state of every train at a time unit of a recorded run (see Replay).
+    animate: Renders the map over a range of time units as PNG frames, a GIF or a video (see RailNetwork.export_animation()).
+    serve: Runs a simulation as a local service that answers JSON line requests (see SimulationServer).
+
+    Parameter: The command line arguments (without the program name).
+
+    Returns: The exit code.
+
+    '''
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="trains.py", description="Rail network simulator. Run without arguments for the interactive program.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="run a simulation without prompts and save its final state and summary")
+    run.add_argument("stations_file")
+    run.add_argument("connections_file")
+    run.add_argument("--trains", type=int, required=True, help="number of trains")
+    run.add_argument("--ticks", type=int, required=True, help="time units to simulate")
+    run.add_argument("--seed", type=int, help="seed for a reproducible run")
+    run.add_argument("--engine", choices=RailNetwork.ENGINES, default="array", help="simulation engine (default: array)")
+    run.add_argument("-o", "--output", help="final state and summary JSON file (default: print only the summary)")
+    run.add_argument("--tick-log", help="JSON lines file with the delays of every time unit (optional)")
+    run.add_argument("--events", help="file to record every departure, arrival, delay and reversal to (optional)")
+    run.add_argument("--events-format", choices=("jsonl", "binary"), default="jsonl", help="event file format (default: jsonl)")
+    run.add_argument("--map", help="image file (.png, .svg, ...) to render the final map to (optional)")
+    run.add_argument("--stats", action="store_true", help="add per-phase timings and counters to the summary")
+    run.add_argument("--workers", type=int, help="worker processes of the parallel engine (default: one per CPU core)")
+    run.add_argument("--delay-stats", action="store_true", help="add delay and dwell time statistics of every station and line to the summary")
+    run.add_argument("--counter-rng", action="store_true", help="draw from a counter-based generator keyed by the seed, train and time unit, "
+                                                               "so every engine and number of workers gives the same result")
+    run.add_argument("--replay", help="file to record the run to, to replay it from any time unit with the replay command (optional)")
+    run.add_argument("--history", help="directory to record every train's station and delayed status to as memory-mapped .npy files (optional)")
+
+    routes = commands.add_parser("routes", help="answer a CSV or JSONL file of (start, target, time_limit) route questions")
+    routes.add_argument("stations_file")
+    routes.add_argument("connections_file")
+    routes.add_argument("queries_file", help="CSV, or JSONL if it ends in .jsonl, or - for standard input")
+    routes.add_argument("-o", "--output", default="-", help="answers file (default: standard output)")
+    routes.add_argument("--jsonl", action="store_true", default=None, help="read and write JSONL (the default for .jsonl files)")
+    routes.add_argument("--chunk-size", type=int, default=100000, help="questions answered at a time")
+
+    replications = commands.add_parser("replicate", help="run independent simulations on every CPU core and summarize their delays")
+    replications.add_argument("stations_file")
+    replications.add_argument("connections_file")
+    replications.add_argument("--trains", type=int, required=True, help="number of trains")
+    replications.add_argument("--ticks", type=int, required=True, help="time units per run")
+    replications.add_argument("--runs", type=int, default=100, help="number of runs (default: 100)")
+    replications.add_argument("--seed", type=int, help="seed for reproducible runs")
+    replications.add_argument("--workers", type=int, help="worker processes (default: one per CPU core)")
+    replications.add_argument("-o", "--output", default="-", help="summary JSON file (default: standard output)")
+
+    memory = commands.add_parser("memory", help="measure the memory each train takes with Train objects and in the array engine")
+    memory.add_argument("stations_file")
+    memory.add_argument("connections_file")
+    memory.add_argument("--trains", type=int, default=100000, help="trains to measure with (default: 100000)")
+
+    replay = commands.add_parser("replay", help="print the state of every train at a time unit of a run recorded with run --replay")
+    replay.add_argument("replay_file")
+    replay.add_argument("--tick", type=int, help="time unit (default: the last one recorded)")
+    replay.add_argument("-o", "--output", default="-", help="JSON file (default: standard output)")
+
+    animate = commands.add_parser("animate", help="render the map over a range of time units as PNG frames, a GIF or a video")
+    animate.add_argument("stations_file")
+    animate.add_argument("connections_file")
+    animate.add_argument("--trains", type=int, required=True, help="number of trains")
+    animate.add_argument("--ticks", type=int, required=True, help="time units to simulate")
+    animate.add_argument("--every", type=int, default=1, help="time units between frames (default: 1)")
+    animate.add_argument("--seed", type=int, help="seed for a reproducible run")
+    animate.add_argument("--engine", choices=RailNetwork.ENGINES, default="array", help="simulation engine (default: array)")
+    animate.add_argument("--workers", type=int, help="processes rendering frames (default: one per CPU core)")
+    animate.add_argument("--fps", type=float, default=10, help="frames per second of a GIF or video (default: 10)")
+    animate.add_argument("--dpi", type=int, default=100, help="resolution of the frames (default: 100, 1000 x 1000 pixels)")
+    animate.add_argument("-o", "--output", required=True, help="directory for PNG frames, a .gif file, or a video file (.mp4 etc., needs ffmpeg)")
+
+    serve = commands.add_parser("serve", help="run a simulation as a local JSON lines service over TCP or a UNIX socket")
+    serve.add_argument("stations_file")
+    serve.add_argument("connections_file")
+    serve.add_argument("--trains", type=int, default=0, help="number of trains (default: 0)")
+    serve.add_argument("--seed", type=int, help="seed for a reproducible run")
+    serve.add_argument("--engine", choices=RailNetwork.ENGINES, default="array", help="simulation engine (default: array)")
+    serve.add_argument("--workers", type=int, help="worker processes of the parallel engine (default: one per CPU core)")
+    serve.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+    serve.add_argument("--port", type=int, default=8765, help="TCP port to listen on (default: 8765)")
+    serve.add_argument("--socket", help="UNIX socket path to listen on instead of TCP")
+    serve.add_argument("--interval", type=float, help="seconds between time units simulated in the background (default: only when asked to)")
+    serve.add_argument("--stats", action="store_true", help="collect statistics for the stats request")
+    serve.add_argument("--counter-rng", action="store_true", help="draw from a counter-based generator keyed by the seed, train and time unit")
+
+    args = parser.parse_args(arguments)
+    if args.command == "run":
+        import json
+
+        _, summary = run_headless(args.stations_file, args.connections_file, args.trains, args.ticks,
+                                  args.seed, args.engine, args.output, args.tick_log, args.events, args.events_format, args.map, args.stats, args.workers,
+                                  args.delay_stats, args.counter_rng, args.replay, args.history)
+        if args.output is None:
+            json.dump(summary, sys.stdout, indent=2)
+            print()
+    elif args.command == "routes":
+        network = RailNetwork()
+        network.load_stations(args.stations_file)
+        network.load_connections(args.connections_file)
+        queries_file = sys.stdin if args.queries_file == "-" else args.queries_file
+        output_file = sys.stdout if args.output == "-" else args.output
+        network.answer_route_queries(queries_file, output_file, args.chunk_size, args.jsonl)
+    elif args.command == "memory":
+        import json
+
+        json.dump(train_memory_budget(args.stations_file, args.connections_file, args.trains), sys.stdout, indent=2)
+        print()
+    elif args.command == "replicate":
+        import json
+
+        network = RailNetwork()
+        network.load_stations(args.stations_file)
+        network.load_connections(args.connections_file)
+        summary = run_replications(network, args.trains, args.ticks, args.runs, args.seed, args.workers)
+        with open_text(sys.stdout if args.output == "-" else args.output, "w") as output:
+            json.dump(summary, output, indent=2)
+            output.write("\n")
+    elif args.command == "replay":
+        import json
+
+        recording = Replay(args.replay_file)
+        snapshot = recording.seek(args.tick if args.tick is not None else recording.last_tick)
+        with open_text(sys.stdout if args.output == "-" else args.output, "w") as output:
+            json.dump({"tick": snapshot.tick, "trains": [snapshot.train_state(train_id) for train_id in snapshot.train_ids.tolist()]}, output)
+            output.write("\n")
+    elif args.command == "animate":
+        network, _ = run_headless(args.stations_file, args.connections_file, args.trains, 0, args.seed, args.engine)
+        frames = network.export_animation(args.output, args.ticks, args.every, args.workers, args.fps, args.dpi)
+        network.close_parallel()
+        print(f"Rendered {frames} frames to {args.output}", file=sys.stderr)
+    elif args.command == "serve":
+        import asyncio
+
+        random.seed(args.seed)
+        network = RailNetwork(args.engine, args.workers)
+        if args.counter_rng:
+            network.use_counter_rng(args.seed if args.seed is not None else random.getrandbits(64))
+        network.load_stations(args.stations_file)
+        network.load_connections(args.connections_file)
+        network.add_random_trains(args.trains)
+        if args.stats:
+            network.enable_stats()
+        server = SimulationServer(network, args.interval)
+        address = args.socket or f"{args.host}:{args.port}"
+        try:
+            asyncio.run(server.serve(args.host, args.port, args.socket, lambda _: print(f"Serving on {address}", file=sys.stderr)))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            network.close_parallel()
+    return 0
 
 
 def file_existance_checker(filename):
@@ -618,34 +5857,39 @@ def connections_file_check(filename):
 
 # The program initiates here.
 if  __name__ == "__main__":
+    # Runs a command instead of the interactive program if there are command line arguments (see command_line()).
+    if len(sys.argv) > 1:
+        sys.exit(command_line(sys.argv[1:]))
     network = RailNetwork()
     # (Dev feature) Uncomment the 2 below/comment the other 2 file inputs to skip file names inputs. Note that this would mean that the files won't be checked for errors.
     #stations_file = ("stations.txt")
     #connections_file = ("connections.txt")
     stations_file = (input("Enter name of stations file: "))
-    # Valid file checkpoint for the stations file.
-    while not file_existance_checker(stations_file) or not stations_file_check(stations_file):
-        if not file_existance_checker(stations_file): # Checks if the station file exists.
+    # Valid file checkpoint for the stations file, which is loaded into RailNetwork while it's checked.
+    while True:
+        try:
+            network.load_stations(stations_file)
+            break
+        except FileNotFoundError: # Checks if the station file exists.
             print("This file does not exist.")
-            stations_file = input("Enter name of stations file: ")
-            continue
-        if not stations_file_check(stations_file): # Checks if the station file can be interpreted.
-            print("This file cannot be interpreted.")
-            stations_file = input("Enter name of stations file: ")
-            continue
+        except OSError: # Checks if the station file can be opened.
+            print("This file cannot be opened.")
+        except NetworkFileError as error: # Checks if the station file can be interpreted.
+            print(f"This file cannot be interpreted.\n{error}")
+        stations_file = input("Enter name of stations file: ")
     connections_file = (input("Enter name of connections file: "))
-    # Valid file checkpoint for the connections file.
-    while not file_existance_checker(connections_file) or not connections_file_check(connections_file):
-        if not file_existance_checker(connections_file): # Checks if the connections file exists.
+    # Valid file checkpoint for the connections file, which is loaded into RailNetwork while it's checked.
+    while True:
+        try:
+            network.load_connections(connections_file)
+            break
+        except FileNotFoundError: # Checks if the connections file exists.
             print("This file does not exist.")
-            connections_file = input("Enter name of connections file: ")
-            continue
-        if not connections_file_check(connections_file): # Checks if the connections file can be interpreted.
-            print("This file cannot be interpreted.")
-            connections_file = input("Enter name of connections file: ")
-            continue
-    network.load_stations(stations_file) # Loads information from the stations file into RailNetwork
-    network.load_connections(connections_file) # Loads info from connections file into RailNetwork
+        except OSError: # Checks if the connections file can be opened.
+            print("This file cannot be opened.")
+        except NetworkFileError as error: # Checks if the connections file can be interpreted.
+            print(f"This file cannot be interpreted.\n{error}")
+        connections_file = input("Enter name of connections file: ")
     num_trains = (input("Enter number of trains: ")).lower().replace(" ","")
     # Train number input checkpoint
     while True:
@@ -670,22 +5914,6 @@ if  __name__ == "__main__":
             break
     print("\n", end="")
     # Populates the rail network with trains 
-    for i in range(num_trains):
-        # Assigns a station for each train by random.
-        station_name = random.choice([key for key in network.stations.keys()])
-        # Assigns a direction for each train by random.
-        direction = random.choice(["North","South"])
-
-        station = network.stations[station_name]
-        # Finds a line to assign to each train
-        # This is to prevent issues with stations that exist on more than 1 line
-        line = network.get_start_line(station)
-
-        # Creates the Train object
-        train = Train(station, direction, line, i+1, False)
-
-        # Adds the train and its ID to the network. 
-        network.add_train(train, i+1)
-        station.add_train(train)
+    network.add_random_trains(num_trains)
 
     network.simulate()
\ No newline at end of file